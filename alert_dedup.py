@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+alert_dedup.py
+
+O(1) duplicate filter for Pushy alerts, shared by missile_alerts_app.py and
+mqttest.py.
+
+Pushy delivers with QoS 1, so the same alert can arrive more than once (and
+the broker re-delivers the backlog after a reconnect). Keys are kept in an
+insertion-ordered hash map and evicted by age (TTL) first and by capacity
+second, so a duplicate is still caught during a storm as long as it arrives
+within the TTL.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+def alert_key(msg_payload):
+    """
+    Returns the dedup key of a Pushy payload.
+
+    `alertTitle` is a per-alert UUID and is preferred; older payloads only
+    carry the numeric `id`, which is combined with `msgId` (the title id).
+    """
+    key = (msg_payload.get("alertTitle") or "").strip()
+    if key:
+        return key
+    aid = str(msg_payload.get("id") or "").strip()
+    if not aid:
+        return ""
+    msg_id = str(msg_payload.get("msgId") or "").strip()
+    return f"{aid}:{msg_id}" if msg_id else aid
+
+
+class DedupCache:
+    """Thread-safe, hash-indexed seen-set with capacity and TTL eviction."""
+
+    def __init__(self, capacity=10000, ttl_s=3600, clock=time.monotonic):
+        self.capacity = int(capacity)
+        self.ttl_s = float(ttl_s)
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> first-seen time, oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # dropped because the cache was full
+        self.expirations = 0  # dropped because they outlived ttl_s
+
+    def seen(self, key):
+        """
+        Atomically checks and records `key`.
+        Returns True if it was already seen (a duplicate), False otherwise.
+        """
+        now = self._clock()
+        with self._lock:
+            self._expire(now)
+            if key in self._entries:
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._entries[key] = now
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return False
+
+    def _expire(self, now):
+        entries = self._entries
+        deadline = now - self.ttl_s
+        while entries:
+            key, ts = next(iter(entries.items()))
+            if ts > deadline:
+                break
+            del entries[key]
+            self.expirations += 1
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire(self._clock())
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for monitoring."""
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,513 @@
+# -*- coding: utf-8 -*-
+"""
+alert_engine.py
+
+asyncio engine behind the standalone script (mqttest.py).
+
+One event loop runs what used to need a thread each: the Pushy MQTT listener
+and the Home Assistant publisher (both Paho clients driven by the loop, see
+loop_io.py), the alert pipeline worker, the coalescing HA publish window,
+alert expiry timers, the /metrics endpoint and the periodic stats / journal
+compaction. Since all alert state is touched from the loop thread only, it
+needs no lock; it stays copy-on-write so a snapshot can be compacted off the
+loop.
+
+Calls that only exist in blocking form in our dependencies - DNS + TCP/TLS
+connect, the Pushy REST calls (requests), HTTP source polls - are awaited on
+one small fixed executor instead of starting a thread per call. State journal
+appends and compactions go, in order, to a single writer thread: the loop
+never waits on a journal write or fsync, and a compaction can never be
+ordered before an append it does not contain.
+
+Back-pressure: when the pipeline queue reaches `backpressure_high` the engine
+stops reading the Pushy socket; undelivered alerts wait in the kernel buffer
+and on the broker (QoS 1, persistent session) instead of piling up in memory
+or being dropped, and reading resumes at `backpressure_low`. Queue depth, and
+with it the receive-to-publish latency, stays bounded under a burst.
+
+Configuration parsing and the pipeline stages are shared with
+missile_alerts_app.py (see alert_processor.py); this module adds the
+script-only keys (storage_dir, ha_mqtt_*, backpressure_*), see _load_config.
+"""
+
+import os
+import ssl
+import json
+import time
+import random
+import signal
+import asyncio
+import contextlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+from pushy_client import PushyClient
+from subscriptions import SubscriptionReconciler
+from storage import Storage
+from state_journal import StateJournal
+from reconnect import ReconnectController
+from metrics import MetricsRegistry, AGE_BUCKETS, LATENCY_BUCKETS
+from log_sink import CaptureSink
+from ha_discovery import OFFLINE
+from alert_sources import HttpPollSource, SourceMerger, PUSHY
+from alert_processor import AlertProcessor
+from loop_io import (LoopMqtt, LoopHAPublisher, LoopPublishScheduler, LoopExpiryScheduler, LoopAlertPipeline,
+                     start_metrics_server)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATS_INTERVAL_S = 30  # Stats logging, metrics topic and journal compaction
+
+
+class AlertEngine(AlertProcessor):
+    def __init__(self, config=None, *, loop=None, logger=None):
+        """Builds every component; no network I/O happens before run() / start()."""
+        self.config = config or {}
+        self.logger = logger or logging.getLogger("missile_alerts")
+        self.loop = loop or asyncio.new_event_loop()
+        self._load_config()
+        self._init_state()
+
+    def _load_config(self):
+        """Shared keys (see alert_processor.py), then the script-only ones."""
+        self._load_common_config(BASE_DIR, os.path.expanduser(self.config.get("storage_dir", "missile_alerts")))
+        self.PAHO_DEBUG = self.config.get("paho_debug", False)  # Paho's per-packet logging (very chatty)
+        # Stop reading the Pushy socket at this queue depth, resume at the low mark
+        self.BACKPRESSURE_HIGH = self.config.get("backpressure_high", 1000)
+        self.BACKPRESSURE_LOW = self.config.get("backpressure_low", 100)
+
+        # --- Home Assistant MQTT ---
+        self.HA_MQTT_HOST = self.config.get("ha_mqtt_host", "")
+        self.HA_MQTT_PORT = self.config.get("ha_mqtt_port", 1883)
+        self.HA_MQTT_USER = self.config.get("ha_mqtt_user", "")
+        self.HA_MQTT_PASS = self.config.get("ha_mqtt_pass", "")
+        self.HA_MAX_QUEUE = self.config.get("ha_max_queue", 1000)  # Kept while disconnected; oldest dropped
+
+    def _init_state(self):
+        logger = self.logger
+        self.paho_logger = logging.getLogger(f"{logger.name}.paho")
+        self.paho_logger.setLevel(logging.DEBUG if self.PAHO_DEBUG else logging.WARNING)
+        self.capture = None  # CaptureSink, opened in start() when capture_file is set
+        self.startup_timings = {}
+        self._startup_t0 = time.perf_counter()
+
+        # Blocking calls (connect, REST, polls, compaction) run here; sized once, never per call
+        self._executor = ThreadPoolExecutor(max_workers=4 + (1 if self.HTTP_SOURCE_URL else 0),
+                                            thread_name_prefix="AlertEngineIO")
+        # State journal I/O, one thread so appends and compactions run in submission order
+        self._journal_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AlertEngineJournal")
+        self.storage = Storage(self.STORAGE_DIR, logger=logger)
+        self.pushy = PushyClient(self.API_HOST, timeout=self.CONNECT_TIMEOUT, retries=self.API_RETRIES,
+                                 logger=logger)
+
+        # Only the loop thread touches the state, so the shared stages need no real lock; lists are never
+        # changed once installed, so a (state, version) pair can be handed to the journal writer as is
+        self.attr_state_lock = contextlib.nullcontext()
+        self._init_processing()
+        self.journal = None  # StateJournal, opened in start() so replays never touch it
+
+        self._init_metrics()
+        self.ha_publisher = None  # LoopHAPublisher, created in start()
+        self.ha_scheduler = LoopPublishScheduler(self.loop, self._render_ha_payloads, self._send_to_ha,
+                                                 self.PUBLISH_WINDOW_S, logger=logger,
+                                                 on_latency=self._m_publish_latency.observe)
+        self.pipeline = LoopAlertPipeline([
+            ("dedup", self._stage_dedup),
+            ("filter", self._stage_filter),
+            ("state", self._stage_state),
+            ("publish", self._stage_publish),
+        ], maxsize=self.PIPELINE_QUEUE_SIZE, on_depth=self._on_queue_depth, logger=logger)
+        self.expiry = LoopExpiryScheduler(self.loop, self._expire_entries, logger=logger)
+
+        # Redundant sources feed the same pipeline; Pushy (the listener) is always on
+        self.sources = []
+        if self.HTTP_SOURCE_URL:
+            self.sources.append(HttpPollSource(self._submit_threadsafe, self.HTTP_SOURCE_URL, self.cities.ids_for,
+                                               interval_s=self.HTTP_POLL_S, logger=logger))
+        self.merger = None
+        if self.sources:
+            self.merger = SourceMerger([PUSHY] + [source.name for source in self.sources], self.MERGE_WINDOW_S,
+                                       registry=self.metrics)
+
+        # Paho's own reconnect would keep retrying the same timestamped host; the controller picks a new one
+        self.reconnect = ReconnectController(self.MQTT_TEMPLATE, self.MQTT_PORT, timeout=self.CONNECT_TIMEOUT,
+                                             candidates=self.RECONNECT_CANDIDATES,
+                                             max_backoff_s=self.RECONNECT_MAX_BACKOFF_S, logger=logger)
+        self.listener = None
+        self._tasks = []
+        self._metrics_server = None
+        self._stop_event = None
+
+    def _init_metrics(self):
+        """Registers the alert-path metrics; component counters are read only when rendered."""
+        m = self.metrics = MetricsRegistry()
+        self._m_alert_age = m.histogram("broker_to_receive_seconds", "Alert time to pipeline processing",
+                                        AGE_BUCKETS)
+        self._m_publish_latency = m.histogram("receive_to_publish_seconds",
+                                              "MQTT receive to Home Assistant publish (queued)", LATENCY_BUCKETS)
+        self._m_stale = m.counter("alerts_stale_total", "Alerts dropped as older than max_age_s")
+        m.gauge("messages_received_total", "Messages received from Pushy",
+                lambda: self.pipeline.received, kind="counter")
+        m.gauge("pipeline_queue_depth", "Messages waiting for the pipeline worker", lambda: self.pipeline.queue_depth())
+        m.gauge("pipeline_dropped_total", "Messages dropped on a full pipeline queue",
+                lambda: self.pipeline.dropped, kind="counter")
+        m.gauge("pipeline_errors_total", "Messages that failed decoding or a stage",
+                lambda: self.pipeline.errors, kind="counter")
+        m.gauge("backpressure_pauses_total", "Times reading from Pushy was paused on a deep pipeline queue",
+                lambda: self.listener.io.pauses if self.listener else 0, kind="counter")
+        m.gauge("dedup_hits_total", "Duplicate alerts dropped", lambda: self._seen.hits, kind="counter")
+        m.gauge("active_alert_entries", "Entries currently published to Home Assistant",
+                lambda: sum(len(v) for v in self.attr_state.values()))
+        m.gauge("group_renders_total", "Output group payloads re-serialized", lambda: self.router.renders,
+                kind="counter")
+        m.gauge("publish_failures_total", "Failed or dropped Home Assistant publishes",
+                lambda: self.ha_scheduler.failed + (self.ha_publisher.failed + self.ha_publisher.dropped
+                                                    if isinstance(self.ha_publisher, LoopHAPublisher) else 0),
+                kind="counter")
+        m.gauge("mqtt_reconnects_total", "Successful MQTT reconnects",
+                lambda: self.reconnect.reconnect_time.count, kind="counter")
+
+    # ─── HELPERS ────────────────────────────────────────────────────────────
+
+    def startup_mark(self, phase):
+        """Records and logs the time from engine creation to the end of a startup phase (first time only)."""
+        if phase in self.startup_timings:
+            return
+        elapsed = time.perf_counter() - self._startup_t0
+        self.startup_timings[phase] = elapsed
+        self.logger.info(f"⏱ Startup phase '{phase}' done at {elapsed * 1000:.0f} ms")
+
+    async def _blocking(self, fn, *args):
+        """Runs a blocking call on the engine's executor."""
+        return await self.loop.run_in_executor(self._executor, fn, *args)
+
+    async def _journal_io(self, fn, *args):
+        """Runs a state journal call on the journal writer, after everything submitted before it."""
+        return await self.loop.run_in_executor(self._journal_writer, fn, *args)
+
+    def load_json(self, path):
+        return self.storage.load(path)
+
+    def save_json(self, path, data):
+        self.storage.save(path, data)
+
+    def get_android_id(self):
+        aid = self.storage.load_text(self.ANDROID_ID_FILE)
+        if aid:
+            return aid
+        aid = f"{random.getrandbits(64):016x}{self.ANDROID_SUFFIX}"
+        self.storage.save_text(self.ANDROID_ID_FILE, aid)
+        return aid
+
+    # ─── PUSHY REST (blocking, run on the executor) ─────────────────────────
+
+    def ensure_authenticated(self):
+        creds = self.load_json(self.TOKEN_FILE)
+        if creds.get("token") and creds.get("auth"):
+            self.logger.info("Loaded credentials from token.json")
+            return creds["token"], creds["auth"]
+
+        aid = self.get_android_id()
+        # Never retry /register: a duplicate registration creates a second device
+        reg = self.pushy.post("/register", {
+            "androidId": aid, "app": None,
+            "appId": self.APP_ID, "platform": "android",
+            "sdk": self.SDK_VERSION
+        }, retries=0)
+        token, auth = reg["token"], reg["auth"]
+        self.save_json(self.TOKEN_FILE, {"token": token, "auth": auth})
+        self.logger.info("Registered new device and saved credentials")
+        return token, auth
+
+    def reconcile_subscriptions(self, token, auth):
+        reconciler = SubscriptionReconciler(self.pushy, token, auth, self.SUBS_FILE,
+                                            load_json=self.load_json, save_json=self.save_json,
+                                            batch_size=self.SUBS_BATCH_SIZE, concurrency=self.SUBS_CONCURRENCY,
+                                            logger=self.logger)
+        return reconciler.reconcile(self.segment_index.topics())
+
+    async def _background_reconcile(self, token, auth):
+        try:
+            await self._blocking(self.reconcile_subscriptions, token, auth)
+        except Exception as e:
+            self.logger.error(f"Subscription reconcile failed: {e}")
+        self.startup_mark("reconcile")
+
+    # ─── HA PUBLISHING ──────────────────────────────────────────────────────
+
+    def _send_to_ha(self, topic, payload):
+        self.ha_publisher.publish(topic, payload, qos=0, retain=True)
+        if topic == self.STATE_TOPIC:
+            self.logger.info(f"Queued state for Home Assistant. Active: {payload}")
+
+    def _on_ha_connect(self):
+        """Re-sends discovery, availability and state after every HA broker (re)connect."""
+        self.ha_scheduler.forget()  # a restarted broker may have lost the retained messages
+        self.publish_to_ha(urgent=True)
+
+    # ─── INTAKE & BACK-PRESSURE ─────────────────────────────────────────────
+
+    def handle(self, msg_payload):
+        """Handles a decoded message synchronously by running it through the pipeline stages."""
+        return self.pipeline.run(msg_payload)
+
+    def _submit_threadsafe(self, payload, source=None):
+        """Sink for sources polling on the executor."""
+        self.loop.call_soon_threadsafe(self.pipeline.submit, payload, source)
+
+    def _on_queue_depth(self, depth):
+        io = self.listener.io if self.listener else None
+        if io is None:
+            return
+        if io.reading and depth >= self.BACKPRESSURE_HIGH:
+            io.pause_reading()
+            self.log_sampled("backpressure", logging.WARNING,
+                             "Pipeline queue at %d; pausing reads from Pushy until it drains", depth)
+        elif not io.reading and depth <= self.BACKPRESSURE_LOW:
+            io.resume_reading()
+            self.log_sampled("backpressure_resume", logging.DEBUG,
+                             "Pipeline queue down to %d; resumed reading from Pushy", depth)
+
+    # ─── JOURNAL ────────────────────────────────────────────────────────────
+
+    def _journal_append(self, version, list_key, clear_key, entries):
+        if self.journal:
+            self._journal_writer.submit(self.journal.append, version, list_key, clear_key, entries)
+
+    async def restore_state(self):
+        """Restores the still-active entries from the state journal and schedules their expiry."""
+        state, version = await self._journal_io(self.journal.load, tuple(self.attr_state), time.time())
+        self.attr_state = state
+        self.state_version = version
+        self.router.load(state)
+        for records in state.values():
+            for entry in records:
+                self.expiry.schedule(entry.deadline, entry)
+        await self._journal_io(self.journal.compact, version, state, True)
+
+    async def compact_journal(self):
+        await self._journal_io(self.journal.compact, self.state_version, self.attr_state)
+        self.logger.debug(f"State journal stats: {await self._journal_io(self.journal.stats)}")
+
+    # ─── PERIODIC ───────────────────────────────────────────────────────────
+
+    def _log_stats(self):
+        logger = self.logger
+        logger.debug(f"Dedup cache stats: {self._seen.stats()}")
+        logger.debug(f"Alert pipeline stats: {self.pipeline.stats()}")
+        logger.debug(f"Pushy API stats: {self.pushy.stats()}")
+        logger.debug(f"MQTT reconnect stats: {self.reconnect.stats()}")
+        if self.router:
+            logger.debug(f"Topic router stats: {self.router.stats()}")
+        if self.merger:
+            logger.debug(f"Alert source merge stats: {self.merger.stats()}")
+            for source in self.sources:
+                logger.debug(f"Alert source '{source.name}' stats: {source.stats()}")
+
+    async def _run_periodic(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL_S)
+            self._log_stats()
+            if self.METRICS_TOPIC:
+                self.ha_publisher.publish(self.METRICS_TOPIC, json.dumps(self.metrics.snapshot()), qos=0,
+                                          retain=False)
+            try:
+                await self.compact_journal()
+            except Exception as e:
+                self.logger.error(f"State journal compaction failed: {e}")
+
+    async def _run_source(self, source):
+        """Polls an HTTP source on the executor at its own (backed-off) interval."""
+        while True:
+            t0 = self.loop.time()
+            delay = await self._blocking(source.poll_once)
+            await asyncio.sleep(max(0.0, delay - (self.loop.time() - t0)))
+
+    # ─── LIFECYCLE ──────────────────────────────────────────────────────────
+
+    def _spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self._tasks.append(task)
+        return task
+
+    async def start(self):
+        self.ha_publisher = LoopHAPublisher(self.loop, self.HA_MQTT_HOST, self.HA_MQTT_PORT, self.HA_MQTT_USER,
+                                            self.HA_MQTT_PASS, max_queue=self.HA_MAX_QUEUE,
+                                            will=(self.AVAILABILITY_TOPIC, OFFLINE), on_connect=self._on_ha_connect,
+                                            executor=self._executor, logger=self.logger)
+        self.ha_publisher.start()
+        if self.CAPTURE_FILE:
+            self.capture = CaptureSink(os.path.join(self.STORAGE_DIR, self.CAPTURE_FILE),
+                                       max_bytes=self.CAPTURE_MAX_MB * 1024 * 1024, backups=self.CAPTURE_BACKUPS,
+                                       rate_limit=self.CAPTURE_RATE_LIMIT, logger=self.logger)
+            self.capture.start()
+        self.pipeline.start()
+        self.expiry.start()
+        self.journal = StateJournal(self.STATE_JOURNAL_FILE, logger=self.logger)
+        await self.restore_state()
+        self.startup_mark("state")
+        self.logger.info("Publishing initial state to Home Assistant...")
+        self.publish_to_ha(urgent=True)  # goes out on connect; includes restored alerts
+
+        token, auth = await self._blocking(self.ensure_authenticated)
+        self.startup_mark("auth")
+
+        # Connect the listener as soon as credentials exist, so no alert is lost during startup
+        self.listener = IoRefListener(self, token, auth)
+        self._spawn(self.listener.run())
+        for source in self.sources:
+            self._spawn(self._run_source(source))
+        self.startup_mark("listener_started")
+
+        # Subscription reconciliation talks HTTP to Pushy; it runs while the listener connects
+        self._spawn(self._background_reconcile(token, auth))
+
+        if self.METRICS_PORT:
+            self._metrics_server = await start_metrics_server(self.metrics, self.METRICS_HOST, self.METRICS_PORT,
+                                                              logger=self.logger)
+        self._spawn(self._run_periodic())
+
+    async def stop(self):
+        if self.listener:
+            await self.listener.stop()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self.pipeline.join()
+        self.expiry.stop()
+        self.ha_scheduler.stop()
+        if self.ha_publisher:
+            self.ha_publisher.publish(self.AVAILABILITY_TOPIC, OFFLINE, qos=1, retain=True)
+            await self.ha_publisher.stop()
+        if self._metrics_server:
+            self._metrics_server.close()
+            await self._metrics_server.wait_closed()
+        if self.capture:
+            self.capture.stop()
+        self.pushy.close()
+        if self.journal:
+            await self._journal_io(self.journal.compact, self.state_version, self.attr_state)
+            await self._journal_io(self.journal.close)
+
+    async def main(self):
+        """start(), then runs until Ctrl-C / SIGTERM (or request_stop()), then stop()."""
+        self._stop_event = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self._stop_event.set)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass  # not on the main thread / not supported: KeyboardInterrupt still ends run()
+        try:
+            await self.start()
+            self.logger.info("🚀 Running; Ctrl-C to quit. Everything runs on one event loop.")
+            await self._stop_event.wait()
+        finally:
+            self.logger.info("Shutting down…")
+            await self.stop()
+            self.logger.info("Shutdown complete.")
+
+    def request_stop(self):
+        """Thread-safe: ends main()."""
+        if self._stop_event is not None:
+            self.loop.call_soon_threadsafe(self._stop_event.set)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.main())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._journal_writer.shutdown(wait=True)  # queued appends still reach the disk
+            self.loop.close()
+
+
+# ─── PUSHY LISTENER ─────────────────────────────────────────────────────────
+class IoRefListener:
+    def __init__(self, engine, token, auth):
+        self.engine = engine
+        self.token = token
+        self.auth = auth
+        self.logger = engine.logger
+        self.reconnect = engine.reconnect
+        self.stopping = False
+        self.endpoint = None  # Broker host of the current connection
+
+        self.client = mqtt.Client(
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            client_id=self.token,
+            clean_session=False,
+            reconnect_on_failure=False
+        )
+        self.client.connect_timeout = engine.CONNECT_TIMEOUT  # Per-socket, not process-wide
+
+        self.client.username_pw_set(self.token, self.auth)
+        if engine.MQTT_TLS:
+            self.client.tls_set(cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS)
+
+        self.client.on_connect = self._on_connect
+        # Only enqueue in the read callback; decoding and processing run in the pipeline task.
+        self.client.on_message = self._on_message
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_subscribe = self._on_subscribe
+        self.client.enable_logger(engine.paho_logger)
+        self.io = LoopMqtt(self.client, engine.loop, name="pushy", logger=self.logger)
+
+    def _on_message(self, client, userdata, msg):
+        capture = self.engine.capture
+        if capture:
+            capture.write(msg.payload, self.endpoint)
+        self.engine.pipeline.submit(msg.payload)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            down = self.reconnect.on_connected()
+            if down is None:
+                self.logger.info("Connection Successful (rc: 0)")
+            else:
+                self.logger.info(f"Reconnected (rc: 0) after {down * 1000:.0f} ms offline")
+            client.subscribe(self.token, self.engine.QOS)
+            self.engine.startup_mark("connected")
+        else:
+            self.logger.error(f"Connection failed: {reason_code}. Will retry with backoff.")
+
+    def _on_subscribe(self, client, userdata, mid, reason_code_list, properties):
+        self.engine.startup_mark("ready_to_receive")
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        self.reconnect.on_disconnected()
+        if not self.stopping:
+            self.logger.warning(f"Disconnected from MQTT (rc: {reason_code}). Reconnecting.")
+
+    async def run(self):
+        engine = self.engine
+        while not self.stopping:
+            try:
+                # Back off on the loop; only the blocking endpoint probe runs on the executor
+                delay = self.reconnect.backoff()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                endpoint = self.endpoint = await engine._blocking(self.reconnect.probe)
+                self.logger.info(f"Attempting to connect to: {endpoint}")
+                await self.io.connect(endpoint, engine.MQTT_PORT, engine.KEEPALIVE_SEC, engine._executor)
+                await self.io.closed.wait()  # Until the connection drops
+            except OSError as e:
+                if not self.stopping:
+                    self.reconnect.on_failure()
+                    self.logger.error(f"Connection error: {e}.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if not self.stopping:
+                    self.reconnect.on_failure()
+                    self.logger.error(f"An unexpected error occurred in the listener: {e}.")
+
+    async def stop(self, timeout=5):
+        self.stopping = True
+        self.reconnect.stop()
+        self.client.disconnect()
+        await self.io.wait_closed(timeout)
+        self.io.close()
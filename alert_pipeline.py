@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+alert_pipeline.py
+
+Staged processing pipeline between the Paho receive thread and the alert
+handling code, shared by missile_alerts_app.py and mqttest.py.
+
+The Paho `on_message` callback only calls `submit(raw_bytes)`, which puts the
+raw payload on a bounded queue and returns without ever waiting, so PUBACKs
+and keepalives are never delayed by alert processing; when the queue is full
+the message is dropped and counted instead. A single worker thread decodes each
+payload and runs it through named stages (dedup → filter → state → publish).
+A stage returns the item for the next stage, or None to stop processing it.
+
+Queue depth, drops and per-stage timing are exposed via `stats()`. While an
+item runs, `received_at` holds the perf_counter() time it was received and
+`source` the name of the alert source that submitted it (see
+alert_sources.py; None for the Pushy listener). Sources that already
+produce a decoded dict skip the decode step.
+"""
+
+import time
+import json
+import queue
+import logging
+import threading
+
+_STOP = object()
+
+
+class StageTimer:
+    """Count / total / max wall time of one pipeline stage."""
+
+    __slots__ = ("count", "total_s", "max_s")
+
+    def __init__(self):
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def add(self, dt):
+        self.count += 1
+        self.total_s += dt
+        if dt > self.max_s:
+            self.max_s = dt
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "avg_ms": (self.total_s / self.count * 1000.0) if self.count else 0.0,
+            "max_ms": self.max_s * 1000.0,
+        }
+
+
+class AlertPipeline:
+    def __init__(self, stages, *, decode=None, maxsize=10000, logger=None):
+        """
+        stages: list of (name, fn) where fn(item) -> item | None
+        decode: fn(raw_bytes) -> payload, run on the worker thread (default: JSON)
+        """
+        self.stages = list(stages)
+        self.decode = decode or (lambda raw: json.loads(raw.decode("utf-8")))
+        self.logger = logger or logging.getLogger("missile_alerts")
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._count_lock = threading.Lock()  # submit() runs on the Paho thread and on source threads
+        self._timers = {name: StageTimer() for name in ["decode"] + [name for name, _ in self.stages]}
+        self._queue_wait = StageTimer()
+
+        self.received_at = None
+        self.source = None
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    # ─── LIFECYCLE ──────────────────────────────────────────────────────────
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._worker, daemon=True, name="AlertPipelineWorker")
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Processes what is already queued, then stops the worker."""
+        if not self._thread:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    # ─── RECEIVE SIDE (Paho network thread, source threads) ─────────────────
+
+    def submit(self, raw, source=None):
+        """Enqueues a raw MQTT payload (or a decoded dict). Never blocks and never runs alert processing."""
+        try:
+            self._queue.put_nowait((time.perf_counter(), raw, source))
+        except queue.Full:
+            with self._count_lock:
+                self.received += 1
+                self.dropped += 1
+            self.logger.error(f"Alert pipeline queue full ({self._queue.maxsize}); dropped a message")
+            return
+        depth = self._queue.qsize()
+        with self._count_lock:
+            self.received += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+
+    # ─── WORKER SIDE ────────────────────────────────────────────────────────
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            self.process(item)
+
+    def process(self, item):
+        """Decodes one queued (enqueued_at, raw, source) item and runs it through the stages."""
+        enqueued_at, raw, source = item
+        t0 = time.perf_counter()
+        self._queue_wait.add(t0 - enqueued_at)
+        try:
+            payload = raw if isinstance(raw, dict) else self.decode(raw)
+        except Exception as e:
+            self.errors += 1
+            self.logger.warning(f"Could not decode alert payload: {e}")
+            return None
+        self._timers["decode"].add(time.perf_counter() - t0)
+        return self.run(payload, enqueued_at, source)
+
+    def run(self, item, received_at=None, source=None):
+        """Runs `item` through all stages synchronously on the current thread."""
+        self.received_at = time.perf_counter() if received_at is None else received_at
+        self.source = source
+        timers = self._timers
+        try:
+            for name, fn in self.stages:
+                t0 = time.perf_counter()
+                item = fn(item)
+                timers[name].add(time.perf_counter() - t0)
+                if item is None:
+                    break
+        except Exception as e:
+            self.errors += 1
+            self.logger.error(f"Alert pipeline stage '{name}' failed: {e}")
+        self.processed += 1
+        return item
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_depth": self.max_depth,
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "queue_wait": self._queue_wait.as_dict(),
+            "stages": {name: t.as_dict() for name, t in self._timers.items()},
+        }
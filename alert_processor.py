@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+alert_processor.py
+
+Configuration, alert state and the dedup → filter → state → publish pipeline
+stages, shared by missile_alerts_app.py and mqttest.py (alert_engine.py).
+
+AlertProcessor is a mixin: the AppDaemon app and the asyncio engine only add
+their transport (Paho thread vs event loop, call_service vs their own HA MQTT
+client), their scheduling and their logging glue. A host
+  - calls _load_common_config(base_dir, storage_dir) from its _load_config()
+    (self.config holds the apps.yaml / CONFIG keys) and then loads its own
+    keys,
+  - calls _init_processing() before building the components below, and
+    provides:
+        logger, attr_state_lock  the state lock (a no-op context when only
+                                 one thread ever touches the state)
+        pipeline                 .source / .received_at of the current message
+        ha_scheduler             .request(urgent, since) / .last_sent(topic)
+        expiry                   .schedule(deadline, entry)
+        merger                   SourceMerger or None
+        _m_alert_age, _m_stale   metrics
+        _journal_append(version, list_key, clear_key, entries)
+
+The state is copy-on-write: a change builds a new dict under attr_state_lock
+and swaps it in (bumping state_version); the lists inside are never mutated
+once installed, so readers and the journal only need a reference.
+"""
+
+import os
+import time
+import logging
+from datetime import datetime
+
+from alert_dedup import DedupCache, alert_key
+from alert_time import parse_alert_time
+from alert_record import AlertRecord, serialize_state
+from segment_index import SegmentIndex
+from log_sink import RateSampler, lazy
+from title_classifier import TitleClassifier, ACTIVE_THREAT, ALL_CLEAR
+from city_registry import CityRegistry
+from topic_router import TopicRouter, parse_groups
+from ha_discovery import discovery_payloads, ONLINE
+from alert_sources import PUSHY
+
+ACTIVE_KEY = "selected_areas_active_alerts"
+UPDATES_KEY = "selected_areas_updates"
+
+
+class AlertProcessor:
+    # Debug mode only logs raw notifications and drops them (the app's historical behaviour)
+    DEBUG_DROPS_ALERTS = False
+    # Seconds between state re-sends; discovery sets expire_after to 3x this when > 0 (see ha_discovery.py)
+    HEARTBEAT_S = 0
+
+    # ─── CONFIG ─────────────────────────────────────────────────────────────
+
+    def _load_common_config(self, base_dir, storage_dir):
+        """Loads the keys shared by apps.yaml and mqttest.CONFIG; data files default to `base_dir`."""
+        config = self.config
+        self.DEBUG = config.get("debug", True)
+        self.API_HOST = config.get("api_host", "https://pushy.ioref.app")
+        self.APP_ID = config.get("app_id", "66c20ac875260a035a3af7b2")
+        self.SDK_VERSION = config.get("sdk_version", 10117)
+        self.ANDROID_SUFFIX = config.get("android_suffix", "-Xiaomi-2107113SI")
+        self.CONNECT_TIMEOUT = config.get("connect_timeout", 10)
+        self.API_RETRIES = config.get("api_retries", 3)
+        self.SUBS_BATCH_SIZE = config.get("subs_batch_size", 50)
+        self.SUBS_CONCURRENCY = config.get("subs_concurrency", 3)
+        self.KEEPALIVE_SEC = config.get("keepalive_sec", 300)
+        self.MQTT_TEMPLATE = config.get("mqtt_template", "mqtt-{timestamp}.ioref.io")
+        self.MQTT_PORT = config.get("mqtt_port", 443)
+        self.MQTT_TLS = config.get("mqtt_tls", True)  # False only for a local stand-in (pushy_standin.py)
+        self.RECONNECT_CANDIDATES = config.get("reconnect_candidates", 2)
+        self.RECONNECT_MAX_BACKOFF_S = config.get("reconnect_max_backoff_s", 30)
+        self.QOS = config.get("qos", 1)
+        self.MAX_AGE_S = config.get("max_age_s", 45)
+        self.EXPIRY_S = config.get("expiry_s", 600)
+        self.SEGMENTS = set(config.get("segments", {}))  # City ids or names, resolved in _init_processing
+        self.name_map = config.get("name_map", {})  # Optional overrides of the cities.json names
+        self.DEDUP_CAPACITY = config.get("dedup_capacity", 10000)
+        self.DEDUP_TTL_S = config.get("dedup_ttl_s", 3600)
+        self.PIPELINE_QUEUE_SIZE = config.get("pipeline_queue_size", 10000)
+
+        # --- Home Assistant Topic Config ---
+        self.STATE_TOPIC = config.get("state_topic", "missile_alerts/5001347_5001878")
+        self.ATTR_TOPIC = config.get("attr_topic", "missile_alerts/5001347_5001878_attr")
+        # Optional per-city / per-area sensors, each with its own topic pair (see topic_router.py)
+        self.GROUPS = config.get("groups", {})
+        self.GROUP_TOPIC_PREFIX = config.get("group_topic_prefix", "missile_alerts")
+        # State/attributes are published retained; discovery announces the sensors to HA by itself
+        self.DISCOVERY = config.get("discovery", True)
+        self.DISCOVERY_PREFIX = config.get("discovery_prefix", "homeassistant")
+        self.AVAILABILITY_TOPIC = config.get("availability_topic", "missile_alerts/status")
+        self.SENSOR_NAME = config.get("sensor_name", "Missile Alert")
+        self.PUBLISH_WINDOW_S = config.get("publish_window_ms", 100) / 1000.0
+
+        # --- Redundant alert sources (see alert_sources.py), merged first-arrival-wins ---
+        self.HTTP_SOURCE_URL = config.get("http_source_url", None)  # e.g. alert_sources.OREF_ALERTS_URL
+        self.HTTP_POLL_S = config.get("http_poll_s", 1.0)
+        self.MERGE_WINDOW_S = config.get("merge_window_s", 30)
+
+        # --- Metrics (Prometheus text endpoint is off unless metrics_port is set) ---
+        self.METRICS_HOST = config.get("metrics_host", "127.0.0.1")
+        self.METRICS_PORT = config.get("metrics_port", 0)
+        self.METRICS_TOPIC = config.get("metrics_topic", None)  # Optional HA sensor with a metrics snapshot
+
+        # --- Hot-path logging ---
+        self.LOG_SAMPLE_PER_S = config.get("log_sample_per_s", 5)  # Per-alert log lines per second (0 = all)
+        self.CAPTURE_FILE = config.get("capture_file", None)  # Raw notification capture (JSONL), off by default
+        self.CAPTURE_MAX_MB = config.get("capture_max_mb", 50)
+        self.CAPTURE_BACKUPS = config.get("capture_backups", 3)
+        self.CAPTURE_RATE_LIMIT = config.get("capture_rate_limit", 0)  # Messages per second (0 = all)
+
+        # --- Storage ---
+        self.STORAGE_DIR = storage_dir
+        os.makedirs(self.STORAGE_DIR, exist_ok=True)
+        self.TOKEN_FILE = os.path.join(self.STORAGE_DIR, "token.json")
+        self.ANDROID_ID_FILE = os.path.join(self.STORAGE_DIR, "android_id.txt")
+        self.SUBS_FILE = os.path.join(self.STORAGE_DIR, "subs.json")
+        self.STATE_JOURNAL_FILE = os.path.join(self.STORAGE_DIR, "state_journal.jsonl")
+        self.CITIES_CACHE_FILE = os.path.join(self.STORAGE_DIR, "cities.cache")
+
+        # --- Segment data (parent/child expansion) ---
+        self.SEGMENT_FILE = config.get("segment_file", os.path.join(base_dir, "raw_data", "Segment.json"))
+        self.CITIES_FILE = config.get("cities_file", os.path.join(base_dir, "cities.json"))
+        self.TITLES_FILE = config.get("titles_file", os.path.join(base_dir, "titles.json"))
+
+    # ─── STATE ──────────────────────────────────────────────────────────────
+
+    def _init_processing(self):
+        """Builds the alert state, the segment/title/group tables and the discovery payloads (no I/O)."""
+        logger = self.logger
+        self._log_sampler = RateSampler(self.LOG_SAMPLE_PER_S)
+        self._seen = DedupCache(self.DEDUP_CAPACITY, self.DEDUP_TTL_S)
+        self.attr_state = {ACTIVE_KEY: [], UPDATES_KEY: []}
+        self.state_version = 0
+        self._rendered = (None, ())  # (state version, rendered payloads)
+
+        self.cities = CityRegistry.load(self.CITIES_FILE, self.CITIES_CACHE_FILE, logger=logger)
+        self.SEGMENTS = self.cities.resolve(self.SEGMENTS, logger=logger)
+        groups = parse_groups(self.GROUPS, self.GROUP_TOPIC_PREFIX,
+                              resolve=lambda segs: self.cities.resolve(segs, logger=logger), logger=logger)
+        for group in groups:
+            self.SEGMENTS |= group.segments  # the combined sensor covers every group too
+        self.classifier = TitleClassifier.from_file(self.TITLES_FILE, logger=logger)
+        self.segment_index = SegmentIndex.from_files(self.SEGMENTS, self.SEGMENT_FILE, self.CITIES_FILE,
+                                                     logger=logger)
+        self.router = TopicRouter(groups, self.segment_index.parent_of, logger=logger)
+        self._discovery = self._build_discovery()
+
+    def _snapshot_state(self):
+        """Returns an immutable (state, version) snapshot; the lock is held only for the reference copy."""
+        with self.attr_state_lock:
+            return self.attr_state, self.state_version
+
+    def _swap_state(self, new_state):
+        """Installs a new state dict. Must be called with attr_state_lock held."""
+        self.attr_state = new_state
+        self.state_version += 1
+
+    # ─── HA PAYLOADS ────────────────────────────────────────────────────────
+
+    def _build_discovery(self):
+        """Discovery configs (see ha_discovery.py) and the availability message, sent ahead of the state."""
+        payloads = ()
+        if self.DISCOVERY:
+            sensors = [(self.SENSOR_NAME, self.STATE_TOPIC, self.ATTR_TOPIC)]
+            sensors += [(f"{self.SENSOR_NAME} - {self.cities.name(group.name, group.name)}",
+                         group.state_topic, group.attr_topic) for group in self.router.groups]
+            payloads = discovery_payloads(sensors, self.AVAILABILITY_TOPIC, prefix=self.DISCOVERY_PREFIX,
+                                          expire_after=3 * self.HEARTBEAT_S)
+        return (*payloads, (self.AVAILABILITY_TOPIC, ONLINE))
+
+    def _render_ha_payloads(self):
+        """Serializes a state snapshot into (topic, payload) pairs for the scheduler, outside the lock."""
+        state, version = self._snapshot_state()
+        rendered_version, payloads = self._rendered
+        if rendered_version != version:
+            attrs = serialize_state(state)
+            active = "1" if state[ACTIVE_KEY] else "0"
+            payloads = ((self.ATTR_TOPIC, attrs), (self.STATE_TOPIC, active))
+            self._rendered = (version, payloads)
+        return (*self._discovery, *payloads, *self.router.render())
+
+    def publish_to_ha(self, urgent=False, since=None):
+        """Requests a publish of the current state; non-urgent requests are coalesced."""
+        self.ha_scheduler.request(urgent, since)
+
+    def log_sampled(self, key, level, msg, *args):
+        """Per-alert log line, rate-limited per `key`; suppressed lines are counted and reported."""
+        if not self.logger.isEnabledFor(level):
+            return
+        allowed, suppressed = self._log_sampler.allow(key)
+        if suppressed:
+            self.logger.log(level, "(%d '%s' log lines suppressed in the last interval)", suppressed, key)
+        if allowed:
+            self.logger.log(level, msg, *args)
+
+    # ─── PIPELINE STAGES ────────────────────────────────────────────────────
+
+    def _stage_dedup(self, msg_payload):
+        now = time.time()
+        # %-style with lazy args: nothing is formatted unless DEBUG logging is enabled
+        self.logger.debug("RAW NOTIFICATION @ %s: %s", lazy(lambda: datetime.fromtimestamp(now).isoformat()),
+                          msg_payload)
+        if self.DEBUG and self.DEBUG_DROPS_ALERTS:
+            return None
+
+        aid = (msg_payload.get("alertTitle") or msg_payload.get("id") or "").strip()
+        key = alert_key(msg_payload)
+        if not key or self._seen.seen(key):
+            return None
+        return {"payload": msg_payload, "aid": aid, "now": now}
+
+    def _stage_filter(self, ctx):
+        msg_payload, aid, now = ctx["payload"], ctx["aid"], ctx["now"]
+        title = msg_payload.get("title", "").strip()
+        raw_time = msg_payload.get("time", "")
+
+        alert_time = ""
+        alert_ts = None
+        latency = None
+        if raw_time:
+            try:
+                alert_ts, alert_time = parse_alert_time(raw_time)
+                latency = now - alert_ts
+                self._m_alert_age.observe(max(latency, 0.0))
+                self.log_sampled("received", logging.INFO, "📩 Received alert '%s' for '%s' with latency: %.2fs",
+                                 aid, title, latency)
+            except ValueError as e:
+                self.logger.warning(f"Could not parse timestamp '{raw_time}': {e}")
+                alert_time = raw_time  # Fallback to raw time if parsing fails
+
+        if latency is not None and latency > self.MAX_AGE_S:
+            self.log_sampled("stale", logging.WARNING, "Skipping stale alert %s (latency: %.2fs > max_age: %ss)",
+                             aid, latency, self.MAX_AGE_S)
+            self._m_stale.inc()
+            return None
+
+        hits = self.segment_index.match(msg_payload.get("citiesIds", ""))
+        if not hits:
+            return None
+
+        self.log_sampled("relevant", logging.INFO, "✅ Alert '%s' is relevant for segments: %s", title, hits)
+        ctx.update(title=title, alert_time=alert_time, alert_ts=alert_ts, hits=hits)
+        return ctx
+
+    def _stage_state(self, ctx):
+        title, aid = ctx["title"], ctx["aid"]
+        threat_id = ctx["payload"].get("threatId", "")
+        kind = self.classifier.classify(title, ctx["payload"].get("msgId"))
+        is_real = kind == ACTIVE_THREAT
+
+        hits = ctx["hits"]
+        if self.merger:
+            # The first source to report a (category, segment) wins; the others are late duplicates
+            source = self.pipeline.source or PUSHY
+            hits = [seg for seg in hits if self.merger.claim(source, (kind, seg))]
+            if not hits:
+                return None
+
+        attr_list_key = ACTIVE_KEY if is_real else UPDATES_KEY
+        # A real alert replaces the updates; only an all-clear ends the active alerts early
+        clear_list_key = UPDATES_KEY if is_real else ACTIVE_KEY if kind == ALL_CLEAR else None
+
+        # Expire relative to the alert time (or arrival time if it could not be parsed)
+        deadline = (ctx["alert_ts"] or ctx["now"]) + self.EXPIRY_S
+        name_of = self.name_map.get
+        entries = [AlertRecord(ctx["alert_time"], title, name_of(seg) or self.cities.name(seg, seg), threat_id,
+                               aid, deadline, seg)
+                   for seg in hits]
+
+        with self.attr_state_lock:
+            new_state = dict(self.attr_state)
+            new_state[attr_list_key] = self.attr_state[attr_list_key] + entries
+            if clear_list_key:
+                new_state[clear_list_key] = []
+            self._swap_state(new_state)
+            version = self.state_version
+        # Only the pipeline worker appends, so versions stay in order without holding the lock over I/O
+        self._journal_append(version, attr_list_key, clear_list_key, entries)
+        ctx["groups"] = self.router.route(entries, attr_list_key, clear_list_key)
+
+        for entry in entries:
+            self.expiry.schedule(deadline, entry)
+        ctx["is_real"] = is_real
+        ctx["kind"] = kind
+        return ctx
+
+    def _stage_publish(self, ctx):
+        # The 0→1 transition (of the combined sensor or any group hit) goes out immediately;
+        # everything else is coalesced.
+        last_sent = self.ha_scheduler.last_sent
+        urgent = ctx["is_real"] and any(last_sent(topic) != "1"
+                                        for topic in (self.STATE_TOPIC, *self.router.state_topics(ctx["groups"])))
+        self.publish_to_ha(urgent=urgent, since=self.pipeline.received_at)
+        return ctx
+
+    # ─── EXPIRY ─────────────────────────────────────────────────────────────
+
+    def _expire_entries(self, expired):
+        """Called by the expiry scheduler exactly when the earliest entries are due."""
+        gone = {id(item) for item in expired}
+        removed = []
+        with self.attr_state_lock:
+            new_state = {}
+            for key, items in self.attr_state.items():
+                fresh_list = [item for item in items if id(item) not in gone]
+                if len(fresh_list) < len(items):
+                    removed.extend(item for item in items if id(item) in gone)
+                new_state[key] = fresh_list
+            if removed:
+                self._swap_state(new_state)
+        # A group can still hold entries that another group's alert cleared from the combined state
+        changed_groups = self.router.remove(expired)
+
+        if removed or changed_groups:
+            for item in removed:
+                self.logger.info(f"Expiring old alert: {item.alert_id or 'N/A'}")
+            self.logger.info("State has changed due to expired alerts, republishing to HA.")
+            self.publish_to_ha()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+alert_record.py
+
+Compact record type for active alert entries and an incremental serializer
+for the Home Assistant attributes payload, shared by missile_alerts_app.py
+and mqttest.py.
+
+An AlertRecord replaces the per-hit five-key dict: it uses __slots__, interns
+the strings that repeat across a mass event (title, segment name, category,
+alertDate) and caches its own JSON fragment the first time it is published.
+serialize_state() then only joins cached fragments, so the per-publish cost
+does not grow with re-encoding every entry again. The output is identical to
+json.dumps(state, ensure_ascii=False) over the equivalent dicts.
+"""
+
+import sys
+import json
+
+
+class AlertRecord:
+    __slots__ = ("alert_date", "title", "data", "category", "alert_id", "deadline", "segment", "_json")
+
+    def __init__(self, alert_date, title, data, category, alert_id, deadline=None, segment=None):
+        self.alert_date = sys.intern(alert_date)
+        self.title = sys.intern(title)
+        self.data = sys.intern(data)
+        self.category = sys.intern(category)
+        self.alert_id = alert_id
+        self.deadline = deadline  # epoch seconds at which the entry expires
+        self.segment = segment    # segment id the entry was created for (routes it to output groups)
+        self._json = None
+
+    def as_dict(self):
+        """The entry as published to Home Assistant."""
+        return {
+            "alertDate": self.alert_date,
+            "title": self.title,
+            "data": self.data,
+            "category": self.category,
+            "id": self.alert_id,
+        }
+
+    def to_json(self):
+        """Cached JSON fragment of as_dict()."""
+        fragment = self._json
+        if fragment is None:
+            fragment = self._json = json.dumps(self.as_dict(), ensure_ascii=False)
+        return fragment
+
+    def __repr__(self):
+        return f"AlertRecord({self.alert_id!r}, {self.data!r}, {self.title!r}, {self.alert_date!r})"
+
+
+def serialize_state(state):
+    """
+    Serializes {key: [AlertRecord, ...]} the same way json.dumps would
+    serialize the equivalent dicts, reusing each record's cached fragment.
+    """
+    parts = []
+    for key, records in state.items():
+        parts.append(f"{json.dumps(key, ensure_ascii=False)}: [{', '.join(r.to_json() for r in records)}]")
+    return "{" + ", ".join(parts) + "}"
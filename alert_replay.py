@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+alert_replay.py
+
+Offline replay harness and latency benchmark for recorded Pushy captures
+(data_examples/*.jsonl, one "<iso-ts> [mqtt-host] {json}" line per message).
+
+Every captured payload is fed into the real message handler of
+`MissileAlertsApp` (AppDaemon app) and/or `mqttest.py` (standalone script)
+with Home Assistant publishing replaced by a recording stub, and the
+per-message processing latency (p50/p99/max), throughput and allocations
+are reported.
+
+The alert `time` field is shifted so that each message keeps its original
+broker→receive delay relative to the replay clock, otherwise every recorded
+alert would be dropped as stale by MAX_AGE_S.
+
+Usage:
+    python3 alert_replay.py data_examples/test_data.jsonl                # as fast as possible
+    python3 alert_replay.py data_examples/olddata1.jsonl --speed 1       # real time
+    python3 alert_replay.py data_examples/*.jsonl --speed 60 --target script
+    python3 alert_replay.py data_examples/test_data.jsonl --segments all --repeat 5 --trace-alloc
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import logging
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from datetime import datetime
+from collections import namedtuple
+
+DEFAULT_SEGMENTS = ("5001878", "5001347")
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("alert_replay")
+
+CaptureEvent = namedtuple("CaptureEvent", "recv_ts host payload")
+
+
+# ─── CAPTURE PARSING ────────────────────────────────────────────────────────
+
+def parse_capture_line(line):
+    """Parses one `<iso-ts> [mqtt-host] {json}` line into a CaptureEvent, or None."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        ts, rest = line.split(" ", 1)
+        host, raw = rest.split(" ", 1)
+        return CaptureEvent(datetime.fromisoformat(ts).timestamp(), host.strip("[]"), json.loads(raw))
+    except ValueError:
+        return None
+
+
+def load_capture(paths):
+    """Loads and time-orders all events from the given capture files."""
+    events = []
+    skipped = 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                ev = parse_capture_line(line)
+                if ev is None:
+                    skipped += bool(line.strip())
+                    continue
+                events.append(ev)
+    if skipped:
+        logger.warning(f"Skipped {skipped} unparsable capture lines")
+    events.sort(key=lambda ev: ev.recv_ts)
+    return events
+
+
+def retime_payload(payload, recv_ts, now_ts, suffix=None):
+    """
+    Returns a copy of `payload` whose `time` is moved so that the original
+    broker→receive delay is preserved relative to `now_ts`.
+    """
+    out = dict(payload)
+    raw_time = payload.get("time", "")
+    if raw_time:
+        try:
+            dt = datetime.strptime(raw_time, "%Y-%m-%dT%H:%M:%S%z")
+            shifted = datetime.fromtimestamp(now_ts - (recv_ts - dt.timestamp()), tz=dt.tzinfo)
+            out["time"] = shifted.strftime("%Y-%m-%dT%H:%M:%S%z")
+        except ValueError:
+            pass
+    if suffix:
+        for key in ("alertTitle", "id", "msgId"):
+            if out.get(key):
+                out[key] = f"{out[key]}#{suffix}"
+    return out
+
+
+# ─── STATISTICS ─────────────────────────────────────────────────────────────
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+class LatencyStats:
+    """Collects per-message latency samples (seconds) and renders a summary."""
+
+    def __init__(self, name):
+        self.name = name
+        self.samples = []
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def summary(self):
+        s = sorted(self.samples)
+        n = len(s)
+        return {
+            "name": self.name,
+            "count": n,
+            "mean_ms": (sum(s) / n * 1000.0) if n else 0.0,
+            "p50_ms": percentile(s, 50) * 1000.0,
+            "p99_ms": percentile(s, 99) * 1000.0,
+            "max_ms": (s[-1] * 1000.0) if n else 0.0,
+        }
+
+
+# ─── REPLAY TARGETS ─────────────────────────────────────────────────────────
+
+class PublishRecorder:
+    """Stub publisher: records every (topic, payload) pair instead of sending it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.published = []
+
+    def record(self, topic, payload):
+        with self.lock:
+            self.published.append((time.perf_counter(), topic, payload))
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.record(topic, payload)
+
+    def __len__(self):
+        return len(self.published)
+
+
+def _install_hassapi_stub():
+    """Registers a bare `appdaemon.plugins.hass.hassapi.Hass` so the app module imports without AppDaemon."""
+    names = ("appdaemon", "appdaemon.plugins", "appdaemon.plugins.hass", "appdaemon.plugins.hass.hassapi")
+    modules = [types.ModuleType(name) for name in names]
+    for parent, child in zip(modules, modules[1:]):
+        setattr(parent, child.__name__.rsplit(".", 1)[1], child)
+    # AppTarget's ReplayApp supplies everything the app calls on it (log, call_service, ...)
+    modules[-1].Hass = type("Hass", (), {})
+    for module in modules:
+        sys.modules[module.__name__] = module
+
+
+def import_app_module():
+    """Imports missile_alerts_app, stubbing AppDaemon's hassapi when AppDaemon is not installed."""
+    try:
+        import appdaemon.plugins.hass.hassapi  # noqa: F401
+    except ImportError:
+        _install_hassapi_stub()
+    import missile_alerts_app
+    return missile_alerts_app
+
+
+class AppTarget:
+    """Drives `MissileAlertsApp._on_message_pushy` without AppDaemon or Home Assistant."""
+
+    name = "missile_alerts_app"
+
+    def __init__(self, segments, log_level, config=None):
+        """config: extra apps.yaml keys (e.g. api_host / mqtt_template for pushy_standin.py)."""
+        app_mod = import_app_module()
+
+        recorder = self.recorder = PublishRecorder()
+        app_logger = logging.getLogger("alert_replay.app")
+        app_logger.setLevel(log_level)
+
+        class ReplayApp(app_mod.MissileAlertsApp):
+            # Shadow the AppDaemon-provided attributes and services with local stubs.
+            args = None
+            app_dir = None
+
+            def __init__(self, args, app_dir):
+                self.args = args
+                self.app_dir = app_dir
+
+            def log(self, msg, level="INFO", **kwargs):
+                app_logger.log(logging.getLevelName(level), msg)
+
+            def error(self, msg, level="ERROR", **kwargs):
+                app_logger.log(logging.getLevelName(level), msg)
+
+            def get_main_logger(self):
+                return app_logger
+
+            def call_service(self, service, **kwargs):
+                recorder.record(kwargs.get("topic"), kwargs.get("payload"))
+
+        self._tmp = tempfile.TemporaryDirectory(prefix="alert_replay_")
+        self.app = ReplayApp({
+            "debug": False,
+            "segments": list(segments),
+            "segment_file": os.path.join(HERE, "raw_data", "Segment.json"),
+            "cities_file": os.path.join(HERE, "cities.json"),
+            "titles_file": os.path.join(HERE, "titles.json"),
+            **(config or {}),
+        }, self._tmp.name)
+        self.app._load_config()
+        self.app._init_state()
+
+    def feed(self, payload):
+        self.app._on_message_pushy(payload)
+
+    def dedup_stats(self):
+        return self.app._seen.stats()
+
+    def publish_stats(self):
+        return self.app.ha_scheduler.stats()
+
+    def pipeline_stats(self):
+        return self.app.pipeline.stats()
+
+    def drain(self):
+        self.app.ha_scheduler.stop()
+
+    def close(self):
+        self.app.ha_scheduler.stop(flush=False)
+        self.app.expiry.stop()
+        self.app._journal.close()
+        self._tmp.cleanup()
+
+
+class ScriptTarget:
+    """Drives the standalone script's AlertEngine (mqttest.py) with the HA publisher replaced by a stub."""
+
+    name = "mqttest"
+
+    def __init__(self, segments, log_level):
+        import mqttest
+        from alert_engine import AlertEngine
+
+        recorder = self.recorder = PublishRecorder()
+        mqttest.logger.setLevel(log_level)
+        self._tmp = tempfile.TemporaryDirectory(prefix="alert_replay_")
+        self.engine = AlertEngine(dict(mqttest.CONFIG, segments=list(segments), storage_dir=self._tmp.name),
+                                  logger=mqttest.logger)
+        self.engine.ha_publisher = recorder
+
+    def feed(self, payload):
+        self.engine.handle(payload)
+        self._tick()
+
+    def _tick(self):
+        """Runs the loop callbacks that are due (e.g. a coalesced publish), as the running engine would."""
+        loop = self.engine.loop
+        loop.call_soon(loop.stop)
+        loop.run_forever()
+
+    def dedup_stats(self):
+        return self.engine._seen.stats()
+
+    def publish_stats(self):
+        return self.engine.ha_scheduler.stats()
+
+    def pipeline_stats(self):
+        return self.engine.pipeline.stats()
+
+    def drain(self):
+        self.engine.ha_scheduler.stop()
+
+    def close(self):
+        self.engine.ha_scheduler.stop(flush=False)
+        self.engine.loop.close()
+        self._tmp.cleanup()
+
+
+TARGETS = {"app": AppTarget, "script": ScriptTarget}
+
+
+# ─── REPLAY LOOP ────────────────────────────────────────────────────────────
+
+def replay(events, target, *, speed=0.0, repeat=1, trace_alloc=False):
+    """
+    Replays `events` into `target`.
+
+    speed == 0  → as fast as possible
+    speed == 1  → real time (original inter-arrival gaps)
+    speed == N  → accelerated ×N
+    """
+    stats = LatencyStats(target.name)
+    alloc_peaks = []
+    if trace_alloc:
+        tracemalloc.start()
+        base_current, _ = tracemalloc.get_traced_memory()
+
+    first_ts = events[0].recv_ts if events else 0.0
+    span = (events[-1].recv_ts - first_ts) if events else 0.0
+    wall_start = time.perf_counter()
+    busy = 0.0
+
+    for rnd in range(repeat):
+        round_offset = rnd * (span + 1.0)
+        for ev in events:
+            if speed > 0:
+                due = wall_start + (ev.recv_ts - first_ts + round_offset) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            payload = retime_payload(ev.payload, ev.recv_ts, time.time(), suffix=rnd or None)
+
+            if trace_alloc:
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+            t0 = time.perf_counter()
+            target.feed(payload)
+            dt = time.perf_counter() - t0
+            if trace_alloc:
+                _, peak = tracemalloc.get_traced_memory()
+                alloc_peaks.append(peak - before)
+            stats.add(dt)
+            busy += dt
+
+    target.drain()
+    wall = time.perf_counter() - wall_start
+
+    result = stats.summary()
+    result.update({
+        "wall_s": wall,
+        "throughput_msg_s": (result["count"] / wall) if wall else 0.0,
+        "capacity_msg_s": (result["count"] / busy) if busy else 0.0,
+        "publishes": len(target.recorder),
+        "dedup": target.dedup_stats(),
+        "scheduler": target.publish_stats(),
+        "stages": target.pipeline_stats()["stages"],
+    })
+    if trace_alloc:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result.update({
+            "alloc_peak_mean_kib": (sum(alloc_peaks) / len(alloc_peaks) / 1024.0) if alloc_peaks else 0.0,
+            "alloc_peak_max_kib": (max(alloc_peaks) / 1024.0) if alloc_peaks else 0.0,
+            "retained_kib": (current - base_current) / 1024.0,
+        })
+    return result
+
+
+def format_result(r):
+    lines = [
+        f"── {r['name']} ──",
+        f"  messages      : {r['count']}   publishes: {r['publishes']}",
+        f"  latency (ms)  : p50={r['p50_ms']:.3f}  p99={r['p99_ms']:.3f}  max={r['max_ms']:.3f}  mean={r['mean_ms']:.3f}",
+        f"  throughput    : {r['throughput_msg_s']:.1f} msg/s offered, {r['capacity_msg_s']:.1f} msg/s handler capacity",
+        f"  wall time     : {r['wall_s']:.3f}s",
+        f"  dedup         : hits={r['dedup']['hits']}  misses={r['dedup']['misses']}  "
+        f"evictions={r['dedup']['evictions']}  expirations={r['dedup']['expirations']}",
+        f"  scheduler     : requests={r['scheduler']['requests']}  flushes={r['scheduler']['flushes']}  "
+        f"sent={r['scheduler']['sent']}  skipped={r['scheduler']['skipped']}",
+        "  stages (ms)   : " + "  ".join(f"{name}={st['avg_ms']:.4f}/{st['max_ms']:.3f}"
+                                         for name, st in r["stages"].items() if st["count"]) + "  (avg/max)",
+    ]
+    if "alloc_peak_mean_kib" in r:
+        lines.append(f"  allocations   : peak/msg mean={r['alloc_peak_mean_kib']:.1f} KiB  "
+                     f"max={r['alloc_peak_max_kib']:.1f} KiB  retained={r['retained_kib']:.1f} KiB")
+    return "\n".join(lines)
+
+
+# ─── ENTRY POINT ────────────────────────────────────────────────────────────
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Replay recorded Pushy captures and measure handler latency.")
+    ap.add_argument("captures", nargs="*", default=[os.path.join("data_examples", "test_data.jsonl")],
+                    help="capture files in '<iso-ts> [mqtt-host] {json}' format")
+    ap.add_argument("--target", choices=("app", "script", "both"), default="both")
+    ap.add_argument("--speed", type=float, default=0.0,
+                    help="0 = as fast as possible (default), 1 = real time, N = accelerated ×N")
+    ap.add_argument("--segments", default=",".join(DEFAULT_SEGMENTS),
+                    help="comma separated city ids or names to follow, or 'all' for every id in the capture")
+    ap.add_argument("--repeat", type=int, default=1, help="replay the capture N times (ids are made unique)")
+    ap.add_argument("--trace-alloc", action="store_true", help="measure allocations with tracemalloc (slower)")
+    ap.add_argument("--log-level", default="WARNING", help="log level for the replayed handlers")
+    ap.add_argument("--json", action="store_true", help="print results as JSON")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)5s %(message)s")
+
+    events = load_capture(args.captures)
+    if not events:
+        logger.error("No events to replay.")
+        return 1
+
+    if args.segments == "all":
+        segments = {c for ev in events for c in ev.payload.get("citiesIds", "").split(",") if c}
+    else:
+        segments = {s.strip() for s in args.segments.split(",") if s.strip()}
+
+    logger.info(f"Replaying {len(events)} events ×{args.repeat} for {len(segments)} segments "
+                f"(speed={'max' if args.speed <= 0 else args.speed})")
+
+    names = ("app", "script") if args.target == "both" else (args.target,)
+    results = []
+    for name in names:
+        try:
+            target = TARGETS[name](segments, args.log_level.upper())
+        except ImportError as e:
+            logger.error(f"Cannot load target '{name}': {e}")
+            continue
+        try:
+            results.append(replay(events, target, speed=args.speed, repeat=args.repeat,
+                                  trace_alloc=args.trace_alloc))
+        finally:
+            target.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for r in results:
+            print(format_result(r))
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
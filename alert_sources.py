@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+alert_sources.py
+
+Redundant alert sources and their first-arrival-wins merge, shared by
+missile_alerts_app.py and mqttest.py.
+
+The Pushy MQTT listener stays the primary source. Additional sources run
+next to it and feed the same AlertPipeline through `sink(payload, source)`,
+with payloads normalised to the Pushy message shape (title, citiesIds, time,
+id, alertTitle, ...), so dedup, filtering and state handling are shared.
+
+  - AlertSource: abstract base (start / stop / stats); a source implements
+    its thread body, _run().
+  - HttpPollSource: polls a JSON endpoint in the format of the public
+    alerts.json ({"id", "cat", "title", "desc", "data": [city names]}) and
+    emits each alert once, plus again for cities added to it later. Point
+    `url` at a local stand-in to test it offline.
+  - SourceMerger: the sources carry different ids for the same alert, so
+    they are merged on (title category, segment id). The first source to
+    report a key owns it for `window_s`; the same key from another source
+    inside the window is dropped as late and its lag behind the winner is
+    recorded. Repeats from the owning source are new alerts and pass.
+"""
+
+import abc
+import json
+import time
+import logging
+import threading
+import urllib.request
+from collections import OrderedDict
+
+from alert_time import DISPLAY_FORMAT
+from metrics import Histogram, AGE_BUCKETS
+
+PUSHY = "pushy"
+
+OREF_ALERTS_URL = "https://www.oref.org.il/WarningMessages/alert/alerts.json"
+OREF_HEADERS = {
+    "Referer": "https://www.oref.org.il/",
+    "X-Requested-With": "XMLHttpRequest",
+    "User-Agent": "Mozilla/5.0",
+    "Accept": "application/json",
+}
+
+
+class AlertSource(abc.ABC):
+    """A feed that pushes payloads into `sink(payload, source_name)` from its own thread."""
+
+    name = "source"
+
+    def __init__(self, sink, *, name=None, logger=None):
+        self.sink = sink
+        self.name = name or self.name
+        self.logger = logger or logging.getLogger("missile_alerts")
+        self._thread = None
+        self._stop = threading.Event()
+        self.emitted = 0
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"AlertSource-{self.name}")
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+
+    @abc.abstractmethod
+    def _run(self):
+        """The source thread: emits payloads via _emit() until `_stop` is set."""
+
+    def _emit(self, payload):
+        self.emitted += 1
+        self.sink(payload, self.name)
+
+    def stats(self):
+        return {"emitted": self.emitted}
+
+
+class HttpPollSource(AlertSource):
+    name = "oref_http"
+
+    def __init__(self, sink, url, resolve, *, interval_s=1.0, timeout=3.0, max_backoff_s=30.0,
+                 headers=None, name=None, logger=None):
+        """resolve(city_name) -> list of segment ids (CityRegistry.ids_for)."""
+        super().__init__(sink, name=name, logger=logger)
+        self.url = url
+        self.resolve = resolve
+        self.interval_s = interval_s
+        self.timeout = timeout
+        self.max_backoff_s = max_backoff_s
+        self.headers = dict(OREF_HEADERS if headers is None else headers)
+        self._cities_of = OrderedDict()  # alert id -> city names already handled, newest last
+        self._delay = interval_s
+
+        self.polls = 0
+        self.errors = 0
+        self.unresolved = 0
+        self.last_ok = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            t0 = time.monotonic()
+            delay = self.poll_once()
+            self._stop.wait(max(0.0, delay - (time.monotonic() - t0)))
+
+    def poll_once(self):
+        """Polls once; returns the delay before the next poll (backing off exponentially on errors)."""
+        try:
+            self.poll()
+            self._delay = self.interval_s
+        except Exception as e:
+            self.errors += 1
+            self._delay = min(max(self._delay, self.interval_s) * 2, self.max_backoff_s)
+            self.logger.warning(f"Alert source '{self.name}' poll failed ({e}); retrying in {self._delay:.1f}s")
+        return self._delay
+
+    def fetch(self):
+        """Returns the decoded alerts at `url` (a list, empty when there is no active alert)."""
+        request = urllib.request.Request(self.url, headers=self.headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+            body = resp.read().decode("utf-8-sig").strip()
+        self.polls += 1
+        self.last_ok = time.time()
+        if not body:
+            return []
+        doc = json.loads(body)
+        return doc if isinstance(doc, list) else [doc]
+
+    def poll(self):
+        now = time.time()
+        for alert in self.fetch():
+            payload = self.normalize(alert, now)
+            if payload is not None:
+                self._emit(payload)
+
+    def normalize(self, alert, now):
+        """Pushy-shaped payload for the cities of `alert` not emitted before (None if there are none)."""
+        aid = str(alert.get("id") or "").strip()
+        if not aid:
+            return None
+        seen = self._cities_of.get(aid)
+        if seen is None:
+            seen = self._cities_of[aid] = set()
+            while len(self._cities_of) > 256:
+                self._cities_of.popitem(last=False)
+        new_ids = []
+        for city in alert.get("data") or ():
+            if city in seen:
+                continue
+            seen.add(city)
+            ids = self.resolve(city)
+            if not ids:
+                self.unresolved += 1
+            new_ids.extend(ids)
+        if not new_ids:
+            return None
+        return {
+            "id": aid,
+            "alertTitle": f"{self.name}:{aid}:{len(seen)}",
+            "title": alert.get("title", ""),
+            "desc": alert.get("desc", ""),
+            "cat": str(alert.get("cat", "")),
+            "threatId": "",
+            "citiesIds": ",".join(new_ids),
+            "time": time.strftime(DISPLAY_FORMAT, time.localtime(now)),
+        }
+
+    def stats(self):
+        return {"emitted": self.emitted, "polls": self.polls, "errors": self.errors,
+                "unresolved": self.unresolved, "last_ok": self.last_ok}
+
+
+class SourceMerger:
+    def __init__(self, sources, window_s=30.0, capacity=10000, *, registry=None, clock=time.monotonic):
+        """
+        sources: the source names; registry: optional MetricsRegistry for per-source metrics.
+        claim() is only called from the pipeline worker thread.
+        """
+        self.window_s = window_s
+        self.capacity = capacity
+        self._clock = clock
+        self._owners = OrderedDict()  # key -> [source, claimed at], oldest first
+        self.first = {name: 0 for name in sources}
+        self.late = {name: 0 for name in sources}
+        self.lag = {}
+        for name in sources:
+            if registry is not None:
+                self.lag[name] = registry.histogram(f"source_{name}_lag_seconds",
+                                                    f"How far '{name}' arrived behind the first source",
+                                                    AGE_BUCKETS)
+                registry.gauge(f"source_{name}_first_total", f"Alerts first reported by '{name}'",
+                               lambda n=name: self.first[n], kind="counter")
+                registry.gauge(f"source_{name}_late_total", f"Alerts '{name}' reported after another source",
+                               lambda n=name: self.late[n], kind="counter")
+            else:
+                self.lag[name] = Histogram(AGE_BUCKETS)
+
+    def claim(self, source, key):
+        """True if `source` reported `key` first (or owns it); False if another source already did."""
+        now = self._clock()
+        owners = self._owners
+        deadline = now - self.window_s
+        while owners:
+            oldest = next(iter(owners.values()))
+            if oldest[1] > deadline:
+                break
+            owners.popitem(last=False)
+
+        owner = owners.get(key)
+        if owner is not None and owner[0] != source:
+            self.late[source] = self.late.get(source, 0) + 1
+            if source in self.lag:
+                self.lag[source].observe(now - owner[1])
+            return False
+        if owner is None:
+            self.first[source] = self.first.get(source, 0) + 1
+        else:
+            owners.move_to_end(key)
+        owners[key] = [source, now]
+        while len(owners) > self.capacity:
+            owners.popitem(last=False)
+        return True
+
+    def stats(self):
+        out = {}
+        for name in self.first:
+            lag = self.lag.get(name)
+            out[name] = {
+                "first": self.first[name],
+                "late": self.late.get(name, 0),
+                "avg_lag_s": round(lag.sum / lag.count, 3) if lag and lag.count else None,
+            }
+        return out
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+alert_time.py
+
+Fast parser for the Pushy `time` field, shared by missile_alerts_app.py and
+mqttest.py.
+
+Pushy sends `2025-06-18T02:30:58+0300`; older payloads used
+`2025-06-18 02:30:58` (local time). Both go through the C implementation of
+datetime.fromisoformat (strptime is only a fallback for Pythons older than
+3.11), the epoch is converted to local time once via time.localtime instead
+of astimezone(), and results are cached on the raw string, since during a
+storm many alerts share the same second.
+
+parse_alert_time() returns (epoch_seconds, display) where `display` is the
+local "%Y-%m-%d %H:%M:%S" string published to Home Assistant as alertDate.
+
+Run this file directly for a micro-benchmark against the previous
+fromisoformat/strptime + astimezone code:
+    python3 alert_time.py [data_examples/test_data.jsonl]
+"""
+
+import sys
+import time
+from datetime import datetime
+from functools import lru_cache
+
+DISPLAY_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@lru_cache(maxsize=512)
+def parse_alert_time(raw_time):
+    """
+    Parses a Pushy time string into (epoch_seconds, local display string).
+    Raises ValueError if the string is not a recognised time.
+    """
+    try:
+        # C fast path; accepts "+0300" (no colon) on Python 3.11+.
+        dt = datetime.fromisoformat(raw_time)
+    except ValueError:
+        dt = datetime.strptime(raw_time, "%Y-%m-%dT%H:%M:%S%z")
+    epoch = dt.timestamp()  # naive values are local time, as before
+    return epoch, time.strftime(DISPLAY_FORMAT, time.localtime(epoch))
+
+
+def parse_display_time(display):
+    """Inverse of the display string: local "%Y-%m-%d %H:%M:%S" → epoch seconds."""
+    return parse_alert_time(display)[0]
+
+
+# ─── MICRO-BENCHMARK ────────────────────────────────────────────────────────
+
+def _legacy_parse(raw_time, now):
+    """The parsing code this module replaced, kept for the benchmark only."""
+    if "T" in raw_time:
+        try:
+            dt_object = datetime.fromisoformat(raw_time)
+        except ValueError:
+            dt_object = datetime.strptime(raw_time, "%Y-%m-%dT%H:%M:%S%z")
+    else:
+        dt_object = datetime.strptime(raw_time, "%Y-%m-%d %H:%M:%S")
+    dt_naive = dt_object.astimezone(None).replace(tzinfo=None)
+    return (now - dt_naive).total_seconds(), dt_naive.strftime(DISPLAY_FORMAT)
+
+
+def _benchmark(path, rounds=20):
+    import json
+    import timeit
+
+    samples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                samples.append(json.loads(line.split(" ", 2)[2])["time"])
+            except (IndexError, ValueError, KeyError):
+                continue
+    if not samples:
+        print(f"No `time` fields found in {path}")
+        return 1
+
+    now = datetime.now()
+    now_ts = time.time()
+    for raw in set(samples):
+        legacy_latency, legacy_display = _legacy_parse(raw, now)
+        epoch, display = parse_alert_time(raw)
+        assert display == legacy_display, (raw, display, legacy_display)
+        assert abs((now_ts - epoch) - legacy_latency) < 1.0, raw
+
+    def legacy():
+        for raw in samples:
+            _legacy_parse(raw, now)
+
+    def cached():
+        for raw in samples:
+            parse_alert_time(raw)
+
+    def uncached():
+        for raw in samples:
+            parse_alert_time.__wrapped__(raw)
+
+    print(f"{len(samples)} samples ({len(set(samples))} distinct) from {path}, best of {rounds}:")
+    for name, fn in (("legacy", legacy), ("fast path", uncached), ("fast path + LRU", cached)):
+        best = min(timeit.repeat(fn, number=1, repeat=rounds))
+        print(f"  {name:16s}: {best / len(samples) * 1e6:7.3f} µs/parse")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_benchmark(sys.argv[1] if len(sys.argv) > 1 else "data_examples/test_data.jsonl"))
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+city_registry.py
+
+City / segment registry built from cities.json, shared by
+missile_alerts_app.py and mqttest.py.
+
+Gives every published entry its Hebrew name without a hand-maintained
+name_map, and lets `segments` be configured by name:
+
+    segments:
+      - "קריית מוצקין"          # exact name
+      - "חיפה"                  # parent city, same as "חיפה (ראשי)"
+      - "5001878"               # ids keep working
+
+The parsed table is kept as two parallel tuples (ids, names) plus an
+id → name dict, and a sorted list of normalised names (with the matching
+row order) for exact and prefix lookups with bisect. The whole built index
+is cached in a marshal file next to the other storage, keyed by the size
+and mtime of cities.json, so a restart neither parses JSON nor re-sorts.
+"""
+
+import os
+import re
+import json
+import bisect
+import marshal
+import logging
+
+from storage import atomic_write
+
+CACHE_VERSION = 1
+PARENT_SUFFIX = " (ראשי)"
+
+_DASHES = re.compile(r"\s*[-‐-―−]+\s*")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_name(name):
+    """Collapses whitespace and unifies dash variants to " - "."""
+    return _DASHES.sub(" - ", _SPACES.sub(" ", name).strip())
+
+
+class CityRegistry:
+    def __init__(self, ids, names, keys=None, order=None):
+        """keys/order: prebuilt sorted normalised names and their row indexes (from the cache)."""
+        self.ids = tuple(ids)
+        self.names = tuple(names)
+        self._name_of = dict(zip(self.ids, self.names))
+        if keys is None:
+            index = sorted((normalize_name(n), i) for i, n in enumerate(self.names))
+            keys = [key for key, _ in index]
+            order = [i for _, i in index]
+        self._keys = keys
+        self._order = order
+
+    # ─── LOADING ────────────────────────────────────────────────────────────
+
+    @classmethod
+    def load(cls, cities_file, cache_file=None, logger=None):
+        """Loads from `cache_file` if it matches `cities_file`, else parses and rewrites the cache."""
+        logger = logger or logging.getLogger("missile_alerts")
+        try:
+            st = os.stat(cities_file)
+        except OSError as e:
+            logger.warning(f"Cities file {cities_file} not available ({e}); segment names are unknown")
+            return cls((), ())
+        stamp = (CACHE_VERSION, st.st_size, st.st_mtime_ns)
+
+        if cache_file:
+            try:
+                with open(cache_file, "rb") as f:
+                    cached = marshal.loads(f.read())  # much faster than marshal.load(f)
+                if tuple(cached[0]) == stamp:
+                    return cls(*cached[1:])
+            except FileNotFoundError:
+                pass
+            except (OSError, EOFError, ValueError, TypeError, IndexError) as e:
+                logger.warning(f"Ignoring unreadable city cache {cache_file}: {e}")
+
+        with open(cities_file, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        registry = cls((str(r["id"]) for r in rows), (r["name"] for r in rows))
+        if cache_file:
+            try:
+                atomic_write(cache_file, marshal.dumps(
+                    (stamp, registry.ids, registry.names, registry._keys, registry._order)))
+            except OSError as e:
+                logger.warning(f"Could not write city cache {cache_file}: {e}")
+        return registry
+
+    # ─── LOOKUPS ────────────────────────────────────────────────────────────
+
+    def name(self, city_id, default=None):
+        return self._name_of.get(str(city_id), default)
+
+    def ids_for(self, name):
+        """Ids whose name equals `name` (normalised); a bare parent name also matches "<name> (ראשי)"."""
+        key = normalize_name(name)
+        out = []
+        for wanted in (key, key + PARENT_SUFFIX):
+            pos = bisect.bisect_left(self._keys, wanted)
+            while pos < len(self._keys) and self._keys[pos] == wanted:
+                out.append(self.ids[self._order[pos]])
+                pos += 1
+        return out
+
+    def search(self, prefix, limit=20):
+        """(id, name) pairs whose name starts with `prefix`, in name order."""
+        key = normalize_name(prefix)
+        pos = bisect.bisect_left(self._keys, key)
+        out = []
+        while pos < len(self._keys) and self._keys[pos].startswith(key) and len(out) < limit:
+            i = self._order[pos]
+            out.append((self.ids[i], self.names[i]))
+            pos += 1
+        return out
+
+    def resolve(self, segments, logger=None):
+        """
+        Turns configured segments (ids or names) into a set of ids.
+        Unknown names are logged with suggestions and skipped.
+        """
+        logger = logger or logging.getLogger("missile_alerts")
+        resolved = set()
+        unknown_ids = []
+        for seg in segments:
+            seg = str(seg).strip()
+            if seg.isdigit():
+                if self._name_of and seg not in self._name_of:
+                    unknown_ids.append(seg)
+                resolved.add(seg)
+                continue
+            ids = self.ids_for(seg)
+            if ids:
+                resolved.update(ids)
+                continue
+            matches = self.search(seg, limit=5)
+            hint = ", ".join(f"{n} ({i})" for i, n in matches) or "no city starts with that name"
+            logger.error(f"Unknown segment name '{seg}'; did you mean: {hint}")
+        if unknown_ids:
+            shown = ", ".join(sorted(unknown_ids)[:10]) + (" ..." if len(unknown_ids) > 10 else "")
+            logger.warning(f"{len(unknown_ids)} segment id(s) not in cities.json (kept, published without a name): "
+                           f"{shown}")
+        return resolved
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, city_id):
+        return str(city_id) in self._name_of
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+expiry_scheduler.py
+
+Deadline-based expiry for active alert entries, shared by
+missile_alerts_app.py and mqttest.py.
+
+Every entry is scheduled once with its precomputed expiry deadline (epoch
+seconds) on a min-heap. A single thread sleeps exactly until the earliest
+deadline, pops everything that is due and hands it to `on_expire(items)` in
+one call, so the caller removes only those entries and republishes once.
+Nothing is re-parsed and nothing wakes up while there is nothing to expire.
+
+Cancellation is lazy: items that are no longer in the caller's state when
+they come due are simply not found there.
+"""
+
+import time
+import heapq
+import logging
+import itertools
+import threading
+
+MAX_SLEEP_S = 60.0  # Re-check at least this often in case the wall clock jumps
+
+
+class ExpiryScheduler:
+    def __init__(self, on_expire, *, clock=time.time, logger=None):
+        self._on_expire = on_expire
+        self._clock = clock
+        self.logger = logger or logging.getLogger("missile_alerts")
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+        self.scheduled = 0
+        self.fired = 0
+
+    # ─── LIFECYCLE ──────────────────────────────────────────────────────────
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="AlertExpiryScheduler")
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    # ─── SCHEDULING ─────────────────────────────────────────────────────────
+
+    def schedule(self, deadline, item):
+        """Expires `item` at `deadline` (epoch seconds)."""
+        with self._cond:
+            wake = not self._heap or deadline < self._heap[0][0]
+            heapq.heappush(self._heap, (deadline, next(self._seq), item))
+            self.scheduled += 1
+            if wake:
+                self._cond.notify()
+
+    def next_deadline(self):
+        with self._cond:
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def pop_due(self, now=None):
+        """Removes and returns all items whose deadline has passed."""
+        now = self._clock() if now is None else now
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[2])
+        return due
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - self._clock()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(min(delay, MAX_SLEEP_S))
+                if self._stopping:
+                    return
+            due = self.pop_due()
+            if not due:
+                continue
+            self.fired += len(due)
+            try:
+                self._on_expire(due)
+            except Exception as e:
+                self.logger.error(f"Alert expiry callback failed: {e}")
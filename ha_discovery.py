@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+ha_discovery.py
+
+Home Assistant MQTT discovery for the alert sensors, shared by
+missile_alerts_app.py and mqttest.py.
+
+Every sensor (the combined STATE_TOPIC/ATTR_TOPIC pair and each output
+group) is announced as a binary_sensor with a retained config message on
+    <discovery prefix>/binary_sensor/<node id>/<object id>/config
+so Home Assistant creates the entities by itself; no hand-written
+configuration.yaml entries are needed. State and attributes are published
+retained as well, and every sensor points at one availability topic
+("online"/"offline"), so after a Home Assistant or broker restart the
+sensors come back with their last state immediately instead of being
+"unknown" until the next alert.
+
+The "offline" mark on a crash needs a broker last will, which only a
+process with its own MQTT connection can register (mqttest.py). The
+AppDaemon app publishes through call_service instead, so it passes
+`expire_after` and re-sends the state topics on a heartbeat: if the app
+dies, Home Assistant marks the sensors unavailable once the heartbeat stops.
+
+The configs are returned as ordinary (topic, payload) pairs so they go
+through the publish scheduler like the state: sent once, and again only
+after the scheduler forgets what it sent (e.g. on an HA broker reconnect).
+"""
+
+import re
+import json
+import hashlib
+
+DISCOVERY_PREFIX = "homeassistant"
+NODE_ID = "missile_alerts"
+ONLINE = "online"
+OFFLINE = "offline"
+
+_UNSAFE = re.compile(r"[^a-zA-Z0-9_-]+")
+
+
+def object_id(state_topic):
+    """An ASCII id for a sensor, derived from its (unique) state topic."""
+    slug = _UNSAFE.sub("_", state_topic).strip("_")
+    if not re.search(r"[a-zA-Z0-9]", slug):
+        slug = hashlib.sha1(state_topic.encode("utf-8")).hexdigest()[:12]
+    return slug
+
+
+def sensor_config(name, state_topic, attr_topic, availability_topic, *, node_id=NODE_ID, device_name="Missile Alerts",
+                  expire_after=None):
+    """The discovery config payload of one binary sensor (unavailable after `expire_after` s without a state)."""
+    oid = object_id(state_topic)
+    config = {
+        "name": name,
+        "unique_id": oid if oid.startswith(node_id) else f"{node_id}_{oid}",
+        "object_id": oid,
+        "state_topic": state_topic,
+        "json_attributes_topic": attr_topic,
+        "payload_on": "1",
+        "payload_off": "0",
+        "device_class": "safety",
+        "availability_topic": availability_topic,
+        "payload_available": ONLINE,
+        "payload_not_available": OFFLINE,
+        "device": {
+            "identifiers": [node_id],
+            "name": device_name,
+            "manufacturer": "pikud_haoref_mqtt",
+            "model": "Pushy alert listener",
+        },
+    }
+    if expire_after:
+        config["expire_after"] = int(expire_after)
+    return config
+
+
+def discovery_payloads(sensors, availability_topic, *, prefix=DISCOVERY_PREFIX, node_id=NODE_ID,
+                       device_name="Missile Alerts", expire_after=None):
+    """
+    sensors: iterable of (name, state_topic, attr_topic).
+    Returns ((config topic, JSON payload), ...) ready to be published retained.
+    """
+    out = []
+    for name, state_topic, attr_topic in sensors:
+        config = sensor_config(name, state_topic, attr_topic, availability_topic,
+                               node_id=node_id, device_name=device_name, expire_after=expire_after)
+        topic = f"{prefix}/binary_sensor/{node_id}/{config['object_id']}/config"
+        out.append((topic, json.dumps(config, ensure_ascii=False, sort_keys=True)))
+    return tuple(out)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+log_sink.py
+
+Cheap logging helpers for the receive path, shared by missile_alerts_app.py
+and mqttest.py.
+
+  - lazy(fn): an argument that is only rendered if the log line is emitted,
+    for use with %-style logger calls.
+  - RateSampler: lets the first `limit` events per key and interval through
+    and reports how many were suppressed when the next interval starts.
+  - CaptureSink: writes raw notifications to a rotating JSONL capture file in
+    the same format as data_examples/test_data.jsonl:
+        <UTC ISO time> [<broker host>] <raw JSON payload>
+    The receive thread only appends to a bounded deque; a writer thread
+    formats, writes in batches and rotates (capture.jsonl → .1 → .2 ...).
+    The result can be replayed with alert_replay.py.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+
+class lazy:
+    """Defers `fn()` until the logging framework formats the message."""
+
+    __slots__ = ("fn",)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __str__(self):
+        return str(self.fn())
+
+
+class RateSampler:
+    def __init__(self, limit, interval_s=1.0, clock=time.monotonic):
+        """limit <= 0 lets everything through."""
+        self.limit = limit
+        self.interval_s = interval_s
+        self._clock = clock
+        self._windows = {}  # key -> [window start, count]
+
+    def allow(self, key=None):
+        """
+        Returns (allowed, suppressed): `suppressed` is the number of events
+        dropped for `key` in the previous interval, reported once.
+        """
+        if self.limit <= 0:
+            return True, 0
+        now = self._clock()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval_s:
+            suppressed = max(0, window[1] - self.limit) if window else 0
+            self._windows[key] = [now, 1]
+            return True, suppressed
+        window[1] += 1
+        return window[1] <= self.limit, 0
+
+
+class CaptureSink:
+    def __init__(self, path, *, max_bytes=50 * 1024 * 1024, backups=3, flush_interval_s=1.0,
+                 max_queue=10000, rate_limit=0, logger=None):
+        """rate_limit: max captured messages per second (0 = capture everything)."""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval_s = flush_interval_s
+        self.logger = logger or logging.getLogger("missile_alerts")
+
+        self._queue = deque(maxlen=max_queue)
+        self._sampler = RateSampler(rate_limit)
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopping = False
+        self._file = None
+
+        self.captured = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    # ─── RECEIVE SIDE ───────────────────────────────────────────────────────
+
+    def write(self, raw, host, recv_ts=None):
+        """Queues one raw payload (bytes or str). Never touches the disk."""
+        if not self._sampler.allow()[0]:
+            self.sampled_out += 1
+            return
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1  # deque drops the oldest entry
+        self._queue.append((time.time() if recv_ts is None else recv_ts, host, raw))
+        if len(self._queue) >= 256:
+            self._wake.set()
+
+    # ─── WRITER THREAD ──────────────────────────────────────────────────────
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="CaptureSink")
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._drain()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+            try:
+                self._drain()
+            except OSError as e:
+                self.logger.error(f"Capture file write failed: {e}")
+
+    def _drain(self, batch=512):
+        while self._queue:
+            lines = []
+            while self._queue and len(lines) < batch:
+                try:
+                    ts, host, raw = self._queue.popleft()
+                except IndexError:
+                    break
+                if isinstance(raw, bytes):
+                    raw = raw.decode("utf-8", "replace")
+                stamp = datetime.fromtimestamp(ts, timezone.utc).isoformat()
+                lines.append(f"{stamp} [{host}] {raw.strip()}\n")
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", buffering=64 * 1024)
+            self._file.writelines(lines)
+            self._file.flush()
+            self.captured += len(lines)
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+
+    def stats(self):
+        return {"captured": self.captured, "sampled_out": self.sampled_out, "dropped": self.dropped,
+                "queued": len(self._queue), "rotations": self.rotations}
@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+"""
+loop_io.py
+
+asyncio counterparts of the threaded building blocks, used by the
+single-loop engine of the standalone script (alert_engine.py).
+
+  - LoopMqtt: drives a Paho client from the event loop (add_reader /
+    add_writer on its socket, loop_misc() once a second) instead of a
+    loop_forever() / loop_start() thread. Reading can be paused, which is
+    how the engine applies back-pressure to the broker.
+  - LoopHAPublisher: the single long-lived Home Assistant MQTT connection;
+    publishes are written straight to the socket while connected and kept
+    in a bounded queue while not.
+  - LoopPublishScheduler, LoopExpiryScheduler: the coalescing publish
+    scheduler and the deadline expiry with loop timers instead of a thread
+    waiting on a condition.
+  - LoopAlertPipeline: AlertPipeline with an asyncio queue and a worker task
+    that runs the stages in batches and yields to the loop between them.
+  - start_metrics_server: GET /metrics served by asyncio.start_server.
+
+Everything here must be used from the loop thread; the only exception is
+LoopMqtt's socket callbacks, which Paho may fire from the executor thread
+that runs the (blocking) connect, and which are handed over to the loop.
+"""
+
+import time
+import select
+import asyncio
+import logging
+import threading
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+from alert_pipeline import AlertPipeline, _STOP
+from expiry_scheduler import ExpiryScheduler, MAX_SLEEP_S
+from publish_scheduler import PublishScheduler
+
+MISC_INTERVAL_S = 1.0  # Paho keepalive / ping timeout checks
+READ_BATCH = 64  # Packets read per readiness event before yielding to the loop
+
+
+class LoopMqtt:
+    """Runs a Paho client's network I/O on an asyncio loop."""
+
+    def __init__(self, client, loop, *, name="mqtt", logger=None):
+        self.client = client
+        self.loop = loop
+        self.name = name
+        self.logger = logger or logging.getLogger("missile_alerts")
+
+        self._loop_thread = None
+        self._sock = None
+        self._reading = True
+        self._connecting = False
+        self._misc = None
+        self.closed = asyncio.Event()
+        self.closed.set()
+
+        self.pauses = 0
+
+        client.on_socket_open = lambda c, u, sock: self._in_loop(self._on_open, sock)
+        client.on_socket_close = lambda c, u, sock: self._in_loop(self._on_close, sock)
+        client.on_socket_register_write = lambda c, u, sock: self._in_loop(self._want_write, sock, True)
+        client.on_socket_unregister_write = lambda c, u, sock: self._in_loop(self._want_write, sock, False)
+
+    def _in_loop(self, fn, *args):
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self.loop.call_soon_threadsafe(fn, *args)
+
+    # ─── CONNECTION ─────────────────────────────────────────────────────────
+
+    async def connect(self, host, port, keepalive, executor=None):
+        """Connects (DNS, TCP and TLS run on `executor`); returns once the CONNECT packet is queued."""
+        self._loop_thread = threading.get_ident()
+        if self._misc is None:
+            self._misc = self.loop.create_task(self._run_misc())
+        self.closed.clear()
+        self._connecting = True
+        try:
+            await self.loop.run_in_executor(executor, self.client.connect, host, port, keepalive)
+        except BaseException:
+            self.closed.set()
+            raise
+        finally:
+            self._connecting = False
+
+    def disconnect(self):
+        self.client.disconnect()
+
+    async def wait_closed(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.closed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def close(self):
+        """Stops the keepalive task; call after the connection is closed for good."""
+        if self._misc:
+            self._misc.cancel()
+            self._misc = None
+
+    async def _run_misc(self):
+        while True:
+            await asyncio.sleep(MISC_INTERVAL_S)
+            if not self._connecting:
+                self.client.loop_misc()
+
+    # ─── SOCKET CALLBACKS ───────────────────────────────────────────────────
+
+    def _on_open(self, sock):
+        self._sock = sock
+        if self._reading:
+            self.loop.add_reader(sock, self._read)
+
+    def _on_close(self, sock):
+        if sock is self._sock:
+            self.loop.remove_reader(sock)
+            self.loop.remove_writer(sock)
+            self._sock = None
+        self.closed.set()
+
+    def _want_write(self, sock, on):
+        if sock is not self._sock:
+            return
+        if on:
+            self.loop.add_writer(sock, self.client.loop_write)
+        else:
+            self.loop.remove_writer(sock)
+
+    @staticmethod
+    def _buffered(sock):
+        """TLS: bytes already decrypted into the SSL buffer; the selector never reports them."""
+        pending = getattr(sock, "pending", None)
+        return bool(pending and pending())
+
+    def _read(self):
+        # Paho reads one packet per call; keep reading while more is buffered (up to READ_BATCH)
+        # instead of paying a full loop iteration per packet
+        if not self._reading or self._sock is None:
+            return  # paused or closed since this read was scheduled
+        client = self.client
+        for _ in range(READ_BATCH):
+            client.loop_read()
+            sock = self._sock
+            if not self._reading or sock is None:
+                return
+            if not self._buffered(sock) and not select.select((sock,), (), (), 0)[0]:
+                return
+        # Batch used up: bytes left in the kernel wake the reader again, decrypted ones would not
+        if self._buffered(self._sock):
+            self.loop.call_soon(self._read)
+
+    # ─── BACK-PRESSURE ──────────────────────────────────────────────────────
+
+    def pause_reading(self):
+        """Stops reading the socket; the broker is throttled by TCP flow control and missing PUBACKs."""
+        if not self._reading:
+            return
+        self._reading = False
+        self.pauses += 1
+        if self._sock is not None:
+            self.loop.remove_reader(self._sock)
+
+    def resume_reading(self):
+        if self._reading:
+            return
+        self._reading = True
+        if self._sock is not None:
+            self.loop.add_reader(self._sock, self._read)
+            if self._buffered(self._sock):
+                self.loop.call_soon(self._read)  # arrived (and was decrypted) before the pause
+
+    @property
+    def reading(self):
+        return self._reading
+
+
+class LoopHAPublisher:
+    """
+    One Paho client to the Home Assistant broker that stays connected and
+    reconnects with backoff, instead of a connection per alert. publish()
+    never waits on the network; while disconnected, messages are queued and
+    the oldest one is dropped when the queue is full, since for HA state the
+    newest value is the one that matters.
+
+    `will=(topic, payload)` registers a retained last will (the "offline"
+    availability payload) that the broker publishes if this process dies
+    without disconnecting. `on_connect()` is called after every successful
+    (re)connect, so the caller can re-send its retained state.
+    """
+
+    def __init__(self, loop, host, port=1883, username="", password="", *,
+                 client_id="home-assistant-publisher", keepalive=60, max_queue=1000, will=None,
+                 on_connect=None, executor=None, max_backoff_s=30.0, logger=None):
+        self.loop = loop
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.max_backoff_s = max_backoff_s
+        self.logger = logger or logging.getLogger("missile_alerts")
+        self.on_connected = on_connect
+        self._executor = executor
+
+        self._queue = deque()  # publishes waiting for a connection
+        self._max_queue = max_queue
+        self._connected = False
+        self._stopping = False
+        self._task = None
+        self._backoff = 1.0
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self.client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        if username:
+            self.client.username_pw_set(username, password)
+        if will:
+            self.client.will_set(will[0], will[1], qos=1, retain=True)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.io = LoopMqtt(self.client, loop, name="ha", logger=self.logger)
+
+    # ─── LIFECYCLE ──────────────────────────────────────────────────────────
+
+    def start(self):
+        """Connects in the background and keeps reconnecting with backoff."""
+        if self._task is None:
+            self._task = self.loop.create_task(self._run())
+
+    async def stop(self, timeout=5):
+        """Flushes what can be flushed within `timeout` seconds, then disconnects."""
+        deadline = time.monotonic() + timeout
+        while self._connected and self.client.want_write() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._connected:
+            self.io.disconnect()
+            await self.io.wait_closed(max(0.1, deadline - time.monotonic()))
+        self.io.close()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await self.io.connect(self.host, self.port, self.keepalive, self._executor)
+                await self.io.closed.wait()
+            except Exception as e:
+                self.logger.error(f"Home Assistant MQTT connection to {self.host}:{self.port} failed: {e}")
+            if self._stopping:
+                return
+            await asyncio.sleep(self._backoff)
+            self._backoff = min(self._backoff * 2, self.max_backoff_s)
+
+    # ─── PUBLISHING ─────────────────────────────────────────────────────────
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Writes the message to the connection, or queues it until the next connect; returns immediately."""
+        if not self._connected:
+            if len(self._queue) >= self._max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((topic, payload, qos, retain))
+            return
+        info = self.client.publish(topic, payload, qos=qos, retain=retain)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS:
+            self.sent += 1
+        else:
+            self.failed += 1
+            self.logger.warning(f"HA publish to {topic} failed (rc: {info.rc})")
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    # ─── CALLBACKS ──────────────────────────────────────────────────────────
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code != 0:
+            self.logger.error(f"Home Assistant MQTT connection failed: {reason_code}. Retrying with backoff.")
+            return
+        self.logger.info(f"Connected to Home Assistant MQTT broker {self.host}:{self.port}")
+        self._connected = True
+        self._backoff = 1.0
+        while self._queue:
+            self.publish(*self._queue.popleft())
+        if self.on_connected:
+            try:
+                self.on_connected()
+            except Exception as e:
+                self.logger.error(f"Home Assistant on-connect handler failed: {e}")
+
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        was_connected, self._connected = self._connected, False
+        if was_connected and not self._stopping:
+            self.logger.warning(f"Disconnected from Home Assistant MQTT (rc: {reason_code}). Reconnecting...")
+
+
+class LoopPublishScheduler(PublishScheduler):
+    """PublishScheduler whose coalescing window is a loop timer; urgent requests flush right away."""
+
+    def __init__(self, loop, render, send, window_s=0.1, logger=None, on_latency=None):
+        super().__init__(render, send, window_s, logger=logger, on_latency=on_latency)
+        self._loop = loop
+        self._timer = None
+
+    def start(self):
+        pass
+
+    def stop(self, flush=True):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if flush and self._deadline is not None:
+            self.flush()
+
+    def request(self, urgent=False, since=None):
+        super().request(urgent, since)
+        if urgent:
+            self._fire()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(self.window_s, self._fire)
+
+    def _fire(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self.flush()
+
+
+class LoopExpiryScheduler(ExpiryScheduler):
+    """ExpiryScheduler with one loop timer armed for the earliest deadline."""
+
+    def __init__(self, loop, on_expire, *, clock=time.time, logger=None):
+        super().__init__(on_expire, clock=clock, logger=logger)
+        self._loop = loop
+        self._timer = None
+        self._timer_deadline = None
+        self._started = False
+
+    def start(self):
+        self._started = True
+        self._arm()
+
+    def stop(self):
+        self._started = False
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def schedule(self, deadline, item):
+        super().schedule(deadline, item)
+        if self._started and (self._timer is None or deadline < self._timer_deadline):
+            self._arm()
+
+    def _arm(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        deadline = self.next_deadline()
+        if deadline is None or not self._started:
+            return
+        self._timer_deadline = deadline
+        # Capped so a wall clock jump is noticed, like the threaded scheduler
+        self._timer = self._loop.call_later(min(max(0.0, deadline - self._clock()), MAX_SLEEP_S), self._fire)
+
+    def _fire(self):
+        self._timer = None
+        due = self.pop_due()
+        if due:
+            self.fired += len(due)
+            try:
+                self._on_expire(due)
+            except Exception as e:
+                self.logger.error(f"Alert expiry callback failed: {e}")
+        self._arm()
+
+
+class LoopAlertPipeline(AlertPipeline):
+    def __init__(self, stages, *, decode=None, maxsize=10000, batch=64, on_depth=None, logger=None):
+        """
+        submit() never blocks: a full queue drops (counted), which the caller avoids by
+        pausing its producer when on_depth(depth) reports a deep queue.
+        """
+        super().__init__(stages, decode=decode, maxsize=maxsize, logger=logger)
+        self._queue = asyncio.Queue(maxsize)
+        self._task = None
+        self.batch = max(1, int(batch))
+        self.on_depth = on_depth
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._work())
+
+    def stop(self, timeout=5):
+        """Stops the worker without processing what is still queued (see join())."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def join(self, timeout=5):
+        """Processes what is already queued, then stops the worker."""
+        if not self._task:
+            return
+        try:
+            self._queue.put_nowait(_STOP)
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self._task.cancel()
+        self._task = None
+
+    def submit(self, raw, source=None):
+        """Enqueues a raw MQTT payload (or a decoded dict); must be called on the loop thread."""
+        self.received += 1
+        try:
+            self._queue.put_nowait((time.perf_counter(), raw, source))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.logger.error(f"Alert pipeline queue full ({self._queue.maxsize}); dropped a message")
+            return
+        depth = self._queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if self.on_depth:
+            self.on_depth(depth)
+
+    async def _work(self):
+        queue = self._queue
+        while True:
+            item = await queue.get()
+            done = 0
+            while True:
+                if item is _STOP:
+                    return
+                self.process(item)
+                done += 1
+                if done >= self.batch or queue.empty():
+                    break
+                item = queue.get_nowait()
+            if self.on_depth:
+                self.on_depth(queue.qsize())
+            await asyncio.sleep(0)  # let sockets and timers run between batches
+
+
+async def start_metrics_server(registry, host="127.0.0.1", port=9108, *, logger=None):
+    """Serves `registry.render()` on GET /metrics from the loop; returns the asyncio server."""
+    logger = logger or logging.getLogger("missile_alerts")
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            path = parts[1].decode("latin-1").split("?", 1)[0] if len(parts) > 1 else ""
+            if path in ("/metrics", "/"):
+                status, body = "200 OK", registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+
+Counters, histograms and a Prometheus-style text endpoint for the alert
+path, shared by missile_alerts_app.py and mqttest.py.
+
+Counters and histograms take no lock when updated: each one is written from
+a single thread (the pipeline worker or the publish scheduler), and a reader
+at worst sees an observation that is half-applied to count and sum. Values
+that the components already count (dedup hits, queue depth, publish
+failures, reconnects, ...) are registered as callbacks and read only when
+the metrics are rendered, so they cost nothing on the hot path.
+
+    registry = MetricsRegistry()
+    stale = registry.counter("alerts_stale_total", "Alerts dropped as older than MAX_AGE_S")
+    registry.gauge("pipeline_queue_depth", "Messages waiting", pipeline.queue_depth)
+    MetricsServer(registry, "127.0.0.1", 9108).start()   # GET /metrics
+"""
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "missile_alerts_"
+
+# Seconds; alert time has one-second resolution, publish latency is sub-second
+AGE_BUCKETS = (0.5, 1, 2, 3, 5, 10, 20, 30, 60, 120)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (None if empty)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self._metrics = {}  # name -> (kind, help, Counter | Histogram | callable)
+
+    def _register(self, name, kind, help_text, metric):
+        if name in self._metrics:
+            raise ValueError(f"Metric {name!r} is already registered")
+        self._metrics[name] = (kind, help_text, metric)
+        return metric
+
+    def counter(self, name, help_text):
+        return self._register(name, "counter", help_text, Counter())
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._register(name, "histogram", help_text, Histogram(buckets))
+
+    def gauge(self, name, help_text, fn, kind="gauge"):
+        """A value read from `fn()` at render time; kind="counter" for monotonic values."""
+        return self._register(name, kind, help_text, fn)
+
+    # ─── EXPORT ─────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _value(metric):
+        value = metric() if callable(metric) else metric.value
+        return float(value or 0)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, (kind, help_text, metric) in self._metrics.items():
+            full = self.prefix + name
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            if kind == "histogram":
+                cumulative = 0
+                for bound, n in zip(metric.buckets, metric.counts):
+                    cumulative += n
+                    lines.append(f'{full}_bucket{{le="{bound:g}"}} {cumulative}')
+                lines.append(f'{full}_bucket{{le="+Inf"}} {metric.count}')
+                lines.append(f"{full}_sum {metric.sum:.6f}")
+                lines.append(f"{full}_count {metric.count}")
+                continue
+            try:
+                lines.append(f"{full} {self._value(metric):g}")
+            except Exception:
+                continue  # a callback whose component is not up yet
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Flat dict for logging or a Home Assistant sensor (histograms as count/avg/p95)."""
+        out = {}
+        for name, (kind, _, metric) in self._metrics.items():
+            if kind == "histogram":
+                p95 = metric.quantile(0.95)
+                out[name] = {
+                    "count": metric.count,
+                    "avg": round(metric.sum / metric.count, 4) if metric.count else None,
+                    "p95_le": p95 if p95 != float("inf") else None,  # None: above the last bucket
+                }
+                continue
+            try:
+                out[name] = self._value(metric)
+            except Exception:
+                out[name] = None
+        return out
+
+
+class MetricsServer:
+    """Serves `registry.render()` on GET /metrics from a daemon thread."""
+
+    def __init__(self, registry, host="127.0.0.1", port=9108, *, logger=None):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.logger = logger or logging.getLogger("missile_alerts")
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass  # scrapes would flood the app log
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True, name="MetricsServer")
+        self._thread.start()
+        self.logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
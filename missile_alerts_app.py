@@ -14,73 +14,187 @@ import socket
 import random
 import logging
 import threading
-from datetime import datetime, timezone, timedelta
-from collections import deque
 
-import requests
 import paho.mqtt.client as mqtt
 import appdaemon.plugins.hass.hassapi as hass
 
+from alert_processor import AlertProcessor
+from publish_scheduler import PublishScheduler
+from alert_pipeline import AlertPipeline
+from expiry_scheduler import ExpiryScheduler
+from pushy_client import PushyClient
+from subscriptions import SubscriptionReconciler
+from storage import Storage
+from state_journal import StateJournal
+from reconnect import ReconnectController
+from metrics import MetricsRegistry, MetricsServer, AGE_BUCKETS, LATENCY_BUCKETS
+from log_sink import CaptureSink
+from ha_discovery import OFFLINE
+from alert_sources import HttpPollSource, SourceMerger, PUSHY
+
 # ─── APPDAEMON CLASS ─────────────────────────────────────────────────────────
 
-class MissileAlertsApp(hass.Hass):
+class MissileAlertsApp(AlertProcessor, hass.Hass):
+    DEBUG_DROPS_ALERTS = True  # debug: only log the raw notifications
 
     def initialize(self):
         """Initialize the AppDaemon application."""
         self.log("🚀 Initializing Missile Alerts App...")
+        self._startup_t0 = time.perf_counter()
+        self.startup_timings = {}
+        self._load_config()
+        self._init_state()
+        self._restore_state()
+        self._startup_mark("state")
 
-        # --- Load Configuration from apps.yaml ---
-        self.config = self.args
-        self.DEBUG = self.config.get("debug", True)
-        self.API_HOST = self.config.get("api_host", "https://pushy.ioref.app")
-        self.APP_ID = self.config.get("app_id", "66c20ac875260a035a3af7b2")
-        self.SDK_VERSION = self.config.get("sdk_version", 10117)
-        self.ANDROID_SUFFIX = self.config.get("android_suffix", "-Xiaomi-2107113SI")
-        self.CONNECT_TIMEOUT = self.config.get("connect_timeout", 10)
-        self.KEEPALIVE_SEC = self.config.get("keepalive_sec", 300)
-        self.MQTT_TEMPLATE = self.config.get("mqtt_template", "mqtt-{timestamp}.ioref.io")
-        self.MQTT_PORT = self.config.get("mqtt_port", 443)
-        self.QOS = self.config.get("qos", 1)
-        self.MAX_AGE_S = self.config.get("max_age_s", 45)
-        self.EXPIRY_S = self.config.get("expiry_s", 600)
-        self.SEGMENTS = set(self.config.get("segments", {}))
-
-        # --- Home Assistant Topic Config ---
-        # NOTE: Using a single, combined sensor for simplicity based on your AppDaemon script
-        self.STATE_TOPIC = self.config.get("state_topic", "missile_alerts/5001347_5001878")
-        self.ATTR_TOPIC = self.config.get("attr_topic", "missile_alerts/5001347_5001878_attr")
-        
-        # --- App-Specific Storage ---
-        self.STORAGE_DIR = os.path.join(self.app_dir, "missile_alerts_storage")
-        os.makedirs(self.STORAGE_DIR, exist_ok=True)
-        self.TOKEN_FILE = os.path.join(self.STORAGE_DIR, "token.json")
-        self.ANDROID_ID_FILE = os.path.join(self.STORAGE_DIR, "android_id.txt")
-        self.SUBS_FILE = os.path.join(self.STORAGE_DIR, "subs.json")
-
-        # --- Global State Variables ---
-        self._seen = deque(maxlen=2000)
-        self.attr_state = {
-            "selected_areas_active_alerts": [],
-            "selected_areas_updates": []
-        }
-        self.attr_state_lock = threading.Lock()
-        self.name_map = self.config.get("name_map", {})
-        
         # --- Initialize and Start All Processes ---
+        # The initial HA publish (including any restored alerts) is asynchronous (publish scheduler thread)
         self.initialize_ha_sensor()
         self.token, self.auth = self._ensure_authenticated()
-        self._reconcile_subscriptions()
+        self._startup_mark("auth")
 
+        # Connect the listener as soon as credentials exist, so no alert is lost during startup
         self.listener = IoRefListener(self) # Pass the app instance to the listener
-        
         self.listener_thread = threading.Thread(target=self.listener.start_loop, daemon=True, name="MQTTListenerLoop")
         self.listener_thread.start()
-        
-        # Use AppDaemon's built-in scheduler for the cleanup task
-        self.run_every(self._cleanup_and_republish, "now+15", 30)
+        for source in self._sources:
+            source.start()
+        self._startup_mark("listener_started")
+
+        # Subscription reconciliation talks HTTP to Pushy; run it in the background
+        self.reconcile_thread = threading.Thread(target=self._background_reconcile, daemon=True, name="PushyReconcile")
+        self.reconcile_thread.start()
+
+        # Expiry is deadline-driven (ExpiryScheduler); AppDaemon's scheduler only logs stats
+        # and compacts the state journal
+        self.run_every(self._log_stats, "now+30", 30)
+
+        self._metrics_server = None
+        if self.METRICS_PORT:
+            try:
+                self._metrics_server = MetricsServer(self._metrics, self.METRICS_HOST, self.METRICS_PORT,
+                                                     logger=self.get_main_logger())
+                self._metrics_server.start()
+            except OSError as e:
+                self.error(f"Could not start the metrics endpoint on port {self.METRICS_PORT}: {e}")
+        self.run_every(self._compact_journal, f"now+{self.JOURNAL_COMPACT_S}", self.JOURNAL_COMPACT_S)
+        if self.HEARTBEAT_S:
+            self.run_every(self._heartbeat, f"now+{self.HEARTBEAT_S}", self.HEARTBEAT_S)
 
         self.log("✅ Missile Alerts App Initialized and Running.")
 
+    def _startup_mark(self, phase):
+        """Records and logs the time from initialize() to the end of a startup phase (first time only)."""
+        if phase in self.startup_timings:
+            return
+        elapsed = time.perf_counter() - self._startup_t0
+        self.startup_timings[phase] = elapsed
+        self.log(f"⏱ Startup phase '{phase}' done at {elapsed * 1000:.0f} ms", level="INFO")
+
+    def _background_reconcile(self):
+        self._reconcile_subscriptions()
+        self._startup_mark("reconcile")
+
+    def _load_config(self):
+        """Loads configuration from apps.yaml (self.args) and prepares the storage dir."""
+        self.config = self.args
+        self._load_common_config(self.app_dir, os.path.join(self.app_dir, "missile_alerts_storage"))
+        # No broker last will through call_service: re-send the states every heartbeat_s and let HA
+        # mark the sensors unavailable after 3 missed heartbeats (0 disables both)
+        self.HEARTBEAT_S = self.config.get("heartbeat_s", 60)
+        self.JOURNAL_COMPACT_S = self.config.get("journal_compact_s", 60)
+
+    def _init_state(self):
+        """Creates the in-memory alert state. No network or Home Assistant I/O happens here."""
+        # Written by the pipeline worker and the expiry thread (see alert_processor.py for the copy-on-write)
+        self.attr_state_lock = threading.Lock()
+        self.logger = self.get_main_logger()
+        self._init_metrics()
+        self._capture = None
+        if self.CAPTURE_FILE:
+            self._capture = CaptureSink(os.path.join(self.STORAGE_DIR, self.CAPTURE_FILE),
+                                        max_bytes=self.CAPTURE_MAX_MB * 1024 * 1024, backups=self.CAPTURE_BACKUPS,
+                                        rate_limit=self.CAPTURE_RATE_LIMIT, logger=self.logger)
+            self._capture.start()
+        self._init_processing()
+        self.ha_scheduler = PublishScheduler(self._render_ha_payloads, self._send_to_ha,
+                                             self.PUBLISH_WINDOW_S, logger=self.logger,
+                                             on_latency=self._m_publish_latency.observe)
+        self.ha_scheduler.start()
+        self.pipeline = AlertPipeline([
+            ("dedup", self._stage_dedup),
+            ("filter", self._stage_filter),
+            ("state", self._stage_state),
+            ("publish", self._stage_publish),
+        ], maxsize=self.PIPELINE_QUEUE_SIZE, logger=self.get_main_logger())
+        self.pipeline.start()
+        self._sources = []
+        if self.HTTP_SOURCE_URL:
+            self._sources.append(HttpPollSource(self.pipeline.submit, self.HTTP_SOURCE_URL, self.cities.ids_for,
+                                                interval_s=self.HTTP_POLL_S, logger=self.get_main_logger()))
+        self.merger = None
+        if self._sources:
+            self.merger = SourceMerger([PUSHY] + [source.name for source in self._sources], self.MERGE_WINDOW_S,
+                                       registry=self._metrics)
+        self.expiry = ExpiryScheduler(self._expire_entries, logger=self.get_main_logger())
+        self.expiry.start()
+        self._pushy = PushyClient(self.API_HOST, timeout=self.CONNECT_TIMEOUT, retries=self.API_RETRIES,
+                                  logger=self.get_main_logger())
+        self._storage = Storage(self.STORAGE_DIR, logger=self.get_main_logger())
+        self._journal = StateJournal(self.STATE_JOURNAL_FILE, logger=self.get_main_logger())
+
+    def _init_metrics(self):
+        """Registers the alert-path metrics; component counters are read only when rendered."""
+        m = self._metrics = MetricsRegistry()
+        self._m_alert_age = m.histogram("broker_to_receive_seconds",
+                                        "Alert time to pipeline processing", AGE_BUCKETS)
+        self._m_publish_latency = m.histogram("receive_to_publish_seconds",
+                                              "MQTT receive to Home Assistant publish", LATENCY_BUCKETS)
+        self._m_stale = m.counter("alerts_stale_total", "Alerts dropped as older than max_age_s")
+        m.gauge("messages_received_total", "Messages received from Pushy",
+                lambda: self.pipeline.received, kind="counter")
+        m.gauge("pipeline_queue_depth", "Messages waiting for the pipeline worker", lambda: self.pipeline.queue_depth())
+        m.gauge("pipeline_dropped_total", "Messages dropped on a full pipeline queue",
+                lambda: self.pipeline.dropped, kind="counter")
+        m.gauge("pipeline_errors_total", "Messages that failed decoding or a stage",
+                lambda: self.pipeline.errors, kind="counter")
+        m.gauge("dedup_hits_total", "Duplicate alerts dropped", lambda: self._seen.hits, kind="counter")
+        m.gauge("active_alert_entries", "Entries currently published to Home Assistant",
+                lambda: sum(len(v) for v in self._snapshot_state()[0].values()))
+        m.gauge("publish_failures_total", "Failed Home Assistant publishes",
+                lambda: self.ha_scheduler.failed, kind="counter")
+        m.gauge("group_renders_total", "Output group payloads re-serialized",
+                lambda: self.router.renders, kind="counter")
+        m.gauge("mqtt_reconnects_total", "Successful MQTT reconnects",
+                lambda: self.listener.reconnect.reconnect_time.count if getattr(self, "listener", None) else 0,
+                kind="counter")
+
+    def _restore_state(self):
+        """Restores the still-active entries from the state journal and schedules their expiry."""
+        with self.attr_state_lock:
+            state, version = self._journal.load(self.attr_state.keys(), time.time())
+            self.attr_state = state
+            self.state_version = version
+        self.router.load(state)
+        for records in state.values():
+            for entry in records:
+                self.expiry.schedule(entry.deadline, entry)
+        self._journal.compact(version, state, force=True)
+
+    def _journal_append(self, version, list_key, clear_key, entries):
+        self._journal.append(version, list_key, clear_key, entries)
+
+    def _compact_journal(self, kwargs):
+        # Refused (and retried on the next run) if the worker journaled a newer version meanwhile
+        state, version = self._snapshot_state()
+        self._journal.compact(version, state)
+
+    def _heartbeat(self, kwargs):
+        """Re-sends the (unchanged) state topics so HA's expire_after does not mark the sensors unavailable."""
+        for topic in [self.STATE_TOPIC] + self.router.state_topics(range(len(self.router))):
+            self.ha_scheduler.forget(topic)
+        self.ha_scheduler.request()
+
     def terminate(self):
         """Called by AppDaemon on shutdown."""
         self.log("🛑 Shutting down Missile Alerts App...")
@@ -88,183 +202,94 @@ class MissileAlertsApp(hass.Hass):
             self.listener.stop()
         if hasattr(self, 'listener_thread') and self.listener_thread.is_alive():
             self.listener_thread.join()
+        for source in getattr(self, '_sources', ()):
+            source.stop()
+        if hasattr(self, 'pipeline'):
+            self.pipeline.stop()
+        if hasattr(self, 'expiry'):
+            self.expiry.stop()
+        if hasattr(self, '_pushy'):
+            self._pushy.close()
+        if hasattr(self, 'ha_scheduler'):
+            self.ha_scheduler.stop()
+            try:
+                self._send_to_ha(self.AVAILABILITY_TOPIC, OFFLINE)
+            except Exception as e:
+                self.log(f"Could not mark the sensors offline: {e}", level="WARNING")
+        if getattr(self, '_metrics_server', None):
+            self._metrics_server.stop()
+        if getattr(self, '_capture', None):
+            self._capture.stop()
+        if hasattr(self, '_journal'):
+            self._compact_journal({})
+            self._journal.close()
         self.log("Shutdown complete.")
 
-    def _publish_to_ha(self):
-        """Publishes the current state to Home Assistant via AppDaemon's service."""
-        try:
-            with self.attr_state_lock:
-                self.call_service("mqtt/publish",
-                                  topic=self.ATTR_TOPIC,
-                                  payload=json.dumps(self.attr_state, ensure_ascii=False),
-                                  qos=0, retain=False)
-                
-                active = "1" if self.attr_state["selected_areas_active_alerts"] else "0"
-                self.call_service("mqtt/publish",
-                                  topic=self.STATE_TOPIC,
-                                  payload=active,
-                                  qos=0, retain=False)
-            
-            self.log(f"Successfully published state to Home Assistant. Active: {active}", level="INFO")
-        except Exception as e:
-            self.error(f"Failed to publish to Home Assistant: {e}", level="ERROR")
-            
-    def _on_message_pushy(self, msg_payload):
-        """Handles incoming messages from the alert service."""
-        now = datetime.now() # Naive datetime for AppDaemon compatibility
-        self.log(f"RAW NOTIFICATION @ {now.isoformat()}: {msg_payload}", level="DEBUG")
-        if self.DEBUG: return
-
-        aid = (msg_payload.get("alertTitle") or msg_payload.get("id") or "").strip()
-        if not aid or aid in self._seen: return
-        self._seen.append(aid)
-
-        title = msg_payload.get("title", "").strip()
-        raw_time = msg_payload.get("time", "")
-
-        alert_time = ""
-        latency = None
-        try:
-            if raw_time:
-                dt_object = None
-                if "T" in raw_time:
-                    try:
-                        dt_object = datetime.fromisoformat(raw_time)
-                    except ValueError:
-                        dt_object = datetime.strptime(raw_time, "%Y-%m-%dT%H:%M:%S%z")
-                else:
-                    dt_object = datetime.strptime(raw_time, "%Y-%m-%d %H:%M:%S")
-
-                if dt_object:
-                    dt_naive = dt_object.astimezone(None).replace(tzinfo=None)
-                    latency = (now - dt_naive).total_seconds()
-                    alert_time = dt_naive.strftime("%Y-%m-%d %H:%M:%S")
-                    self.log(f"📩 Received alert '{aid}' for '{title}' with latency: {latency:.2f}s", level="INFO")
-            
-            if latency is not None and latency > self.MAX_AGE_S:
-                self.log(f"Skipping stale alert {aid} (latency: {latency:.2f}s > max_age: {self.MAX_AGE_S}s)", level="WARNING")
-                return
-        except Exception as e:
-            self.log(f"Could not parse timestamp '{raw_time}': {e}", level="WARNING")
-            alert_time = raw_time
-
-        segs = set(msg_payload.get("citiesIds", "").split(","))
-        hits = segs & self.SEGMENTS
-        if not hits: return
-
-        self.log(f"✅ Alert '{title}' is relevant for segments: {hits}", level="INFO")
-        
-        is_real = (title in {"ירי רקטות וטילים", "חדירת כלי טיס עוין"})
-        attr_list_key = "selected_areas_active_alerts" if is_real else "selected_areas_updates"
-        clear_list_key = "selected_areas_updates" if is_real else "selected_areas_active_alerts"
-
-        with self.attr_state_lock:
-            self.attr_state[clear_list_key].clear()
-            for seg in hits:
-                entry = {
-                    "alertDate": alert_time,
-                    "title": title,
-                    "data": self.name_map.get(seg, seg),
-                    "category": msg_payload.get("threatId", ""),
-                    "id": aid
-                }
-                self.attr_state[attr_list_key].append(entry)
-        
-        self._publish_to_ha()
+    def _send_to_ha(self, topic, payload, retain=True):
+        """Publishes one topic to Home Assistant via AppDaemon's service (retained, so HA restarts see it)."""
+        self.call_service("mqtt/publish", topic=topic, payload=payload, qos=0, retain=retain)
+        if topic == self.STATE_TOPIC:
+            self.log(f"Successfully published state to Home Assistant. Active: {payload}", level="INFO")
 
-    def _cleanup_and_republish(self, kwargs):
-        """Periodically checks for and removes stale alerts."""
-        now = datetime.now() # Use naive datetime for comparison
-        dirty = False
-        with self.attr_state_lock:
-            for key in ("selected_areas_active_alerts", "selected_areas_updates"):
-                fresh_list = []
-                for item in self.attr_state[key]:
-                    try:
-                        alert_dt = datetime.strptime(item["alertDate"], "%Y-%m-%d %H:%M:%S")
-                        if (now - alert_dt).total_seconds() < self.EXPIRY_S:
-                            fresh_list.append(item)
-                        else:
-                            self.log(f"Expiring old alert: {item.get('id', 'N/A')}", level="INFO")
-                            dirty = True
-                    except Exception as e:
-                        self.log(f"Could not parse date for cleanup: {item.get('alertDate', 'N/A')} - {e}", level="WARNING")
-                        fresh_list.append(item)
-                
-                if len(fresh_list) < len(self.attr_state[key]):
-                    self.attr_state[key] = fresh_list
-                    dirty = True
-
-        if dirty:
-            self.log("State has changed due to expired alerts, republishing to HA.", level="INFO")
-            self._publish_to_ha()
+    def _on_message_pushy(self, msg_payload):
+        """Handles a decoded message synchronously by running it through the pipeline stages."""
+        self.pipeline.run(msg_payload)
+
+    def _log_stats(self, kwargs):
+        self.log(f"Dedup cache stats: {self._seen.stats()}", level="DEBUG")
+        self.log(f"Alert pipeline stats: {self.pipeline.stats()}", level="DEBUG")
+        self.log(f"Pushy API stats: {self._pushy.stats()}", level="DEBUG")
+        self.log(f"State journal stats: {self._journal.stats()}", level="DEBUG")
+        if getattr(self, "listener", None):
+            self.log(f"MQTT reconnect stats: {self.listener.reconnect.stats()}", level="DEBUG")
+        if self.merger:
+            self.log(f"Alert source merge stats: {self.merger.stats()}", level="DEBUG")
+            for source in self._sources:
+                self.log(f"Alert source '{source.name}' stats: {source.stats()}", level="DEBUG")
+        if self.router:
+            self.log(f"Topic router stats: {self.router.stats()}", level="DEBUG")
+        if self._capture:
+            self.log(f"Capture sink stats: {self._capture.stats()}", level="DEBUG")
+        if self.METRICS_TOPIC:
+            try:
+                self._send_to_ha(self.METRICS_TOPIC, json.dumps(self._metrics.snapshot()), retain=False)
+            except Exception as e:
+                self.log(f"Failed to publish metrics to Home Assistant: {e}", level="WARNING")
 
     def initialize_ha_sensor(self):
         self.log("Publishing initial state to Home Assistant...", level="INFO")
-        self._publish_to_ha()
+        self.publish_to_ha(urgent=True)
     
     def _load_json(self, path):
-        try:
-            with open(path, "r", encoding="utf-8") as f: return json.load(f)
-        except: return {}
+        return self._storage.load(path)
 
     def _save_json(self, path, data):
-        with open(path, "w", encoding="utf-8") as f: json.dump(data, f)
+        self._storage.save(path, data)
 
     def _get_android_id(self):
-        if os.path.exists(self.ANDROID_ID_FILE): return open(self.ANDROID_ID_FILE).read().strip()
+        aid = self._storage.load_text(self.ANDROID_ID_FILE)
+        if aid: return aid
         aid = f"{random.getrandbits(64):016x}{self.ANDROID_SUFFIX}"
-        with open(self.ANDROID_ID_FILE, "w") as f: f.write(aid)
+        self._storage.save_text(self.ANDROID_ID_FILE, aid)
         return aid
 
-    def _api_post(self, path, payload, *, bypass_status=False):
-        url = self.API_HOST + path
+    def _api_post(self, path, payload, *, bypass_status=False, retries=None):
         try:
-            r = requests.post(url, json=payload, timeout=self.CONNECT_TIMEOUT, headers={"Content-Type": "application/json"})
-            r.raise_for_status() # Raise an exception for bad status codes
-            body = r.json()
-            if bypass_status and isinstance(body, dict) and body.get("success") is True: return body
-            return body or {}
-        except requests.exceptions.RequestException as e:
-            self.error(f"API request to {url} failed: {e}")
+            return self._pushy.post(path, payload, bypass_status=bypass_status, retries=retries)
+        except Exception as e:
+            self.error(f"API request to {self.API_HOST + path} failed: {e}")
             raise
 
-    def _subscribe_topics(self, token, auth, topics):
-        if isinstance(topics, str): topics = [topics]
-        try:
-            resp = self._api_post("/devices/subscribe", {"token": token, "auth": auth, "topics": topics}, bypass_status=True)
-            if not resp.get("success", False): self.error(f"Subscribe failed: {resp}")
-        except Exception as e: self.error(f"Exception during subscribe: {e}")
-
-    def _unsubscribe_topics(self, token, auth, topics):
-        if isinstance(topics, str): topics = [topics]
-        try:
-            resp = self._api_post("/devices/unsubscribe", {"token": token, "auth": auth, "topics": topics}, bypass_status=True)
-            if not resp.get("success", False): self.error(f"Unsubscribe failed: {resp}")
-        except Exception as e: self.error(f"Exception during unsubscribe: {e}")
-
     def _reconcile_subscriptions(self):
-        if not os.path.exists(self.SUBS_FILE):
-            self.log("No subs.json → first-run dance (sub1,unsub1)")
-            self._subscribe_topics(self.token, self.auth, "1")
-            self._unsubscribe_topics(self.token, self.auth, "1")
-            prev = set()
-        else:
-            prev = set(self._load_json(self.SUBS_FILE).get("topics", []))
-        desired = set(self.SEGMENTS)
-        to_unsub = list(prev - desired)
-        to_sub = list(desired - prev)
-        if to_unsub:
-            self.log(f"Unsubscribing removed: {to_unsub}")
-            self._unsubscribe_topics(self.token, self.auth, to_unsub)
-        if to_sub:
-            self.log(f"Subscribing new: {to_sub}")
-            self._subscribe_topics(self.token, self.auth, to_sub)
-        if to_unsub or to_sub:
-            self._save_json(self.SUBS_FILE, {"topics": list(desired)})
-            self.log("Saved updated subs.json")
-        else:
-            self.log("No subscription changes needed.")
+        reconciler = SubscriptionReconciler(
+            self._pushy, self.token, self.auth, self.SUBS_FILE,
+            load_json=self._load_json, save_json=self._save_json,
+            batch_size=self.SUBS_BATCH_SIZE, concurrency=self.SUBS_CONCURRENCY,
+            logger=self.get_main_logger())
+        try:
+            return reconciler.reconcile(self.segment_index.topics())
+        except Exception as e:
+            self.error(f"Subscription reconcile failed: {e}")
 
     def _ensure_authenticated(self):
         creds = self._load_json(self.TOKEN_FILE)
@@ -272,10 +297,11 @@ class MissileAlertsApp(hass.Hass):
             self.log("Loaded credentials from token.json")
             return creds["token"], creds["auth"]
         aid = self._get_android_id()
+        # Never retry /register: a duplicate registration creates a second device
         reg = self._api_post("/register", {
             "androidId": aid, "app": None, "appId": self.APP_ID,
             "platform": "android", "sdk": self.SDK_VERSION
-        })
+        }, retries=0)
         token, auth = reg["token"], reg["auth"]
         self._save_json(self.TOKEN_FILE, {"token": token, "auth": auth})
         self.log("Registered new device and saved credentials")
@@ -287,55 +313,85 @@ class IoRefListener:
         self.token = app_instance.token
         self.auth = app_instance.auth
         self.stopping = False
+        self.endpoint = None  # Broker host of the current connection
         
         # Use the main app logger provided by AppDaemon
         self.logger = app_instance.log
 
+        # Paho's own reconnect would keep retrying the same timestamped host; the controller picks a new one
+        self.reconnect = ReconnectController(
+            app_instance.MQTT_TEMPLATE, app_instance.MQTT_PORT,
+            timeout=app_instance.CONNECT_TIMEOUT,
+            candidates=app_instance.RECONNECT_CANDIDATES,
+            max_backoff_s=app_instance.RECONNECT_MAX_BACKOFF_S,
+            logger=app_instance.get_main_logger()
+        )
+
         self.client = mqtt.Client(
             callback_api_version=mqtt.CallbackAPIVersion.VERSION2, 
             client_id=self.token, 
-            clean_session=False
+            clean_session=False,
+            reconnect_on_failure=False
         )
+        self.client.connect_timeout = app_instance.CONNECT_TIMEOUT  # Per-socket, not process-wide
         
         self.client.username_pw_set(self.token, self.auth)
-        self.client.tls_set(cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS)
+        if app_instance.MQTT_TLS:
+            self.client.tls_set(cert_reqs=ssl.CERT_REQUIRED, tls_version=ssl.PROTOCOL_TLS)
 
         self.client.on_connect = self._on_connect
-        self.client.on_message = lambda c, u, m: self.app._on_message_pushy(json.loads(m.payload.decode()))
+        # Only enqueue on Paho's network thread; decoding and processing run on the pipeline worker.
+        self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
+        self.client.on_subscribe = self._on_subscribe
         
         # Paho can use the standard logger, but AppDaemon's log methods are preferred
         # self.client.enable_logger(logging.getLogger("paho_mqtt_client"))
 
     def _on_connect(self, client, userdata, flags, reason_code, properties):
         if reason_code == 0:
-            self.app.log("MQTT Connection Successful (rc: 0)")
+            down = self.reconnect.on_connected()
+            if down is None:
+                self.app.log("MQTT Connection Successful (rc: 0)")
+            else:
+                self.app.log(f"MQTT Reconnected (rc: 0) after {down * 1000:.0f} ms offline")
             client.subscribe(self.token, self.app.QOS)
+            self.app._startup_mark("connected")
         else:
-            self.app.error(f"MQTT Connection failed: {reason_code}. Paho's loop will retry.")
+            self.app.error(f"MQTT Connection failed: {reason_code}. Will retry with backoff.")
+
+    def _on_message(self, client, userdata, msg):
+        if self.app._capture:
+            self.app._capture.write(msg.payload, self.endpoint)
+        self.app.pipeline.submit(msg.payload)
+
+    def _on_subscribe(self, client, userdata, mid, reason_code_list, properties):
+        self.app._startup_mark("ready_to_receive")
 
     def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        self.reconnect.on_disconnected()
         if not self.stopping:
-            self.app.log(f"Disconnected from MQTT (rc: {reason_code}). Paho's loop will attempt to reconnect automatically.", level="WARNING")
+            self.app.log(f"Disconnected from MQTT (rc: {reason_code}). Reconnecting.", level="WARNING")
 
     def start_loop(self):
-        socket.setdefaulttimeout(self.app.CONNECT_TIMEOUT)
+        port = self.app.MQTT_PORT
+        ka = self.app.KEEPALIVE_SEC
         while not self.stopping:
             try:
-                endpoint = self.app.MQTT_TEMPLATE.replace("{timestamp}", str(int(time.time())))
-                port = self.app.MQTT_PORT
-                ka = self.app.KEEPALIVE_SEC
+                endpoint = self.endpoint = self.reconnect.next_endpoint()
                 self.app.log(f"Attempting to connect to: {endpoint}")
                 self.client.connect(endpoint, port, ka)
-                self.client.loop_forever()
+                self.client.loop_forever()  # Returns when the connection drops
             except (socket.timeout, OSError) as e:
-                self.app.error(f"Connection error: {e}. Retrying after 5 seconds.")
-                time.sleep(5)
+                if not self.stopping:
+                    self.reconnect.on_failure()
+                    self.app.error(f"Connection error: {e}.")
             except Exception as e:
                 if not self.stopping:
-                    self.app.error(f"An unexpected error occurred in the listener thread: {e}. Retrying after 10 seconds.")
-                    time.sleep(10)
+                    self.reconnect.on_failure()
+                    self.app.error(f"An unexpected error occurred in the listener thread: {e}.")
     
     def stop(self):
         self.stopping = True
+        self.reconnect.stop()
         self.client.disconnect()
\ No newline at end of file
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+publish_scheduler.py
+
+Coalescing publish scheduler for Home Assistant state updates, shared by
+missile_alerts_app.py and mqttest.py.
+
+Callers only *request* a publish. Requests arriving within `window_s` are
+merged into one flush, which renders the current state once and sends only
+the topics whose serialized payload differs from the last one sent. Urgent
+requests (the STATE_TOPIC 0→1 transition) wake the scheduler thread right
+away with no coalescing delay; callers never perform publish I/O themselves,
+so the MQTT receive thread is never blocked by Home Assistant.
+
+Requests may carry `since`, the perf_counter() time the triggering message
+was received; the flush that sends it reports receive-to-publish latency of
+the oldest pending message to `on_latency(seconds)`.
+"""
+
+import time
+import logging
+import threading
+
+
+class PublishScheduler:
+    def __init__(self, render, send, window_s=0.1, logger=None, on_latency=None):
+        """
+        render() -> iterable of (topic, payload) for the current state
+        send(topic, payload) -> performs the actual publish
+        on_latency(seconds) -> optional receive-to-publish latency sink
+        """
+        self._render = render
+        self._send = send
+        self.window_s = window_s
+        self.logger = logger or logging.getLogger("missile_alerts")
+        self._on_latency = on_latency
+
+        self._last = {}  # topic -> last payload sent
+        self._deadline = None
+        self._pending_since = None  # receive time of the oldest message not yet published
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+        self.requests = 0
+        self.flushes = 0
+        self.sent = 0
+        self.skipped = 0
+        self.failed = 0
+
+    # ─── LIFECYCLE ──────────────────────────────────────────────────────────
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="HAPublishScheduler")
+        self._thread.start()
+
+    def stop(self, flush=True):
+        with self._cond:
+            self._stopping = True
+            pending = self._deadline is not None
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if flush and pending:
+            self.flush()
+
+    # ─── REQUESTS ───────────────────────────────────────────────────────────
+
+    def request(self, urgent=False, since=None):
+        """Schedules a publish of the current state; urgent requests skip the coalescing window."""
+        with self._cond:
+            self.requests += 1
+            if since is not None and (self._pending_since is None or since < self._pending_since):
+                self._pending_since = since
+            if urgent:
+                self._deadline = time.monotonic()
+                self._cond.notify()
+            elif self._deadline is None:
+                self._deadline = time.monotonic() + self.window_s
+                self._cond.notify()
+
+    def last_sent(self, topic):
+        """The last payload sent on `topic`, or None."""
+        return self._last.get(topic)
+
+    def forget(self, topic=None):
+        """Drops the last-sent cache so the next flush re-sends `topic` (or everything)."""
+        if topic is None:
+            self._last.clear()
+        else:
+            self._last.pop(topic, None)
+
+    def flush(self):
+        """Renders and sends the changed topics now."""
+        with self._flush_lock:
+            with self._cond:
+                self._deadline = None
+                since, self._pending_since = self._pending_since, None
+            self.flushes += 1
+            for topic, payload in self._render():
+                if self._last.get(topic) == payload:
+                    self.skipped += 1
+                    continue
+                try:
+                    self._send(topic, payload)
+                except Exception as e:
+                    self.failed += 1
+                    self.logger.error(f"Failed to publish to Home Assistant ({topic}): {e}")
+                    continue
+                self._last[topic] = payload
+                self.sent += 1
+            if since is not None and self._on_latency:
+                self._on_latency(time.perf_counter() - since)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if self._deadline is None:
+                        self._cond.wait()
+                        continue
+                    delay = self._deadline - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if self._stopping:
+                    return
+            self.flush()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "flushes": self.flushes,
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+pushy_client.py
+
+Pooled REST client for the Pushy API (/register, /devices/subscribe,
+/devices/unsubscribe), shared by missile_alerts_app.py and mqttest.py.
+
+One requests.Session with a small keep-alive pool is reused for every call,
+so startup reconciliation and resubscribes pay for one TLS handshake instead
+of one per request. Timeouts, connection errors and 5xx responses are retried
+a bounded number of times with jittered exponential backoff, and every
+endpoint keeps call/error/retry counts and latency.
+
+/register is NOT idempotent (a retried request could register a second
+device, see the README), so callers pass retries=0 for it.
+"""
+
+import time
+import random
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from alert_pipeline import StageTimer
+
+
+class PushyAPIError(RuntimeError):
+    """The Pushy API answered with an error status or body."""
+
+    def __init__(self, message, status=None, retryable=False):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+
+
+class PushyClient:
+    def __init__(self, api_host, *, timeout=10, retries=3, backoff_s=0.5, max_backoff_s=8.0,
+                 pool_size=4, logger=None):
+        self.api_host = api_host.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.logger = logger or logging.getLogger("missile_alerts")
+
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._lock = threading.Lock()
+        self._metrics = {}  # path -> {"latency": StageTimer, "errors": int, "retries": int}
+
+    def close(self):
+        self.session.close()
+
+    # ─── REQUESTS ───────────────────────────────────────────────────────────
+
+    def post(self, path, payload, *, bypass_status=False, retries=None):
+        """
+        POSTs `payload` as JSON and returns the decoded body (or {}).
+        Raises PushyAPIError / requests.RequestException once retries are exhausted.
+        """
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            t0 = time.perf_counter()
+            try:
+                body = self._post_once(path, payload, bypass_status)
+                self._record(path, time.perf_counter() - t0)
+                return body
+            except (requests.ConnectionError, requests.Timeout, PushyAPIError) as e:
+                retryable = not isinstance(e, PushyAPIError) or e.retryable
+                self._record(path, time.perf_counter() - t0, error=True)
+                if not retryable or attempt >= retries:
+                    raise
+                attempt += 1
+                delay = self._backoff(attempt)
+                self._record_retry(path)
+                self.logger.warning(f"POST {path} failed ({e}); retry {attempt}/{retries} in {delay:.2f}s")
+                time.sleep(delay)
+
+    def _post_once(self, path, payload, bypass_status):
+        r = self.session.post(self.api_host + path, json=payload, timeout=self.timeout)
+        try:
+            body = r.json()
+        except ValueError:
+            body = None
+
+        if 200 <= r.status_code < 300:
+            return body or {}
+        if bypass_status and isinstance(body, dict) and body.get("success") is True:
+            return body
+        retryable = r.status_code >= 500
+        if isinstance(body, dict):
+            code = body.get("code", "")
+            msg = body.get("error", body.get("message", "Unknown error"))
+            raise PushyAPIError(f"{code}: {msg} (HTTP {r.status_code})", r.status_code, retryable)
+        raise PushyAPIError(f"{r.text.strip()} (HTTP {r.status_code})", r.status_code, retryable)
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.max_backoff_s, self.backoff_s * (2 ** attempt)))
+
+    # ─── METRICS ────────────────────────────────────────────────────────────
+
+    def _entry(self, path):
+        m = self._metrics.get(path)
+        if m is None:
+            m = self._metrics[path] = {"latency": StageTimer(), "errors": 0, "retries": 0}
+        return m
+
+    def _record(self, path, dt, error=False):
+        with self._lock:
+            m = self._entry(path)
+            m["latency"].add(dt)
+            if error:
+                m["errors"] += 1
+
+    def _record_retry(self, path):
+        with self._lock:
+            self._entry(path)["retries"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {path: dict(m["latency"].as_dict(), errors=m["errors"], retries=m["retries"])
+                    for path, m in self._metrics.items()}
@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+pushy_standin.py
+
+Local stand-in for the Pushy backend and an end-to-end load test, so the
+listener can be exercised without pushy.ioref.app or the mqtt-*.ioref.io
+brokers (no network, usable in CI).
+
+  - RestStandin: POST /register, /devices/subscribe, /devices/unsubscribe with
+    the same request and response shapes as the Pushy API.
+  - MiniBroker: a minimal MQTT 3.1.1 broker (CONNECT, SUBSCRIBE, PUBLISH QoS
+    0/1, PUBACK, PINGREQ, DISCONNECT, plain TCP). push(payload) delivers an
+    alert on the device token topic of every connected device subscribed
+    (via the REST stand-in) to one of its citiesIds, like Pushy does.
+  - LoadGenerator: replays data_examples/*.jsonl payloads, ramping from
+    `start_rate` to `rate` alerts/s, with fresh ids and alert times and
+    configurable duplicate and reordering rates.
+
+Usage:
+    # stand-in only; point the app at it with
+    #   api_host: "http://127.0.0.1:8080", mqtt_template: "127.0.0.1", mqtt_port: 1883, mqtt_tls: False
+    # (the same keys in mqttest.py's CONFIG)
+    python3 pushy_standin.py serve --rate 5 data_examples/test_data.jsonl
+
+    # end to end: stand-in + MissileAlertsApp listener in this process
+    python3 pushy_standin.py bench --rate 2000 --ramp-s 5 --duration 15 --dup-rate 0.05 --reorder-rate 0.02
+    python3 pushy_standin.py bench --target script --rate 2000 --duration 15   # mqttest.py's asyncio engine
+    python3 pushy_standin.py bench --duration 5 --max-p99-ms 250 --json     # CI gate (exit 1 on failure)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import struct
+import logging
+import argparse
+import secrets
+import tempfile
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from alert_replay import load_capture, percentile, DEFAULT_SEGMENTS
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SENT_AT_KEY = "standinSentAt"  # epoch seconds the broker pushed the alert (end-to-end latency)
+
+logger = logging.getLogger("pushy_standin")
+
+
+# ─── REST ───────────────────────────────────────────────────────────────────
+
+class RestStandin:
+    """Pushy REST API stand-in; `devices` maps token -> {"auth", "topics"}."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.devices = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, as PushyClient pools connections
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    body = None
+                status, reply = standin.handle(self.path, body)
+                data = json.dumps(reply).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.host, self.port = self._server.server_address[:2]
+        self.url = f"http://{self.host}:{self.port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="RestStandin").start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, path, body):
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            if not isinstance(body, dict):
+                return 400, {"code": "INVALID_PARAM", "error": "Body must be a JSON object"}
+            if path == "/register":
+                token = secrets.token_hex(10)
+                self.devices[token] = {"auth": secrets.token_hex(32), "topics": set()}
+                return 200, {"token": token, "auth": self.devices[token]["auth"], "success": True}
+            if path in ("/devices/subscribe", "/devices/unsubscribe"):
+                device = self.devices.get(body.get("token"))
+                if device is None or device["auth"] != body.get("auth"):
+                    return 401, {"code": "INVALID_CREDENTIALS", "error": "Invalid device credentials"}
+                topics = {str(t) for t in body.get("topics") or ()}
+                if path == "/devices/subscribe":
+                    device["topics"] |= topics
+                else:
+                    device["topics"] -= topics
+                return 200, {"success": True}
+            return 404, {"code": "NOT_FOUND", "error": f"Unknown path {path}"}
+
+    def subscribers(self, cities):
+        """Tokens of the devices subscribed to any of `cities`."""
+        with self._lock:
+            return [token for token, device in self.devices.items() if not device["topics"].isdisjoint(cities)]
+
+
+# ─── MQTT ───────────────────────────────────────────────────────────────────
+
+def _encode_length(n):
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def _encode_str(s):
+    data = s.encode("utf-8")
+    return struct.pack("!H", len(data)) + data
+
+
+def _decode_str(buf, pos):
+    (n,) = struct.unpack_from("!H", buf, pos)
+    return buf[pos + 2:pos + 2 + n].decode("utf-8"), pos + 2 + n
+
+
+class _Session:
+    def __init__(self, sock):
+        self.sock = sock
+        self.client_id = None
+        self.topics = set()
+        self.send_lock = threading.Lock()
+        self.next_pid = 0
+        self.inflight = {}  # packet id -> send time (perf_counter)
+
+    def send(self, packet):
+        with self.send_lock:
+            self.sock.sendall(packet)
+
+    def recv_exact(self, n):
+        data = b""
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("client closed the connection")
+            data += chunk
+        return data
+
+    def read_packet(self):
+        header = self.recv_exact(1)[0]
+        length, shift = 0, 0
+        while True:
+            byte = self.recv_exact(1)[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        return header, self.recv_exact(length) if length else b""
+
+
+class MiniBroker:
+    """Just enough of MQTT 3.1.1 for the Paho listener; authenticates against a RestStandin."""
+
+    def __init__(self, rest, host="127.0.0.1", port=0, *, qos=1):
+        self.rest = rest
+        self.qos = qos
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen(64)
+        self.host, self.port = self._sock.getsockname()[:2]
+        self._sessions = {}  # client id -> _Session
+        self._lock = threading.Lock()
+        self._stopping = False
+
+        self.connects = 0
+        self.pushed = 0
+        self.delivered = 0
+        self.undelivered = 0  # subscribed device not connected
+        self.acked = 0
+        self.ack_latency = []  # seconds, PUBLISH → PUBACK
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True, name="MiniBroker").start()
+        return self
+
+    def stop(self):
+        self._stopping = True
+        self._sock.close()
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            self.drop(session)
+
+    def drop(self, session):
+        """Closes a client connection (also useful to test reconnects)."""
+        try:
+            session.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        session.sock.close()
+
+    def connected(self, client_id=None):
+        with self._lock:
+            if client_id is None:
+                return len(self._sessions)
+            session = self._sessions.get(client_id)
+            return session is not None and client_id in session.topics
+
+    def _accept_loop(self):
+        while not self._stopping:
+            try:
+                sock, _ = self._sock.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(_Session(sock),), daemon=True,
+                             name="MiniBrokerSession").start()
+
+    def _serve(self, session):
+        try:
+            while True:
+                header, body = session.read_packet()
+                kind = header >> 4
+                if kind == 1:
+                    self._on_connect(session, body)
+                elif kind == 8:
+                    pid = body[:2]
+                    pos, granted = 2, bytearray()
+                    while pos < len(body):
+                        topic, pos = _decode_str(body, pos)
+                        granted.append(min(body[pos], self.qos))
+                        pos += 1
+                        session.topics.add(topic)
+                    session.send(bytes([0x90]) + _encode_length(2 + len(granted)) + pid + bytes(granted))
+                elif kind == 10:
+                    session.send(b"\xb0\x02" + body[:2])
+                elif kind == 4:
+                    (pid,) = struct.unpack_from("!H", body)
+                    sent = session.inflight.pop(pid, None)
+                    if sent is not None:
+                        self.acked += 1
+                        self.ack_latency.append(time.perf_counter() - sent)
+                elif kind == 3:
+                    if (header >> 1) & 0x03:
+                        _, pos = _decode_str(body, 0)
+                        session.send(b"\x40\x02" + body[pos:pos + 2])
+                elif kind == 12:
+                    session.send(b"\xd0\x00")
+                elif kind == 14:
+                    return
+        except (OSError, ConnectionError, struct.error, IndexError):
+            pass
+        finally:
+            with self._lock:
+                if session.client_id and self._sessions.get(session.client_id) is session:
+                    del self._sessions[session.client_id]
+            session.sock.close()
+
+    def _on_connect(self, session, body):
+        _, pos = _decode_str(body, 0)       # protocol name
+        flags = body[pos + 1]
+        pos += 4                            # level, flags, keepalive
+        client_id, pos = _decode_str(body, pos)
+        if flags & 0x04:                    # will topic + message
+            _, pos = _decode_str(body, pos)
+            _, pos = _decode_str(body, pos)
+        username = password = None
+        if flags & 0x80:
+            username, pos = _decode_str(body, pos)
+        if flags & 0x40:
+            password, pos = _decode_str(body, pos)
+
+        device = self.rest.devices.get(username)
+        rc = 0 if device is not None and device["auth"] == password else 4
+        session.send(bytes([0x20, 0x02, 0x00, rc]))
+        if rc:
+            raise ConnectionError("bad credentials")
+        session.client_id = client_id
+        with self._lock:
+            old = self._sessions.get(client_id)
+            self._sessions[client_id] = session
+            self.connects += 1
+        if old is not None:
+            self.drop(old)  # MQTT: a second connection with the same client id takes over
+
+    def push(self, payload):
+        """Delivers an alert (dict) on the token topic of every subscribed, connected device."""
+        cities = set(str(payload.get("citiesIds", "")).split(","))
+        tokens = self.rest.subscribers(cities)
+        self.pushed += 1
+        for token in tokens:
+            with self._lock:
+                session = self._sessions.get(token)
+            if session is None or token not in session.topics:
+                self.undelivered += 1
+                continue
+            data = json.dumps(dict(payload, **{SENT_AT_KEY: time.time()}), ensure_ascii=False).encode("utf-8")
+            try:
+                self._publish(session, token, data)
+                self.delivered += 1
+            except OSError:
+                self.undelivered += 1
+
+    def _publish(self, session, topic, data):
+        variable = _encode_str(topic)
+        if self.qos:
+            with session.send_lock:
+                session.next_pid = session.next_pid % 65535 + 1
+                pid = session.next_pid
+            variable += struct.pack("!H", pid)
+            session.inflight[pid] = time.perf_counter()
+        session.send(bytes([0x30 | (self.qos << 1)]) + _encode_length(len(variable) + len(data)) + variable + data)
+
+    def stats(self):
+        lat = sorted(self.ack_latency)
+        return {"connects": self.connects, "pushed": self.pushed, "delivered": self.delivered,
+                "undelivered": self.undelivered, "acked": self.acked,
+                "puback_p50_ms": percentile(lat, 50) * 1000.0, "puback_p99_ms": percentile(lat, 99) * 1000.0}
+
+
+# ─── LOAD GENERATOR ─────────────────────────────────────────────────────────
+
+class LoadGenerator:
+    def __init__(self, payloads, push, *, rate=100.0, start_rate=None, ramp_s=0.0, duration_s=10.0,
+                 dup_rate=0.0, reorder_rate=0.0, seed=None):
+        """
+        payloads: template alerts (dicts), cycled; push(payload) delivers one.
+        The rate ramps linearly from `start_rate` to `rate` over `ramp_s`, then holds until `duration_s`.
+        """
+        if not payloads:
+            raise ValueError("LoadGenerator needs at least one payload")
+        self.payloads = payloads
+        self.push = push
+        self.rate = float(rate)
+        self.start_rate = float(rate if start_rate is None else start_rate)
+        self.ramp_s = float(ramp_s)
+        self.duration_s = float(duration_s)
+        self.dup_rate = dup_rate
+        self.reorder_rate = reorder_rate
+        self._random = random.Random(seed)
+
+        self.sent = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.elapsed_s = 0.0
+
+    def rate_at(self, t):
+        if self.ramp_s <= 0 or t >= self.ramp_s:
+            return self.rate
+        return self.start_rate + (self.rate - self.start_rate) * t / self.ramp_s
+
+    def _fresh(self, n):
+        template = self.payloads[n % len(self.payloads)]
+        payload = dict(template)
+        for key in ("alertTitle", "id", "msgId"):
+            if payload.get(key):
+                payload[key] = f"{payload[key]}#{n}"
+        payload["time"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        return payload
+
+    def run(self, stop=None):
+        """Generates load until `duration_s` has passed (or `stop` is set); returns stats()."""
+        recent = deque(maxlen=256)
+        held = None
+        credit = 0.0
+        n = 0
+        t0 = last = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            t = now - t0
+            if t >= self.duration_s or (stop is not None and stop.is_set()):
+                break
+            credit += self.rate_at(t) * (now - last)
+            last = now
+            while credit >= 1.0:
+                credit -= 1.0
+                if recent and self._random.random() < self.dup_rate:
+                    payload = self._random.choice(recent)
+                    self.duplicates += 1
+                else:
+                    payload = self._fresh(n)
+                    n += 1
+                    recent.append(payload)
+                if held is None and self._random.random() < self.reorder_rate:
+                    held = payload  # goes out after the next one
+                    self.reordered += 1
+                    continue
+                self.push(payload)
+                self.sent += 1
+                if held is not None:
+                    self.push(held)
+                    self.sent += 1
+                    held = None
+            time.sleep(0.001)
+        if held is not None:
+            self.push(held)
+            self.sent += 1
+        self.elapsed_s = time.perf_counter() - t0
+        return self.stats()
+
+    def stats(self):
+        return {"sent": self.sent, "duplicates": self.duplicates, "reordered": self.reordered,
+                "elapsed_s": self.elapsed_s, "offered_msg_s": self.sent / self.elapsed_s if self.elapsed_s else 0.0}
+
+
+# ─── END-TO-END BENCH ───────────────────────────────────────────────────────
+
+class _AppRunner:
+    """MissileAlertsApp's listener thread, started the way AppDaemon's initialize() would."""
+
+    name = "MissileAlertsApp"
+
+    def __init__(self, segments, log_level, config, rest, broker):
+        from alert_replay import AppTarget
+
+        self.target = AppTarget(segments, log_level, config=config)
+        app = self.app = self.target.app
+        app._startup_t0 = time.perf_counter()
+        app.startup_timings = {}
+        self.pipeline, self.seen, self.scheduler, self.metrics = app.pipeline, app._seen, app.ha_scheduler, app._metrics
+        self.token = None
+        self._listener = None
+
+    def start(self):
+        from alert_replay import import_app_module
+
+        app_mod = import_app_module()
+        app = self.app
+        app.token, app.auth = app._ensure_authenticated()
+        app._reconcile_subscriptions()
+        self._listener = app_mod.IoRefListener(app)
+        threading.Thread(target=self._listener.start_loop, daemon=True, name="MQTTListenerLoop").start()
+        self.token = app.token
+
+    def stop(self):
+        if self._listener:
+            self._listener.stop()
+        self.pipeline.stop()
+        self.target.drain()
+
+    def close(self):
+        self.target.close()
+
+
+class _EngineRunner:
+    """The standalone script's AlertEngine (mqttest.py) on its own loop thread; HA goes to the stand-in broker."""
+
+    name = "AlertEngine"
+
+    def __init__(self, segments, log_level, config, rest, broker):
+        import mqttest
+        from alert_engine import AlertEngine
+
+        mqttest.logger.setLevel(log_level)
+        _, ha = rest.handle("/register", {})  # any registered device may publish to the stand-in broker
+        self._tmp = tempfile.TemporaryDirectory(prefix="pushy_standin_")
+        self.engine = engine = AlertEngine(dict(
+            mqttest.CONFIG, **config, segments=list(segments), storage_dir=self._tmp.name,
+            ha_mqtt_host=broker.host, ha_mqtt_port=broker.port, ha_mqtt_user=ha["token"], ha_mqtt_pass=ha["auth"],
+        ), logger=mqttest.logger)
+        self.pipeline, self.seen, self.scheduler, self.metrics = (engine.pipeline, engine._seen, engine.ha_scheduler,
+                                                                  engine.metrics)
+        self.token = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.engine.run, daemon=True, name="AlertEngine")
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        # The engine reconciles subscriptions while its listener connects; load starts once both are done
+        while self.engine.listener is None or "reconcile" not in self.engine.startup_timings:
+            if time.monotonic() > deadline:
+                raise RuntimeError("The engine did not start its listener / reconcile its subscriptions")
+            time.sleep(0.01)
+        self.token = self.engine.listener.token
+
+    def stop(self):
+        if self._thread:
+            self.engine.request_stop()
+            self._thread.join(timeout=10)
+
+    def close(self):
+        self._tmp.cleanup()
+
+
+BENCH_TARGETS = {"app": _AppRunner, "script": _EngineRunner}
+
+
+def bench(payloads, segments, *, rate, start_rate, ramp_s, duration_s, dup_rate, reorder_rate, seed,
+          target="app", log_level="WARNING", settle_s=2.0):
+    """Runs the stand-in plus the app's listener (or the script's engine) in this process and measures the full path."""
+    rest = RestStandin().start()
+    broker = MiniBroker(rest).start()
+    runner = BENCH_TARGETS[target](segments, log_level, {
+        "api_host": rest.url, "mqtt_template": broker.host, "mqtt_port": broker.port, "mqtt_tls": False,
+        "reconnect_candidates": 1, "connect_timeout": 5, "discovery": False, "log_sample_per_s": 1,
+    }, rest, broker)
+    pipeline = runner.pipeline
+
+    # End-to-end latency: broker push → pipeline done (measured around the worker's run())
+    e2e = []
+    run = pipeline.run
+
+    def timed_run(item, received_at=None, source=None):
+        out = run(item, received_at, source)
+        sent_at = item.get(SENT_AT_KEY) if isinstance(item, dict) else None
+        if sent_at:
+            e2e.append(time.time() - sent_at)
+        return out
+
+    pipeline.run = timed_run
+
+    try:
+        runner.start()
+        deadline = time.monotonic() + 10
+        while not broker.connected(runner.token):
+            if time.monotonic() > deadline:
+                raise RuntimeError("The listener did not connect/subscribe to the stand-in broker")
+            time.sleep(0.01)
+
+        # The broker only delivers alerts for subscribed cities, so only those templates are worth replaying
+        with rest._lock:
+            watched = set(rest.devices[runner.token]["topics"])
+        matching = [p for p in payloads if watched.intersection(p["citiesIds"].split(","))]
+        if not matching:
+            logger.warning(f"None of the {len(payloads)} payload templates is for a watched city "
+                           f"({len(watched)} subscribed topics); no load generated. Use --segments with ids "
+                           f"from the captures, or --segments all.")
+        gen = LoadGenerator(matching or payloads, broker.push, rate=rate, start_rate=start_rate, ramp_s=ramp_s,
+                            duration_s=duration_s, dup_rate=dup_rate, reorder_rate=reorder_rate, seed=seed)
+        load = gen.run() if matching else gen.stats()
+
+        # Let the pipeline catch up with what was delivered
+        deadline = time.monotonic() + settle_s
+        while time.monotonic() < deadline:
+            if pipeline.processed >= pipeline.received >= broker.delivered:
+                break
+            time.sleep(0.01)
+    finally:
+        runner.stop()
+        broker.stop()
+        rest.stop()
+
+    lat = sorted(e2e)
+    result = {
+        "target": runner.name,
+        "templates": {"total": len(payloads), "matching": len(matching)},
+        "load": load,
+        "broker": broker.stats(),
+        "rest_calls": dict(rest.calls),
+        "pipeline": {k: v for k, v in pipeline.stats().items() if k != "stages"},
+        "dedup": runner.seen.stats(),
+        "scheduler": runner.scheduler.stats(),
+        "publish_latency": runner.metrics.snapshot().get("receive_to_publish_seconds"),
+        "e2e": {
+            "count": len(lat),
+            "p50_ms": percentile(lat, 50) * 1000.0,
+            "p99_ms": percentile(lat, 99) * 1000.0,
+            "max_ms": (lat[-1] * 1000.0) if lat else 0.0,
+            "throughput_msg_s": len(lat) / load["elapsed_s"] if load["elapsed_s"] else 0.0,
+        },
+        "lost": broker.delivered - pipeline.processed,
+    }
+    runner.close()
+    return result
+
+
+def format_bench(r):
+    load, broker, e2e, pipe = r["load"], r["broker"], r["e2e"], r["pipeline"]
+    return "\n".join([
+        f"── pushy stand-in → {r['target']} ──",
+        f"  templates     : {r['templates']['matching']} of {r['templates']['total']} for watched cities",
+        f"  load          : sent={load['sent']}  dup={load['duplicates']}  reordered={load['reordered']}  "
+        f"offered={load['offered_msg_s']:.0f} msg/s over {load['elapsed_s']:.1f}s",
+        f"  broker        : delivered={broker['delivered']}  acked={broker['acked']}  "
+        f"puback p50={broker['puback_p50_ms']:.2f}ms p99={broker['puback_p99_ms']:.2f}ms",
+        f"  pipeline      : received={pipe['received']}  processed={pipe['processed']}  dropped={pipe['dropped']}  "
+        f"max_depth={pipe['max_depth']}  lost={r['lost']}",
+        f"  dedup         : hits={r['dedup']['hits']}  misses={r['dedup']['misses']}",
+        f"  end to end    : p50={e2e['p50_ms']:.2f}ms  p99={e2e['p99_ms']:.2f}ms  max={e2e['max_ms']:.2f}ms  "
+        f"{e2e['throughput_msg_s']:.0f} msg/s",
+        f"  HA publishes  : sent={r['scheduler']['sent']}  flushes={r['scheduler']['flushes']}  "
+        f"receive→publish={r['publish_latency']}",
+    ])
+
+
+# ─── ENTRY POINT ────────────────────────────────────────────────────────────
+
+def _load_payloads(paths):
+    return [ev.payload for ev in load_capture(paths) if ev.payload.get("citiesIds")]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Local Pushy stand-in (REST + MQTT) and end-to-end load test.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    def common(p):
+        p.add_argument("captures", nargs="*", default=[os.path.join(HERE, "data_examples", "test_data.jsonl")],
+                       help="payload templates in '<iso-ts> [mqtt-host] {json}' format")
+        p.add_argument("--rate", type=float, default=1000.0, help="alerts/s after the ramp")
+        p.add_argument("--start-rate", type=float, default=None, help="alerts/s at the start of the ramp")
+        p.add_argument("--ramp-s", type=float, default=0.0)
+        p.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+        p.add_argument("--dup-rate", type=float, default=0.0, help="probability of re-sending a recent alert")
+        p.add_argument("--reorder-rate", type=float, default=0.0, help="probability of swapping two alerts")
+        p.add_argument("--seed", type=int, default=None)
+
+    serve = sub.add_parser("serve", help="run the stand-in; optionally push load once a device subscribes")
+    common(serve)
+    serve.add_argument("--rest-port", type=int, default=8080)
+    serve.add_argument("--mqtt-port", type=int, default=1883)
+    serve.set_defaults(rate=0.0)
+
+    run = sub.add_parser("bench", help="stand-in + MissileAlertsApp listener (or the script's engine) in this process")
+    common(run)
+    run.add_argument("--target", choices=sorted(BENCH_TARGETS), default="app",
+                     help="app: missile_alerts_app.py's listener thread; script: mqttest.py's asyncio engine")
+    run.add_argument("--segments", default=",".join(DEFAULT_SEGMENTS),
+                     help="comma separated city ids or names to follow, or 'all' for every id in the captures")
+    run.add_argument("--log-level", default="WARNING")
+    run.add_argument("--max-p99-ms", type=float, default=None, help="fail if the end-to-end p99 is above this")
+    run.add_argument("--json", action="store_true")
+    args = ap.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)5s %(message)s")
+    payloads = _load_payloads(args.captures)
+    if not payloads:
+        logger.error("No payloads with citiesIds in the captures.")
+        return 1
+
+    if args.cmd == "serve":
+        rest = RestStandin(port=args.rest_port).start()
+        broker = MiniBroker(rest, port=args.mqtt_port).start()
+        logger.info(f"Pushy REST stand-in on {rest.url}, MQTT broker on {broker.host}:{broker.port}")
+        try:
+            if args.rate > 0:
+                logger.info("Waiting for a subscribed device...")
+                while not any(broker.connected(token) for token in list(rest.devices)):
+                    time.sleep(0.1)
+                gen = LoadGenerator(payloads, broker.push, rate=args.rate, start_rate=args.start_rate,
+                                    ramp_s=args.ramp_s, duration_s=args.duration, dup_rate=args.dup_rate,
+                                    reorder_rate=args.reorder_rate, seed=args.seed)
+                logger.info(f"Load done: {gen.run()}  broker: {broker.stats()}")
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            broker.stop()
+            rest.stop()
+        return 0
+
+    if args.segments == "all":
+        segments = {c for p in payloads for c in p["citiesIds"].split(",") if c}
+    else:
+        segments = {s.strip() for s in args.segments.split(",") if s.strip()}
+    result = bench(payloads, segments, rate=args.rate, start_rate=args.start_rate, ramp_s=args.ramp_s,
+                   duration_s=args.duration, dup_rate=args.dup_rate, reorder_rate=args.reorder_rate,
+                   seed=args.seed, target=args.target, log_level=args.log_level.upper())
+    print(json.dumps(result, indent=2) if args.json else format_bench(result))
+    if not result["templates"]["matching"]:
+        return 0  # nothing to measure with these segments (warned above), not a lost-message failure
+
+    ok = result["lost"] <= 0 and result["e2e"]["count"] > 0
+    if args.max_p99_ms is not None and result["e2e"]["p99_ms"] > args.max_p99_ms:
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
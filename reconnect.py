@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+reconnect.py
+
+Reconnect controller for the Pushy MQTT listener, shared by
+missile_alerts_app.py and mqttest.py.
+
+Pushy's broker host is built from a timestamp (mqtt-{timestamp}.ioref.io);
+any recent timestamp resolves. After a drop the controller
+  - probes a few candidate hosts in parallel (DNS + TCP connect, each with its
+    own timeout) and hands the fastest one to Paho,
+  - waits with jittered exponential backoff between failed attempts; the first
+    attempt after a drop is immediate, so a broker restart costs one handshake
+    (next_endpoint() sleeps on the calling thread; an asyncio caller awaits
+    backoff() itself and runs only the blocking probe() on an executor),
+  - records time-to-reconnect (drop → CONNACK), attempts, failures and probe
+    latency.
+
+Paho's built-in reconnect is disabled for the listener client
+(reconnect_on_failure=False) so loop_forever() returns on a drop and the
+controller picks the next endpoint.
+"""
+
+import time
+import random
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from alert_pipeline import StageTimer
+
+
+def candidate_endpoints(template, now=None, count=2):
+    """Timestamped broker hosts for `now`, `now - 1`, ... (`count` of them)."""
+    now = int(time.time() if now is None else now)
+    return [template.replace("{timestamp}", str(now - i)) for i in range(count)]
+
+
+def _probe(host, port, timeout):
+    t0 = time.perf_counter()
+    with socket.create_connection((host, port), timeout=timeout):
+        pass
+    return time.perf_counter() - t0
+
+
+def probe_endpoints(hosts, port, timeout):
+    """
+    DNS-resolves and TCP-connects to every host in parallel.
+    Returns (host, seconds) of the first one to answer; raises OSError if none does.
+    """
+    if len(hosts) == 1:
+        return hosts[0], _probe(hosts[0], port, timeout)
+    errors = []
+    pool = ThreadPoolExecutor(max_workers=len(hosts), thread_name_prefix="MQTTProbe")
+    try:
+        futures = {pool.submit(_probe, host, port, timeout): host for host in hosts}
+        for future in as_completed(futures):
+            try:
+                return futures[future], future.result()
+            except OSError as e:
+                errors.append(f"{futures[future]}: {e}")
+    finally:
+        pool.shutdown(wait=False)
+    raise OSError(f"No broker endpoint reachable ({'; '.join(errors)})")
+
+
+class ReconnectController:
+    def __init__(self, template, port, *, timeout=10, candidates=2, backoff_s=0.5, max_backoff_s=30.0,
+                 logger=None):
+        self.template = template
+        self.port = port
+        self.timeout = timeout
+        self.candidates = max(1, int(candidates))
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.logger = logger or logging.getLogger("missile_alerts")
+
+        self._lock = threading.Lock()
+        self._failures = 0          # consecutive failed attempts
+        self._down_since = None     # perf_counter() of the drop, None while connected
+        self._session_up = False    # CONNACK received since the last attempt
+        self._ever_connected = False
+        self._stop = threading.Event()
+
+        self.attempts = 0
+        self.failed = 0
+        self.reconnect_time = StageTimer()  # drop → CONNACK
+        self.probe_time = StageTimer()
+
+    # ─── ATTEMPTS ───────────────────────────────────────────────────────────
+
+    def next_endpoint(self):
+        """Waits out the backoff, then returns the fastest reachable host (raises OSError)."""
+        delay = self.backoff()
+        if delay > 0 and self._stop.wait(delay):
+            raise OSError("listener stopping")
+        return self.probe()
+
+    def backoff(self):
+        """The delay to wait before the next attempt (0 right after a drop); callers on an event loop sleep it."""
+        delay = self._delay()
+        if delay > 0:
+            self.logger.info(f"Reconnecting in {delay:.2f}s (attempt {self._failures + 1})")
+        return delay
+
+    def probe(self):
+        """Starts an attempt and returns the fastest reachable host (blocking; raises OSError)."""
+        with self._lock:
+            self.attempts += 1
+            self._session_up = False
+            if self._down_since is None and self._ever_connected:
+                self._down_since = time.perf_counter()
+        hosts = candidate_endpoints(self.template, count=self.candidates)
+        host, elapsed = probe_endpoints(hosts, self.port, self.timeout)
+        with self._lock:
+            self.probe_time.add(elapsed)
+        return host
+
+    def _delay(self):
+        """Full-jitter exponential backoff; the first attempt after a drop is immediate."""
+        if self._failures == 0:
+            return 0.0
+        return random.uniform(0, min(self.max_backoff_s, self.backoff_s * (2 ** self._failures)))
+
+    # ─── EVENTS ─────────────────────────────────────────────────────────────
+
+    def on_failure(self):
+        """An attempt failed before the session was up (probe, connect or CONNACK)."""
+        with self._lock:
+            self._failures += 1
+            self.failed += 1
+
+    def on_connected(self):
+        """Call on a successful CONNACK; returns the downtime in seconds (None on first connect)."""
+        with self._lock:
+            self._failures = 0
+            self._session_up = True
+            self._ever_connected = True
+            if self._down_since is None:
+                return None
+            down = time.perf_counter() - self._down_since
+            self._down_since = None
+            self.reconnect_time.add(down)
+        return down
+
+    def on_disconnected(self):
+        """Call on every disconnect; a disconnect before CONNACK counts as a failed attempt."""
+        with self._lock:
+            if not self._session_up:
+                self._failures += 1
+                self.failed += 1
+            self._session_up = False
+            if self._down_since is None and self._ever_connected:
+                self._down_since = time.perf_counter()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return {"attempts": self.attempts, "failed": self.failed,
+                    "reconnect": self.reconnect_time.as_dict(), "probe": self.probe_time.as_dict()}
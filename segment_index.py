@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+segment_index.py
+
+Precompiled segment (city) filter, shared by missile_alerts_app.py and
+mqttest.py.
+
+Built once at startup from the Segment data: a subscription to a parent city
+(e.g. "חיפה", 5005025) also matches alerts for its child segments
+("חיפה - קריית חיים ושמואל", 5001878), and a subscription to a child also
+matches alerts that only carry its parent id.
+
+`match()` works directly on the raw comma-separated `citiesIds` string: for
+typical watch lists (a handful of ids) it first probes the string with
+C-level substring checks, so the ~99% of alerts that don't concern us are
+rejected without splitting the string or allocating a set. Only probe hits
+(and large watch lists) go through the exact split/isdisjoint check.
+"""
+
+import os
+import json
+import logging
+from collections import defaultdict
+
+PARENT_SUFFIX = " (ראשי)"
+PROBE_MAX_IDS = 32  # Above this many watched ids, substring probing costs more than splitting
+
+_NO_HITS = frozenset()
+
+
+def load_parent_map(segment_file=None, cities_file=None, logger=None):
+    """
+    Returns {child_id: parent_id}.
+
+    Prefers raw_data/Segment.json (explicit `parent` field). Falls back to
+    cities.json, where parent cities carry the " (ראשי)" suffix and their
+    children are named "<parent> - <area>".
+    """
+    logger = logger or logging.getLogger("missile_alerts")
+    if segment_file and os.path.exists(segment_file):
+        with open(segment_file, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        return {str(r["id"]): str(r["parent"]) for r in rows if r.get("parent")}
+
+    if cities_file and os.path.exists(cities_file):
+        with open(cities_file, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        prefixes = {}
+        for r in rows:
+            if r["name"].endswith(PARENT_SUFFIX):
+                base = r["name"][:-len(PARENT_SUFFIX)].split(" - ")[0].strip()
+                prefixes[base + " -"] = str(r["id"])
+        parents = {}
+        for r in rows:
+            if r["name"].endswith(PARENT_SUFFIX):
+                continue
+            for prefix, pid in prefixes.items():
+                if r["name"].startswith(prefix):
+                    parents[str(r["id"])] = pid
+                    break
+        return parents
+
+    logger.warning("No Segment.json / cities.json found; parent/child segment expansion is disabled.")
+    return {}
+
+
+class SegmentIndex:
+    def __init__(self, watched, parent_map=None):
+        self.watched = frozenset(str(s) for s in watched)
+        self.parent_of = dict(parent_map or {})
+        self.children_of = defaultdict(set)
+        for child, parent in self.parent_of.items():
+            self.children_of[parent].add(child)
+
+        downward = set(self.watched)
+        for seg in self.watched:
+            downward.update(self.children_of.get(seg, ()))
+        self.downward = frozenset(downward)
+        self.expanded = frozenset(downward.union(
+            self.parent_of[seg] for seg in self.watched if seg in self.parent_of))
+        self._probe = tuple(self.expanded) if len(self.expanded) <= PROBE_MAX_IDS else None
+
+    @classmethod
+    def from_files(cls, watched, segment_file=None, cities_file=None, logger=None):
+        return cls(watched, load_parent_map(segment_file, cities_file, logger))
+
+    def match(self, cities_ids):
+        """
+        Returns the ids in the raw `citiesIds` string that concern a watched
+        segment (directly or via parent/child), or an empty frozenset.
+        """
+        if not cities_ids or not self.expanded:
+            return _NO_HITS
+        if self._probe is not None:
+            for seg in self._probe:
+                if seg in cities_ids:
+                    break
+            else:
+                return _NO_HITS
+        ids = cities_ids.split(",")
+        if self.expanded.isdisjoint(ids):
+            return _NO_HITS
+        return self.expanded.intersection(ids)
+
+    def topics(self):
+        """
+        Pushy topics to subscribe to: the watched segments plus the children
+        of watched parents.
+
+        Parents of watched children are matched but deliberately not
+        subscribed: alerts are published per child segment id (none of the
+        recorded captures carries a parent id), so watching 5001878 must not
+        add a subscription to the whole of Haifa (5005025).
+        """
+        return self.downward
+
+    def __contains__(self, seg):
+        return seg in self.expanded
+
+    def __len__(self):
+        return len(self.expanded)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+state_journal.py
+
+Append-only journal of the active-alert state, shared by
+missile_alerts_app.py and mqttest.py, so a restart during an event republishes
+the alerts that are still active instead of an empty state.
+
+Every state update appends one compact JSON line; expiry is not journaled,
+since every entry carries its own deadline and entries past it are simply
+dropped on replay. compact() rewrites the file atomically as a single
+snapshot line, which keeps restart cost bounded by the number of live
+entries. Lines carry the state version they produced, so an update that
+races a compaction is never applied twice, and compact() refuses a snapshot
+older than the last appended line, so it can never overwrite one either.
+
+Line format:
+    {"op": "snapshot", "v": 12, "state": {"<list key>": [entry, ...], ...}}
+    {"op": "add", "v": 13, "key": "<list key>", "clear": "<list key>", "entries": [entry, ...]}
+where entry = [alertDate, title, data, category, id, deadline, segment id]
+(entries written before segment ids were journaled have six fields).
+"""
+
+import os
+import json
+import logging
+import threading
+
+from alert_record import AlertRecord
+from storage import atomic_write
+
+
+def _entry(record):
+    return [record.alert_date, record.title, record.data, record.category, record.alert_id, record.deadline,
+            record.segment]
+
+
+def _record(entry):
+    return AlertRecord(*entry)
+
+
+class StateJournal:
+    def __init__(self, path, *, logger=None):
+        self.path = path
+        self.logger = logger or logging.getLogger("missile_alerts")
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = 0        # lines appended since the last compaction
+        self._version = 0        # highest state version in the file
+        self._snapshot_size = 0  # live entries written by the last compaction
+
+        self.appended = 0
+        self.compactions = 0
+
+    # ─── REPLAY ─────────────────────────────────────────────────────────────
+
+    def load(self, keys, now):
+        """
+        Replays the journal and returns (state, version): {key: [AlertRecord, ...]}
+        for `keys`, without entries whose deadline is at or before `now`.
+        """
+        state = {key: [] for key in keys}
+        version = 0
+        lines = skipped = 0
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return state, version
+        with f:
+            for line in f:
+                lines += 1
+                try:
+                    rec = json.loads(line)
+                    v = rec["v"]
+                    if rec["op"] == "snapshot":
+                        state = {key: [_record(e) for e in rec["state"].get(key, [])] for key in keys}
+                    elif rec["op"] == "add":
+                        if v <= version:
+                            continue  # already part of the snapshot
+                        if rec["clear"] in state:
+                            state[rec["clear"]] = []
+                        if rec["key"] in state:
+                            state[rec["key"]].extend(_record(e) for e in rec["entries"])
+                    else:
+                        raise ValueError(f"unknown op {rec['op']!r}")
+                    version = max(version, v)
+                except (ValueError, KeyError, TypeError) as e:
+                    # A torn last line from a kill mid-append is expected; anything else is logged too
+                    skipped += 1
+                    self.logger.warning(f"Skipping unreadable state journal line {lines}: {e}")
+        with self._lock:
+            self._version = max(self._version, version)
+
+        live = {key: [r for r in records if r.deadline is not None and r.deadline > now]
+                for key, records in state.items()}
+        kept = sum(len(records) for records in live.values())
+        dropped = sum(len(records) for records in state.values()) - kept
+        self.logger.info(f"Replayed state journal: {lines} lines, {kept} active entries restored, "
+                         f"{dropped} expired dropped, {skipped} skipped")
+        return live, version
+
+    # ─── WRITING ────────────────────────────────────────────────────────────
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        return self._file
+
+    def append(self, version, key, clear, records):
+        """Journals `key += records` after clearing `clear`, which produced state `version`."""
+        line = json.dumps({"op": "add", "v": version, "key": key, "clear": clear,
+                           "entries": [_entry(r) for r in records]}, ensure_ascii=False)
+        with self._lock:
+            try:
+                f = self._open()
+                f.write(line + "\n")
+                f.flush()
+            except OSError as e:
+                self.logger.error(f"State journal append failed: {e}")
+                return
+            self._pending += 1
+            self._version = max(self._version, version)
+            self.appended += 1
+
+    def compact(self, version, state, force=False):
+        """
+        Rewrites the journal as one snapshot of `state` (at `version`) if anything
+        changed since the last compaction. Returns True if the file was rewritten.
+
+        A snapshot taken before the last appended version is refused (False):
+        writing it would lose that update, so the caller retries with a fresh
+        snapshot next time.
+        """
+        size = sum(len(records) for records in state.values())
+        with self._lock:
+            if version < self._version:
+                self.logger.debug(f"Skipping state journal compaction: snapshot v{version} is older than "
+                                  f"the journaled v{self._version}")
+                return False
+            if not force and not self._pending and size == self._snapshot_size:
+                return False
+            line = json.dumps({"op": "snapshot", "v": version,
+                               "state": {key: [_entry(r) for r in records] for key, records in state.items()}},
+                              ensure_ascii=False)
+            try:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                atomic_write(self.path, line + "\n")
+            except OSError as e:
+                self.logger.error(f"State journal compaction failed: {e}")
+                return False
+            self._pending = 0
+            self._version = version
+            self._snapshot_size = size
+            self.compactions += 1
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        with self._lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            return {"appended": self.appended, "compactions": self.compactions,
+                    "pending": self._pending, "bytes": size}
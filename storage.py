@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+storage.py
+
+Crash-safe storage for the device credentials (token.json), the Android id
+(android_id.txt) and the subscription progress (subs.json), shared by
+missile_alerts_app.py and mqttest.py.
+
+Every write goes to a temporary file in the same directory, is fsync'ed and
+then renamed over the target (and the directory entry fsync'ed), so a kill
+mid-write leaves either the old or the new file, never a truncated one.
+JSON files carry a schema version:
+    {"schema": 1, "data": {...}}
+Files written before versioning (a bare JSON object) are still read and are
+upgraded on the next write.
+
+Reads are served from an in-memory cache after the first load, so nothing on
+a hot path touches the disk. A file that exists but cannot be parsed raises
+StorageError instead of looking empty: an empty token.json would make the
+caller register a new device, which can get the whole solution banned.
+"""
+
+import os
+import json
+import logging
+import tempfile
+import threading
+
+SCHEMA_VERSION = 1
+TMP_PREFIX = ".tmp-"
+
+
+class StorageError(RuntimeError):
+    """A stored file exists but is unreadable or has an unknown schema."""
+
+
+def atomic_write(path, text):
+    """Writes `text` (str, or bytes for binary files) to `path` via write → fsync → rename."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=TMP_PREFIX, dir=directory)
+    try:
+        with (os.fdopen(fd, "wb") if isinstance(text, bytes) else os.fdopen(fd, "w", encoding="utf-8")) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # e.g. Windows; the rename itself is still atomic
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class Storage:
+    def __init__(self, directory, *, logger=None):
+        self.directory = directory
+        self.logger = logger or logging.getLogger("missile_alerts")
+        self._lock = threading.Lock()
+        self._cache = {}  # absolute path -> dict / str
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale_tmp()
+
+    def _path(self, name):
+        """`name` may be a file name inside the storage dir or a full path."""
+        return os.path.abspath(os.path.join(self.directory, name))
+
+    def _remove_stale_tmp(self):
+        """Drops temp files left behind by a write that was killed before its rename."""
+        for entry in os.listdir(self.directory):
+            if entry.startswith(TMP_PREFIX):
+                try:
+                    os.unlink(os.path.join(self.directory, entry))
+                    self.logger.warning(f"Removed stale temp file {entry} from an interrupted write")
+                except OSError:
+                    pass
+
+    # ─── JSON ───────────────────────────────────────────────────────────────
+
+    def load(self, name):
+        """Returns the stored dict ({} if the file does not exist)."""
+        path = self._path(name)
+        with self._lock:
+            if path not in self._cache:
+                self._cache[path] = self._read_json(path)
+            return dict(self._cache[path])
+
+    def save(self, name, data):
+        path = self._path(name)
+        data = dict(data)
+        text = json.dumps({"schema": SCHEMA_VERSION, "data": data}, ensure_ascii=False)
+        with self._lock:
+            atomic_write(path, text)
+            self._cache[path] = data
+
+    def _read_json(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return {}
+        except OSError as e:
+            raise StorageError(f"Cannot read {path}: {e}") from e
+        try:
+            doc = json.loads(raw)
+        except ValueError as e:
+            raise StorageError(f"{path} is corrupt ({e}); refusing to treat it as empty") from e
+        if not isinstance(doc, dict):
+            raise StorageError(f"{path} does not contain a JSON object")
+        if "schema" not in doc:
+            return doc  # pre-versioning file, upgraded on the next save
+        if doc["schema"] != SCHEMA_VERSION or not isinstance(doc.get("data"), dict):
+            raise StorageError(f"{path} has unsupported schema {doc.get('schema')!r}")
+        return doc["data"]
+
+    # ─── TEXT ───────────────────────────────────────────────────────────────
+
+    def load_text(self, name):
+        """Returns the stripped file contents, or None if the file does not exist."""
+        path = self._path(name)
+        with self._lock:
+            if path not in self._cache:
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        self._cache[path] = f.read().strip() or None
+                except FileNotFoundError:
+                    self._cache[path] = None
+                except OSError as e:
+                    raise StorageError(f"Cannot read {path}: {e}") from e
+            return self._cache[path]
+
+    def save_text(self, name, text):
+        path = self._path(name)
+        with self._lock:
+            atomic_write(path, text)
+            self._cache[path] = text.strip() or None
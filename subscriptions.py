@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+subscriptions.py
+
+Batched, diff-based reconciliation of Pushy topic subscriptions, shared by
+missile_alerts_app.py and mqttest.py.
+
+The diff between the desired topics and the topics recorded in subs.json is
+split into bounded batches which are sent concurrently (at most
+`concurrency` requests in flight). subs.json is updated after every batch
+that succeeds, so a crash or a failed batch mid-reconcile resumes from the
+recorded progress on the next run instead of starting over. Failed batches
+are retried once at the end, then the recorded set is verified against the
+desired one.
+
+subs.json format:
+    {"topics": [...confirmed subscribed topics...], "dance_done": true}
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def chunked(items, size):
+    items = sorted(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class SubscriptionReconciler:
+    def __init__(self, client, token, auth, subs_file, *, load_json, save_json,
+                 batch_size=50, concurrency=3, logger=None):
+        """
+        client: PushyClient
+        load_json(path) -> dict, save_json(path, data): storage helpers of the caller
+        """
+        self.client = client
+        self.token = token
+        self.auth = auth
+        self.subs_file = subs_file
+        self._load_json = load_json
+        self._save_json = save_json
+        self.batch_size = max(1, int(batch_size))
+        self.concurrency = max(1, int(concurrency))
+        self.logger = logger or logging.getLogger("missile_alerts")
+
+        self._lock = threading.Lock()
+        self._state = None
+
+    # ─── PROGRESS ───────────────────────────────────────────────────────────
+
+    def _load(self):
+        data = self._load_json(self.subs_file)
+        return {
+            "topics": set(data.get("topics", [])),
+            # subs.json files written before batching only existed after the first-run dance
+            "dance_done": bool(data.get("dance_done", "topics" in data)),
+        }
+
+    def _persist(self):
+        self._save_json(self.subs_file, {
+            "topics": sorted(self._state["topics"]),
+            "dance_done": self._state["dance_done"],
+        })
+
+    # ─── API ────────────────────────────────────────────────────────────────
+
+    def _call(self, path, topics):
+        resp = self.client.post(path, {"token": self.token, "auth": self.auth, "topics": list(topics)},
+                                bypass_status=True)
+        if not resp.get("success", False):
+            raise RuntimeError(f"{path} failed: {resp}")
+
+    def _run_batch(self, action, batch):
+        path = "/devices/subscribe" if action == "subscribe" else "/devices/unsubscribe"
+        try:
+            self._call(path, batch)
+        except Exception as e:
+            self.logger.error(f"{action.capitalize()} batch of {len(batch)} failed: {e}")
+            return False
+        with self._lock:
+            if action == "subscribe":
+                self._state["topics"].update(batch)
+            else:
+                self._state["topics"].difference_update(batch)
+            self._persist()
+        return True
+
+    def _run_batches(self, action, batches):
+        """Runs batches concurrently; returns the batches that failed."""
+        if not batches:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches)),
+                                thread_name_prefix=f"Pushy{action.capitalize()}") as pool:
+            results = list(pool.map(lambda b: self._run_batch(action, b), batches))
+        return [b for b, ok in zip(batches, results) if not ok]
+
+    # ─── RECONCILE ──────────────────────────────────────────────────────────
+
+    def reconcile(self, desired):
+        """
+        Brings the device subscriptions to `desired`.
+        Returns a summary dict; `in_sync` tells whether the recorded set matches.
+        """
+        desired = set(desired)
+        self._state = self._load()
+
+        if not self._state["dance_done"]:
+            self.logger.info("No subs.json → first-run dance (sub1,unsub1)")
+            self._call("/devices/subscribe", ["1"])
+            self._call("/devices/unsubscribe", ["1"])
+            self._state["dance_done"] = True
+            self._persist()
+
+        prev = set(self._state["topics"])
+        to_unsub = prev - desired
+        to_sub = desired - prev
+        if not to_unsub and not to_sub:
+            self.logger.info("No subscription changes needed.")
+            return {"subscribed": 0, "unsubscribed": 0, "failed": 0, "in_sync": True}
+
+        unsub_batches = chunked(to_unsub, self.batch_size)
+        sub_batches = chunked(to_sub, self.batch_size)
+        if to_unsub:
+            self.logger.info(f"Unsubscribing removed: {len(to_unsub)} topics in {len(unsub_batches)} batches")
+        if to_sub:
+            self.logger.info(f"Subscribing new: {len(to_sub)} topics in {len(sub_batches)} batches")
+
+        failed_unsub = self._run_batches("unsubscribe", unsub_batches)
+        failed_sub = self._run_batches("subscribe", sub_batches)
+
+        # One sequential retry pass for whatever failed
+        if failed_unsub or failed_sub:
+            self.logger.warning(f"Retrying {len(failed_unsub) + len(failed_sub)} failed subscription batches")
+            failed_unsub = [b for b in failed_unsub if not self._run_batch("unsubscribe", b)]
+            failed_sub = [b for b in failed_sub if not self._run_batch("subscribe", b)]
+
+        # Verify the recorded set against the desired one
+        recorded = self._state["topics"]
+        missing = desired - recorded
+        extra = recorded - desired
+        in_sync = not missing and not extra
+        if in_sync:
+            self.logger.info(f"Subscriptions in sync ({len(recorded)} topics); saved subs.json")
+        else:
+            self.logger.error(f"Subscriptions out of sync after reconcile: {len(missing)} missing, "
+                              f"{len(extra)} extra. Progress is saved; the rest is retried on next start.")
+        return {
+            "subscribed": len(to_sub) - sum(len(b) for b in failed_sub),
+            "unsubscribed": len(to_unsub) - sum(len(b) for b in failed_unsub),
+            "failed": sum(len(b) for b in failed_sub + failed_unsub),
+            "in_sync": in_sync,
+        }
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from alert_dedup import DedupCache, alert_key
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_duplicate_within_the_ttl_is_caught_and_forgotten_after_it():
+    clock = Clock()
+    cache = DedupCache(capacity=10, ttl_s=10, clock=clock)
+    assert not cache.seen("a")
+    clock.now = 9.9
+    assert cache.seen("a")
+    clock.now = 10.0
+    assert "a" not in cache
+    assert not cache.seen("a")
+    assert cache.stats()["expirations"] == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_capacity_evicts_the_oldest_first_seen_key():
+    cache = DedupCache(capacity=2, ttl_s=3600, clock=Clock())
+    cache.seen("a")
+    cache.seen("b")
+    assert cache.seen("a")  # a hit does not make "a" younger
+    cache.seen("c")
+    assert "a" not in cache
+    assert "b" in cache and "c" in cache
+    assert cache.evictions == 1
+    assert len(cache) == 2
+
+
+def test_alert_key_prefers_the_alert_uuid():
+    assert alert_key({"alertTitle": " 5b1c-uuid ", "id": 7, "msgId": 3}) == "5b1c-uuid"
+
+
+def test_alert_key_falls_back_to_id_and_msg_id():
+    assert alert_key({"alertTitle": "", "id": 134, "msgId": 5}) == "134:5"
+    assert alert_key({"id": "134"}) == "134"
+    assert alert_key({"msgId": 5}) == ""
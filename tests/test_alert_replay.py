@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import os
+import logging
+
+import pytest
+
+from alert_replay import TARGETS, DEFAULT_SEGMENTS, HERE, load_capture, replay
+
+CAPTURE = os.path.join(HERE, "data_examples", "test_data.jsonl")
+
+
+@pytest.mark.parametrize("name", sorted(TARGETS))
+def test_capture_replays_offline(name):
+    """Runs without AppDaemon or a broker; both targets see the same alerts."""
+    target = TARGETS[name](DEFAULT_SEGMENTS, logging.WARNING)
+    try:
+        result = replay(load_capture([CAPTURE]), target)
+    finally:
+        target.close()
+    assert result["count"] == 3893
+    assert result["publishes"] == 6
+
+
+def test_app_heartbeat_resends_only_the_state_topics():
+    target = TARGETS["app"](DEFAULT_SEGMENTS, logging.WARNING, config={"groups": {"5001878": None}})
+    app = target.app
+    try:
+        app.ha_scheduler.flush()
+        first = [topic for _, topic, _ in target.recorder.published]
+        app._heartbeat({})
+        app.ha_scheduler.flush()
+        resent = [topic for _, topic, _ in target.recorder.published[len(first):]]
+    finally:
+        target.close()
+    assert app.ATTR_TOPIC in first
+    assert sorted(resent) == sorted([app.STATE_TOPIC, "missile_alerts/5001878"])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from alert_sources import PUSHY, AlertSource, HttpPollSource, SourceMerger
+
+HTTP = "oref_http"
+KEY = ("active_threat", "5001878")
+CITY_IDS = {"חיפה - קריית חיים ושמואל": ["5001878"], "קריית מוצקין": ["5001347"]}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def merger(clock, window_s=30):
+    return SourceMerger([PUSHY, HTTP], window_s, clock=clock)
+
+
+def test_alert_source_requires_a_run_method():
+    with pytest.raises(TypeError):
+        AlertSource(lambda payload, source: None)
+
+
+def test_the_first_source_wins_and_a_late_source_is_dropped_inside_the_window():
+    clock = Clock()
+    m = merger(clock)
+    assert m.claim(HTTP, KEY)
+    clock.now += 1.5
+    assert not m.claim(PUSHY, KEY)
+    assert (m.first, m.late) == ({PUSHY: 0, HTTP: 1}, {PUSHY: 1, HTTP: 0})
+    assert m.stats()[PUSHY]["avg_lag_s"] == 1.5
+
+
+def test_repeats_from_the_owning_source_pass():
+    clock = Clock()
+    m = merger(clock)
+    assert m.claim(PUSHY, KEY)
+    clock.now += 10
+    assert m.claim(PUSHY, KEY)
+    assert not m.claim(HTTP, KEY)
+    assert m.first[PUSHY] == 1
+
+
+def test_a_key_is_free_again_after_the_window():
+    clock = Clock()
+    m = merger(clock)
+    assert m.claim(PUSHY, KEY)
+    clock.now += 30
+    assert m.claim(HTTP, KEY)
+    assert m.first == {PUSHY: 1, HTTP: 1}
+    assert m.claim(PUSHY, ("active_threat", "5001347"))  # other keys are independent
+
+
+def source():
+    return HttpPollSource(lambda payload, name: None, "http://127.0.0.1:1/alerts.json",
+                          lambda city: CITY_IDS.get(city, []))
+
+
+def alert(*cities, aid="134000"):
+    return {"id": aid, "cat": "1", "title": "ירי רקטות וטילים", "desc": "היכנסו למרחב המוגן", "data": list(cities)}
+
+
+def test_normalize_gives_a_pushy_shaped_payload():
+    payload = source().normalize(alert("חיפה - קריית חיים ושמואל", "קריית מוצקין"), 0)
+    assert payload["citiesIds"] == "5001878,5001347"
+    assert payload["title"] == "ירי רקטות וטילים"
+    assert (payload["id"], payload["cat"]) == ("134000", "1")
+    assert payload["alertTitle"] == "oref_http:134000:2"
+    assert {"desc", "threatId", "time"} <= set(payload)
+
+
+def test_normalize_emits_only_cities_added_to_a_known_alert():
+    s = source()
+    assert s.normalize(alert("קריית מוצקין"), 0)["citiesIds"] == "5001347"
+    assert s.normalize(alert("קריית מוצקין"), 1) is None
+    later = s.normalize(alert("קריית מוצקין", "חיפה - קריית חיים ושמואל"), 2)
+    assert later["citiesIds"] == "5001878"
+    assert later["alertTitle"] == "oref_http:134000:2"
+
+
+def test_normalize_skips_alerts_without_an_id_or_known_cities():
+    s = source()
+    assert s.normalize(alert("קריית מוצקין", aid=""), 0) is None
+    assert s.normalize(alert("עיר לא קיימת"), 0) is None
+    assert s.unresolved == 1
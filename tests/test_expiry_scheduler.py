@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+from expiry_scheduler import ExpiryScheduler
+
+
+def test_pop_due_returns_only_items_past_their_deadline_in_order():
+    sched = ExpiryScheduler(lambda items: None, clock=lambda: 100.0)
+    sched.schedule(105.0, "c")
+    sched.schedule(90.0, "a")
+    sched.schedule(100.0, "b")
+    assert sched.pop_due() == ["a", "b"]
+    assert len(sched) == 1
+    assert sched.next_deadline() == 105.0
+
+
+def test_due_items_are_handed_over_in_one_call():
+    batches = []
+    fired = threading.Event()
+
+    def on_expire(items):
+        batches.append(sorted(items))
+        fired.set()
+
+    sched = ExpiryScheduler(on_expire)
+    sched.start()
+    try:
+        deadline = time.time() + 0.1
+        sched.schedule(deadline, "x")
+        sched.schedule(deadline, "y")
+        assert fired.wait(2)
+    finally:
+        sched.stop()
+    assert batches == [["x", "y"]]
+    assert sched.fired == 2
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import json
+
+from ha_discovery import discovery_payloads, object_id
+
+SENSORS = [("Missile Alert", "missile_alerts/5001878", "missile_alerts/5001878_attr"),
+           ("Missile Alert - חיפה", "missile_alerts/חיפה", "missile_alerts/חיפה_attr")]
+
+
+def test_one_retained_config_per_sensor_with_unique_ids():
+    payloads = discovery_payloads(SENSORS, "missile_alerts/status")
+    configs = [json.loads(payload) for _, payload in payloads]
+    assert [topic for topic, _ in payloads] == [
+        f"homeassistant/binary_sensor/missile_alerts/{c['object_id']}/config" for c in configs]
+    assert len({c["unique_id"] for c in configs}) == 2
+    assert all(c["availability_topic"] == "missile_alerts/status" for c in configs)
+    assert "expire_after" not in configs[0]
+
+
+def test_expire_after_is_set_on_every_sensor():
+    payloads = discovery_payloads(SENSORS, "missile_alerts/status", expire_after=180.0)
+    assert [json.loads(payload)["expire_after"] for _, payload in payloads] == [180, 180]
+
+
+def test_object_id_of_a_non_ascii_topic_is_stable_ascii():
+    oid = object_id("חיפה")
+    assert oid == object_id("חיפה") and oid.isascii() and oid
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import socket
+import asyncio
+
+import pytest
+
+from loop_io import LoopMqtt, READ_BATCH
+
+
+class TLSLikeSocket:
+    """A socket whose data already sits decrypted in the SSL buffer: pending() > 0, nothing to select."""
+
+    def __init__(self):
+        self._sock, self._peer = socket.socketpair()
+        self.packets = 0
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def pending(self):
+        return self.packets * 2  # bytes of buffered PINGRESP-sized packets
+
+    def close(self):
+        self._sock.close()
+        self._peer.close()
+
+
+class FakeClient:
+    """Just enough of a Paho client: loop_read() consumes one buffered packet."""
+
+    def __init__(self):
+        self.sock = None
+        self.reads = 0
+
+    def loop_read(self):
+        self.reads += 1
+        if self.sock.packets:
+            self.sock.packets -= 1
+
+
+@pytest.fixture
+def io():
+    loop = asyncio.new_event_loop()
+    client = FakeClient()
+    client.sock = TLSLikeSocket()
+    io = LoopMqtt(client, loop)
+    io._on_open(client.sock)
+    yield io
+    io._on_close(client.sock)
+    client.sock.close()
+    loop.close()
+
+
+def spin(loop):
+    loop.run_until_complete(asyncio.sleep(0.05))
+
+
+def test_read_batch_reschedules_while_tls_bytes_are_pending(io):
+    sock = io.client.sock
+    sock.packets = READ_BATCH * 2 + 5
+    io._read()  # one readiness event
+    assert sock.packets == READ_BATCH + 5
+    spin(io.loop)
+    assert sock.packets == 0
+
+
+def test_resume_reads_tls_bytes_buffered_during_the_pause(io):
+    sock = io.client.sock
+    io.pause_reading()
+    sock.packets = 3
+    spin(io.loop)
+    assert sock.packets == 3  # paused: nothing read
+    io.resume_reading()
+    spin(io.loop)
+    assert sock.packets == 0
+    assert io.pauses == 1
+
+
+def test_scheduled_read_is_dropped_once_paused(io):
+    sock = io.client.sock
+    sock.packets = READ_BATCH + 1
+    io._read()
+    io.pause_reading()
+    spin(io.loop)
+    assert sock.packets == 1
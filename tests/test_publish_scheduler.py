@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+from publish_scheduler import PublishScheduler
+
+
+class Recorder:
+    def __init__(self, fail_on=()):
+        self.sent = []
+        self.fail_on = set(fail_on)
+        self.event = threading.Event()
+
+    def send(self, topic, payload):
+        if topic in self.fail_on:
+            self.fail_on.discard(topic)
+            raise OSError("broker gone")
+        self.sent.append((topic, payload))
+        self.event.set()
+
+
+def make(state, window_s=0.1, fail_on=()):
+    rec = Recorder(fail_on)
+    sched = PublishScheduler(lambda: list(state.items()), rec.send, window_s=window_s)
+    return sched, rec
+
+
+def test_urgent_request_bypasses_the_coalescing_window():
+    state = {"state": "1"}
+    sched, rec = make(state, window_s=30)
+    sched.start()
+    try:
+        sched.request()  # would wait 30 s
+        assert not rec.event.wait(0.2)
+        sched.request(urgent=True)
+        assert rec.event.wait(2)
+        assert rec.sent == [("state", "1")]
+    finally:
+        sched.stop(flush=False)
+
+
+def test_requests_within_the_window_coalesce_into_one_flush():
+    state = {"state": "0", "attr": "{}"}
+    sched, rec = make(state, window_s=0.1)
+    sched.start()
+    try:
+        for _ in range(5):
+            sched.request()
+        assert rec.event.wait(2)
+    finally:
+        sched.stop()
+    assert sched.requests == 5
+    assert sched.flushes == 1
+    assert sorted(rec.sent) == [("attr", "{}"), ("state", "0")]
+
+
+def test_unchanged_topics_are_skipped_until_forgotten():
+    state = {"state": "0", "attr": "{}"}
+    sched, rec = make(state)
+    sched.flush()
+    sched.flush()
+    assert len(rec.sent) == 2
+    assert sched.skipped == 2
+
+    sched.forget("attr")
+    sched.flush()
+    assert rec.sent[-1] == ("attr", "{}")
+    assert len(rec.sent) == 3
+
+    sched.forget()
+    sched.flush()
+    assert len(rec.sent) == 5
+    assert sched.last_sent("state") == "0"
+
+
+def test_failed_send_is_retried_on_the_next_flush():
+    state = {"state": "1"}
+    sched, rec = make(state, fail_on={"state"})
+    sched.flush()
+    assert sched.failed == 1
+    assert sched.last_sent("state") is None
+    sched.flush()
+    assert rec.sent == [("state", "1")]
+
+
+def test_stop_flushes_a_pending_request():
+    state = {"state": "1"}
+    sched, rec = make(state, window_s=30)
+    sched.start()
+    sched.request()
+    sched.stop()
+    assert rec.sent == [("state", "1")]
+
+
+def test_flush_reports_the_latency_of_the_oldest_pending_request():
+    latencies = []
+    sched = PublishScheduler(lambda: [("state", "1")], lambda topic, payload: None, on_latency=latencies.append)
+    sched.request(since=time.perf_counter() - 0.5)
+    sched.request(since=time.perf_counter())
+    sched.flush()
+    sched.flush()  # nothing pending any more: no second report
+    assert len(latencies) == 1
+    assert latencies[0] >= 0.5
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import pytest
+import requests
+
+import pushy_client
+from alert_engine import AlertEngine
+from pushy_client import PushyAPIError, PushyClient
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body
+        self.text = "" if body is None else str(body)
+
+    def json(self):
+        if self._body is None:
+            raise ValueError("no JSON body")
+        return self._body
+
+
+class FakeSession:
+    """Stands in for requests.Session; each post() returns (or raises) the next scripted outcome."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def post(self, url, json=None, timeout=None):
+        self.calls.append((url, json))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(pushy_client.time, "sleep", lambda s: None)
+
+
+def client(outcomes, retries=3):
+    c = PushyClient("https://pushy.test/", retries=retries)
+    c.session = FakeSession(outcomes)
+    return c
+
+
+@pytest.mark.parametrize("failure", [
+    FakeResponse(503, {"code": "UNAVAILABLE", "error": "try later"}),
+    FakeResponse(502),
+    requests.Timeout("read timed out"),
+    requests.ConnectionError("connection reset"),
+])
+def test_transient_failures_are_retried(failure):
+    c = client([failure, failure, FakeResponse(200, {"success": True})])
+    assert c.post("/devices/subscribe", {"topics": ["1"]}) == {"success": True}
+    assert len(c.session.calls) == 3
+    stats = c.stats()["/devices/subscribe"]
+    assert (stats["errors"], stats["retries"]) == (2, 2)
+
+
+def test_retries_are_bounded():
+    c = client([requests.Timeout("t")] * 3, retries=2)
+    with pytest.raises(requests.Timeout):
+        c.post("/devices/subscribe", {"topics": ["1"]})
+    assert len(c.session.calls) == 3
+
+
+@pytest.mark.parametrize("status", [400, 401, 404])
+def test_client_errors_are_not_retried(status):
+    c = client([FakeResponse(status, {"code": "BAD", "error": "nope"})])
+    with pytest.raises(PushyAPIError) as exc:
+        c.post("/devices/subscribe", {"topics": ["1"]})
+    assert exc.value.status == status
+    assert not exc.value.retryable
+    assert len(c.session.calls) == 1
+
+
+def test_bypass_status_accepts_a_successful_body():
+    c = client([FakeResponse(400, {"success": True})])
+    assert c.post("/devices/unsubscribe", {"topics": ["1"]}, bypass_status=True) == {"success": True}
+
+
+def test_register_is_never_retried(tmp_path):
+    engine = AlertEngine({"storage_dir": str(tmp_path), "segments": [], "api_host": "https://pushy.test"})
+    try:
+        engine.pushy.session = FakeSession([FakeResponse(503, {"error": "busy"}), FakeResponse(200, {})])
+        with pytest.raises(PushyAPIError):
+            engine.ensure_authenticated()
+        assert [url for url, _ in engine.pushy.session.calls] == ["https://pushy.test/register"]
+        assert not (tmp_path / "token.json").exists()
+    finally:
+        engine._executor.shutdown(wait=False)
+        engine._journal_writer.shutdown(wait=False)
+        engine.loop.close()
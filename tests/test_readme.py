@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""The README's Deploy step must list every local module the app imports."""
+import os
+import re
+import ast
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def local_imports(module, seen=None):
+    seen = set() if seen is None else seen
+    local = {f[:-3] for f in os.listdir(ROOT) if f.endswith(".py")}
+    with open(os.path.join(ROOT, module + ".py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            name = name.split(".")[0]
+            if name in local and name not in seen:
+                seen.add(name)
+                local_imports(name, seen)
+    return seen
+
+
+def deploy_section():
+    with open(os.path.join(ROOT, "README.md"), encoding="utf-8") as f:
+        readme = f.read()
+    return readme[readme.index("3. **Deploy**"):readme.index("4. **MQTT sensors**")]
+
+
+def test_deploy_step_lists_every_module_the_app_imports():
+    listed = set(re.findall(r"(\w+)\.py", deploy_section()))
+    assert local_imports("missile_alerts_app") - listed == set()
+
+
+def test_deploy_step_lists_the_script_modules():
+    listed = set(re.findall(r"(\w+)\.py", deploy_section()))
+    assert local_imports("mqttest") - listed == set()
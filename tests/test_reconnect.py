@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import socket
+import asyncio
+import threading
+
+import pytest
+
+from alert_engine import AlertEngine, IoRefListener
+from reconnect import ReconnectController, candidate_endpoints
+
+
+def closed_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_candidate_endpoints_count_back_from_now():
+    assert candidate_endpoints("mqtt-{timestamp}.ioref.io", now=1000, count=3) == [
+        "mqtt-1000.ioref.io", "mqtt-999.ioref.io", "mqtt-998.ioref.io"]
+
+
+def test_backoff_is_immediate_after_a_drop_and_capped_after_failures():
+    rc = ReconnectController("127.0.0.1", 1, backoff_s=0.5, max_backoff_s=2.0)
+    assert rc.backoff() == 0.0
+    for _ in range(10):
+        rc.on_failure()
+    assert all(0 <= rc.backoff() <= 2.0 for _ in range(50))
+    rc.on_connected()
+    assert rc.backoff() == 0.0
+
+
+def test_probe_returns_the_reachable_host_and_counts_attempts():
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        rc = ReconnectController("127.0.0.1", server.getsockname()[1], timeout=1, candidates=1)
+        assert rc.probe() == "127.0.0.1"
+    assert rc.attempts == 1 and rc.probe_time.count == 1
+
+    rc = ReconnectController("127.0.0.1", closed_port(), timeout=1, candidates=1)
+    with pytest.raises(OSError):
+        rc.probe()
+
+
+def test_engine_backs_off_on_the_loop_and_probes_on_the_executor(tmp_path):
+    engine = AlertEngine({"storage_dir": str(tmp_path), "segments": [], "mqtt_tls": False,
+                          "mqtt_template": "127.0.0.1", "mqtt_port": closed_port(), "reconnect_max_backoff_s": 0.05})
+    rc = engine.reconnect
+    threads = {"backoff": set(), "probe": set()}
+    backoff, probe = rc.backoff, rc.probe
+
+    def recording(name, fn):
+        def call():
+            threads[name].add(threading.current_thread().name)
+            return fn()
+        return call
+
+    rc.backoff, rc.probe = recording("backoff", backoff), recording("probe", probe)
+    listener = IoRefListener(engine, "tok", "auth")
+
+    async def run_briefly():
+        task = asyncio.ensure_future(listener.run())
+        await asyncio.sleep(0.5)
+        listener.stopping = True
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    try:
+        engine.loop.run_until_complete(run_briefly())
+    finally:
+        listener.io.close()
+        engine._executor.shutdown(wait=False)
+        engine._journal_writer.shutdown(wait=False)
+        engine.loop.close()
+    assert rc.failed >= 2  # retried after backing off
+    assert threads["backoff"] == {threading.current_thread().name}
+    assert threads["probe"] and all(name.startswith("AlertEngineIO") for name in threads["probe"])
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import os
+
+from segment_index import SegmentIndex, load_parent_map
+
+HAIFA = "5005025"
+KIRYAT_HAIM = "5001878"
+HAIFA_OTHER = "5001292"
+PARENT_MAP = {KIRYAT_HAIM: HAIFA, HAIFA_OTHER: HAIFA}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_substring_and_prefix_of_an_id_do_not_match():
+    index = SegmentIndex(["500187"])
+    assert not index.match("5001878")
+    assert not index.match("5001870,15001871")
+    assert index.match("5001878,500187") == {"500187"}
+
+
+def test_a_watched_id_inside_a_longer_id_is_rejected_after_the_probe():
+    index = SegmentIndex([KIRYAT_HAIM])
+    assert not index.match("50018789,15001878")
+    assert index.match(f"5000218,{KIRYAT_HAIM}") == {KIRYAT_HAIM}
+
+
+def test_watching_a_parent_matches_and_subscribes_its_children():
+    index = SegmentIndex([HAIFA], PARENT_MAP)
+    assert index.match(KIRYAT_HAIM) == {KIRYAT_HAIM}
+    assert index.match(f"{HAIFA_OTHER},5000218") == {HAIFA_OTHER}
+    assert index.topics() == {HAIFA, KIRYAT_HAIM, HAIFA_OTHER}
+
+
+def test_watching_a_child_matches_its_parent_without_subscribing_to_it():
+    index = SegmentIndex([KIRYAT_HAIM], PARENT_MAP)
+    assert index.match(HAIFA) == {HAIFA}
+    assert not index.match(HAIFA_OTHER)
+    assert index.topics() == {KIRYAT_HAIM}
+
+
+def test_large_watch_lists_skip_the_probe_but_match_exactly():
+    index = SegmentIndex([str(5000000 + i) for i in range(100)])
+    assert index._probe is None
+    assert index.match("5000099,6000000") == {"5000099"}
+    assert not index.match("50000990")
+
+
+def test_parent_map_from_segment_data_links_kiryat_haim_to_haifa():
+    parents = load_parent_map(os.path.join(ROOT, "raw_data", "Segment.json"),
+                              os.path.join(ROOT, "cities.json"))
+    assert parents[KIRYAT_HAIM] == HAIFA
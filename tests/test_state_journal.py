@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import time
+
+from alert_record import AlertRecord
+from state_journal import StateJournal
+
+KEYS = ("selected_areas_active_alerts", "selected_areas_updates")
+ACTIVE, UPDATES = KEYS
+
+
+def record(alert_id, ttl=600):
+    return AlertRecord("2025-06-20 10:00:00", "ירי רקטות וטילים", "חיפה", "1", alert_id, time.time() + ttl, "5001878")
+
+
+def ids(state, key=ACTIVE):
+    return [r.alert_id for r in state[key]]
+
+
+def test_appends_replay_after_a_snapshot(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = StateJournal(path)
+    a, b = record("a"), record("b")
+    assert journal.compact(1, {ACTIVE: [a], UPDATES: []}, force=True)
+    journal.append(2, ACTIVE, UPDATES, [b])
+    journal.close()
+
+    state, version = StateJournal(path).load(KEYS, time.time())
+    assert version == 2
+    assert ids(state) == ["a", "b"]
+
+
+def test_expired_entries_are_dropped_on_replay(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = StateJournal(path)
+    journal.append(1, ACTIVE, None, [record("old", ttl=-1), record("live")])
+    journal.close()
+    state, _ = StateJournal(path).load(KEYS, time.time())
+    assert ids(state) == ["live"]
+
+
+def test_compaction_never_overwrites_a_newer_append(tmp_path):
+    """A snapshot taken before the worker journaled v2 must not replace the file."""
+    path = str(tmp_path / "journal.jsonl")
+    journal = StateJournal(path)
+    a, b = record("a"), record("b")
+    journal.append(1, ACTIVE, None, [a])
+    stale = {ACTIVE: [a], UPDATES: []}   # v1 snapshot taken by the compactor ...
+    journal.append(2, ACTIVE, None, [b])  # ... before this append took the journal lock
+
+    assert not journal.compact(1, stale)
+    assert journal.compact(2, {ACTIVE: [a, b], UPDATES: []})
+    journal.close()
+
+    state, version = StateJournal(path).load(KEYS, time.time())
+    assert (ids(state), version) == (["a", "b"], 2)
+
+
+def test_append_of_a_version_already_in_the_snapshot_is_not_applied_twice(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = StateJournal(path)
+    a = record("a")
+    assert journal.compact(1, {ACTIVE: [a], UPDATES: []}, force=True)  # state already contains v1
+    journal.append(1, ACTIVE, None, [a])
+    journal.close()
+    state, _ = StateJournal(path).load(KEYS, time.time())
+    assert ids(state) == ["a"]
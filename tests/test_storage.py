@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+import pytest
+
+import storage
+from storage import SCHEMA_VERSION, TMP_PREFIX, Storage, StorageError, atomic_write
+
+
+def test_missing_file_reads_as_empty(tmp_path):
+    assert Storage(str(tmp_path)).load("token.json") == {}
+    assert Storage(str(tmp_path)).load_text("android_id.txt") is None
+
+
+@pytest.mark.parametrize("content", ['{"schema": 1, "data": {"tok', "", "[1, 2]", '{"schema": 99, "data": {}}'])
+def test_corrupt_file_raises_instead_of_reading_as_empty(tmp_path, content):
+    (tmp_path / "token.json").write_text(content, encoding="utf-8")
+    with pytest.raises(StorageError):
+        Storage(str(tmp_path)).load("token.json")
+
+
+def test_legacy_bare_object_is_read_and_upgraded_on_save(tmp_path):
+    path = tmp_path / "token.json"
+    path.write_text(json.dumps({"token": "t", "auth": "a"}), encoding="utf-8")
+    store = Storage(str(tmp_path))
+    creds = store.load("token.json")
+    assert creds == {"token": "t", "auth": "a"}
+
+    store.save("token.json", creds)
+    assert json.loads(path.read_text(encoding="utf-8")) == {"schema": SCHEMA_VERSION, "data": creds}
+    assert Storage(str(tmp_path)).load("token.json") == creds
+
+
+def test_save_round_trips_through_a_fresh_instance(tmp_path):
+    Storage(str(tmp_path)).save("subs.json", {"topics": ["5001878"]})
+    Storage(str(tmp_path)).save_text("android_id.txt", "abc-Xiaomi\n")
+    fresh = Storage(str(tmp_path))
+    assert fresh.load("subs.json") == {"topics": ["5001878"]}
+    assert fresh.load_text("android_id.txt") == "abc-Xiaomi"
+
+
+def test_atomic_write_renames_a_synced_temp_file_over_the_target(tmp_path, monkeypatch):
+    target = tmp_path / "token.json"
+    target.write_text("old", encoding="utf-8")
+    renames = []
+    real_replace = os.replace
+
+    def replace(src, dst):
+        assert os.path.basename(src).startswith(TMP_PREFIX)
+        assert os.path.dirname(src) == str(tmp_path)
+        assert target.read_text(encoding="utf-8") == "old"  # target untouched until the rename
+        renames.append(dst)
+        real_replace(src, dst)
+
+    monkeypatch.setattr(storage.os, "replace", replace)
+    atomic_write(str(target), "new")
+    assert renames == [str(target)]
+    assert target.read_text(encoding="utf-8") == "new"
+    assert os.listdir(tmp_path) == ["token.json"]
+
+
+def test_failed_write_keeps_the_old_file_and_removes_the_temp_file(tmp_path, monkeypatch):
+    target = tmp_path / "token.json"
+    target.write_text("old", encoding="utf-8")
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(storage.os, "replace", fail)
+    with pytest.raises(OSError):
+        atomic_write(str(target), "new")
+    assert target.read_text(encoding="utf-8") == "old"
+    assert os.listdir(tmp_path) == ["token.json"]
+
+
+def test_stale_temp_files_are_removed_on_startup(tmp_path):
+    (tmp_path / f"{TMP_PREFIX}abc").write_text("half a write", encoding="utf-8")
+    Storage(str(tmp_path))
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from subscriptions import SubscriptionReconciler, chunked
+
+
+class FakePushy:
+    """Records /devices/* calls; `fail` maps a topic to how many calls containing it fail."""
+
+    def __init__(self, fail=None):
+        self.fail = dict(fail or {})
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def post(self, path, payload, *, bypass_status=False):
+        topics = payload["topics"]
+        with self._lock:
+            self.calls.append((path, sorted(topics)))
+            for topic in topics:
+                if self.fail.get(topic, 0) > 0:
+                    self.fail[topic] -= 1
+                    return {"success": False, "error": f"rejected {topic}"}
+        return {"success": True}
+
+
+class MemoryStore:
+    def __init__(self, data=None):
+        self.files = {"subs.json": data} if data is not None else {}
+
+    def load(self, path):
+        return dict(self.files.get(path) or {})
+
+    def save(self, path, data):
+        self.files[path] = data
+
+
+def reconciler(client, store, batch_size=2):
+    return SubscriptionReconciler(client, "tok", "auth", "subs.json", load_json=store.load, save_json=store.save,
+                                  batch_size=batch_size, concurrency=3)
+
+
+def test_chunked_is_sorted_and_bounded():
+    assert chunked({"3", "1", "2"}, 2) == [["1", "2"], ["3"]]
+
+
+def test_first_run_dances_then_subscribes_everything():
+    client, store = FakePushy(), MemoryStore()
+    result = reconciler(client, store).reconcile({"a", "b", "c"})
+    assert client.calls[:2] == [("/devices/subscribe", ["1"]), ("/devices/unsubscribe", ["1"])]
+    assert result == {"subscribed": 3, "unsubscribed": 0, "failed": 0, "in_sync": True}
+    assert store.files["subs.json"] == {"topics": ["a", "b", "c"], "dance_done": True}
+
+
+def test_no_changes_makes_no_calls():
+    client = FakePushy()
+    store = MemoryStore({"topics": ["a", "b"], "dance_done": True})
+    result = reconciler(client, store).reconcile({"b", "a"})
+    assert client.calls == []
+    assert result["in_sync"]
+
+
+def test_only_the_diff_is_sent():
+    client = FakePushy()
+    store = MemoryStore({"topics": ["a", "b", "old"], "dance_done": True})
+    result = reconciler(client, store).reconcile({"a", "b", "new"})
+    assert sorted(client.calls) == [("/devices/subscribe", ["new"]), ("/devices/unsubscribe", ["old"])]
+    assert result == {"subscribed": 1, "unsubscribed": 1, "failed": 0, "in_sync": True}
+    assert store.files["subs.json"]["topics"] == ["a", "b", "new"]
+
+
+def test_a_batch_failing_once_is_retried():
+    client = FakePushy(fail={"c": 1})
+    store = MemoryStore({"topics": [], "dance_done": True})
+    result = reconciler(client, store).reconcile({"a", "b", "c", "d"})
+    assert result == {"subscribed": 4, "unsubscribed": 0, "failed": 0, "in_sync": True}
+    assert client.calls.count(("/devices/subscribe", ["c", "d"])) == 2
+
+
+def test_partial_subscribe_failure_keeps_progress_and_resumes():
+    client = FakePushy(fail={"c": 2})  # fails the batch and its retry
+    store = MemoryStore({"topics": [], "dance_done": True})
+    result = reconciler(client, store).reconcile({"a", "b", "c", "d"})
+    assert result == {"subscribed": 2, "unsubscribed": 0, "failed": 2, "in_sync": False}
+    assert store.files["subs.json"]["topics"] == ["a", "b"]  # only the confirmed batch is recorded
+
+    client = FakePushy()
+    result = reconciler(client, store).reconcile({"a", "b", "c", "d"})
+    assert client.calls == [("/devices/subscribe", ["c", "d"])]
+    assert result["in_sync"]
+
+
+def test_failed_unsubscribe_stays_recorded():
+    client = FakePushy(fail={"x": 2})
+    store = MemoryStore({"topics": ["a", "x", "y", "z"], "dance_done": True})
+    result = reconciler(client, store, batch_size=1).reconcile({"a"})
+    assert result == {"subscribed": 0, "unsubscribed": 2, "failed": 1, "in_sync": False}
+    assert store.files["subs.json"]["topics"] == ["a", "x"]
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from title_classifier import (ACTIVE_THREAT, ALL_CLEAR, DRILL, EARLY_WARNING, OTHER, TitleClassifier,
+                              load_titles, normalize_title)
+
+TITLES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "titles.json")
+
+# Every title in titles.json; a new title must be added here with the category it should get
+EXPECTED = {
+    "אירוע במרחב המרכז למחקר גרעיני - היכנסו למבנה": ACTIVE_THREAT,
+    "אירוע במרחב המרכז למחקר גרעיני בשורק – ניתן לצאת ממבנים": ALL_CLEAR,
+    "אירוע במרחב הקרייה למחקר גרעיני - היכנסו למבנה": ACTIVE_THREAT,
+    "אירוע במרחב- הקרייה למחקר גרעיני - אין הנחיות מיוחדות לציבור": OTHER,
+    "אירוע במרחב-____ (קמ\"ג/ממ\"ג) - אין הנחיות מיוחדות לציבור": OTHER,
+    "אירוע במרחב-המרכז למחקר גרעיני - אין הנחיות מיוחדות לציבור": OTHER,
+    "אירוע בקריה למחקר גרעיני - הנחיות התפנות": ACTIVE_THREAT,
+    "אירוע בקריה למחקר גרעיני - ניתן לחזור לבתים": ALL_CLEAR,
+    "אירוע בקריה למחקר גרעיני בנגב – ניתן לצאת ממבנים": ALL_CLEAR,
+    "אירוע חומרים מסוכנים": ACTIVE_THREAT,
+    "אירוע חומרים מסוכנים - המשך שהייה במבנה": ACTIVE_THREAT,
+    "אירוע חומרים מסוכנים - הנחיות לפינוי": ACTIVE_THREAT,
+    "אירוע חומרים מסוכנים - הסכנה באזורכם חלפה": ALL_CLEAR,
+    "אירוע צונמי - אין לשוב לחופי הים": ACTIVE_THREAT,
+    "בדיקה בדיקה בדיקה": OTHER,
+    "בדקות הקרובות צפויות להתקבל התרעות באזורך": EARLY_WARNING,
+    "בעקבות רעידת האדמה - הנחיות לחזרה למבנים": ALL_CLEAR,
+    "בעקבות רעידת האדמה - יש להמשיך ולשהות בשטח פתוח": ACTIVE_THREAT,
+    "הודעה שקטה": OTHER,
+    "היכנסו מייד למרחב המוגן": ACTIVE_THREAT,
+    "המשיכו לשהות בסמיכות למרחב המוגן": EARLY_WARNING,
+    "הנחיות בעקבות רעידת האדמה": OTHER,
+    "הסתיים אירוע חדירת מחבלים - ניתן לצאת מהבתים": ALL_CLEAR,
+    "התרעה על צונמי - ניתן לחזור לשגרה": ALL_CLEAR,
+    "התרעה על רעידת אדמה - ניתן לחזור לשגרה": ALL_CLEAR,
+    "התרעה על רעידת אדמה בדרום הארץ - ניתן לחזור לשגרה": ALL_CLEAR,
+    "התרעה על רעידת אדמה במרכז הארץ - ניתן לחזור לשגרה": ALL_CLEAR,
+    "התרעה על רעידת אדמה בצפון הארץ - ניתן לחזור לשגרה": ALL_CLEAR,
+    "התרעה על רעידת אדמה ברחבי הארץ - ניתן לחזור לשגרה": ALL_CLEAR,
+    "חדירת כלי טיס עוין": ACTIVE_THREAT,
+    "חדירת כלי טיס עוין - האירוע הסתיים": ALL_CLEAR,
+    "חדירת מחבלים": ACTIVE_THREAT,
+    "חדירת מחבלים -  החשש הוסר": ALL_CLEAR,
+    "חדירת מחבלים - אין לצאת מהמרחב המוגן": ACTIVE_THREAT,
+    "חומרים מסוכנים - האירוע הסתיים": ALL_CLEAR,
+    "חשש לאירוע חדירת מחבלים": ACTIVE_THREAT,
+    "חשש לאירוע חומרים מסוכנים": ACTIVE_THREAT,
+    "חשש לאירוע כימי": ACTIVE_THREAT,
+    "חשש לאירוע רדיולוגי": ACTIVE_THREAT,
+    "חשש לחדירת כלי טייס בלתי מאויש": ACTIVE_THREAT,
+    "חשש לצונאמי": ACTIVE_THREAT,
+    "חשש לצונמי": ACTIVE_THREAT,
+    "ים של דמעות": OTHER,
+    "ירי רקטות וטילים": ACTIVE_THREAT,
+    "ירי רקטות וטילים - האירוע הסתיים": ALL_CLEAR,
+    "יש להישמע להנחיות פיקוד העורף": OTHER,
+    "יש להמשיך לשהות במרחב המוגן": ACTIVE_THREAT,
+    "יש לשהות בסמיכות למרחב המוגן": EARLY_WARNING,
+    "ניתן לצאת מהמרחב המוגן": ALL_CLEAR,
+    "ניתן לצאת מהמרחב המוגן אך יש להישאר בקרבתו": EARLY_WARNING,
+    "סיום שהייה בסמיכות למרחב מוגן": ALL_CLEAR,
+    "סכנת פיצוץ והדף חזק - היכנסו מייד למרחב המוגן": ACTIVE_THREAT,
+    "סכנת פיצוץ והדף חזק - הסתיים האירוע": ALL_CLEAR,
+    "סכנת פיצוץ והדף חזק - יש להמשיך לשהות במרחב המוגן": ACTIVE_THREAT,
+    "רעידת אדמה": ACTIVE_THREAT,
+    "רענון ההנחיות בעקבות רעידת אדמה שהתרחשה בישראל": OTHER,
+    "שהייה בסמיכות למרחב מוגן": EARLY_WARNING,
+    "ששש": OTHER,
+    "תרגיל -  רעידת אדמה": DRILL,
+    "תרגיל - אירוע כימי": DRILL,
+    "תרגיל - אירוע רדיולוגי": DRILL,
+    "תרגיל - חדירת כלי טייס בלתי מאויש": DRILL,
+    "תרגיל - רעידת אדמה": DRILL,
+    "תרגיל חדירת מחבלים": DRILL,
+    "תרגיל חומרים מסוכנים": DRILL,
+    "תרגיל ירי רקטות וטילים": DRILL,
+    "תרגיל מוסדות חינוך": DRILL,
+    "תרגיל צונאמי": DRILL,
+    "תרגיל רעידת אדמה": DRILL,
+}
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return TitleClassifier.from_file(TITLES_FILE)
+
+
+def test_every_title_in_titles_json_has_an_expected_category():
+    assert {title for title, _ in load_titles(TITLES_FILE)} == set(EXPECTED)
+
+
+@pytest.mark.parametrize("title", sorted(EXPECTED))
+def test_title_maps_to_its_expected_category(classifier, title):
+    assert classifier.classify(title) == EXPECTED[title]
+
+
+@pytest.mark.parametrize("title", [t for t in sorted(EXPECTED) if " - " in t])
+@pytest.mark.parametrize("dash", ["-", " -", "- ", "  -  ", " – ", " — ", "\u2011", " \u2212 "])
+def test_dash_variants_give_the_same_category(classifier, title, dash):
+    variant = title.replace(" - ", dash)
+    assert normalize_title(variant) == normalize_title(title)
+    assert classifier.classify(variant) == EXPECTED[title]
+
+
+@pytest.mark.parametrize("title", sorted(EXPECTED))
+def test_whitespace_variants_give_the_same_category(classifier, title):
+    variant = "  " + title.replace(" ", " \t ") + "\n"
+    assert classifier.classify(variant) == EXPECTED[title]
+
+
+def test_unknown_title_falls_back_to_the_msg_id_listed_in_titles_json(classifier):
+    assert classifier.classify("כותרת חדשה", "372349") == ALL_CLEAR   # חדירת כלי טיס עוין - האירוע הסתיים
+    assert classifier.classify("כותרת חדשה", "21988") == ACTIVE_THREAT  # חדירת כלי טיס עוין
+    assert classifier.classify("כותרת חדשה", "372323") == EARLY_WARNING
+    assert classifier.classify("כותרת חדשה", "999999") == OTHER
+    assert classifier.classify("כותרת חדשה") == OTHER
+
+
+def test_title_rules_win_over_the_msg_id(classifier):
+    assert classifier.classify("ירי רקטות וטילים", "372349") == ACTIVE_THREAT
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import json
+
+from alert_record import AlertRecord
+from topic_router import ACTIVE_KEY, UPDATES_KEY, OutputGroup, TopicRouter, parse_groups
+
+HAIFA = "5005025"
+KIRYAT_HAIM = "5001878"
+KIRYAT_MOTZKIN = "5001347"
+TEL_AVIV = "5000218"
+PARENT_MAP = {KIRYAT_HAIM: HAIFA}
+
+
+def record(segment, alert_id="a1", title="ירי רקטות וטילים"):
+    return AlertRecord("2025-06-20 10:00:00", title, segment, "0", alert_id, None, segment)
+
+
+def router():
+    # "bay" and "haifa" overlap on Kiryat Haim; "center" is disjoint from both
+    return TopicRouter([
+        OutputGroup("bay", [KIRYAT_HAIM, KIRYAT_MOTZKIN], "missile_alerts/bay"),
+        OutputGroup("haifa", [HAIFA], "missile_alerts/haifa"),
+        OutputGroup("center", [TEL_AVIV], "missile_alerts/center"),
+    ], PARENT_MAP)
+
+
+def payloads(r):
+    return {topic: payload for topic, payload in r.render()}
+
+
+def test_a_segment_shared_by_two_groups_reaches_both():
+    r = router()
+    assert sorted(r.route([record(KIRYAT_HAIM)], ACTIVE_KEY)) == [0, 1]  # "haifa" via the parent
+    out = payloads(r)
+    assert out["missile_alerts/bay"] == "1"
+    assert out["missile_alerts/haifa"] == "1"
+    assert out["missile_alerts/center"] == "0"
+
+
+def test_route_only_touches_the_groups_it_hits():
+    r = router()
+    assert r.route([record(KIRYAT_MOTZKIN)], ACTIVE_KEY) == (0,)
+    assert r.route([record(TEL_AVIV, "a2")], ACTIVE_KEY) == (2,)
+    assert r.route([record("9999999", "a3")], ACTIVE_KEY) == ()
+    assert payloads(r)["missile_alerts/haifa"] == "0"
+
+
+def test_clear_only_empties_the_lists_of_groups_that_were_hit():
+    r = router()
+    r.route([record(KIRYAT_HAIM), record(TEL_AVIV)], ACTIVE_KEY)
+    r.route([record(KIRYAT_MOTZKIN, "a2", "ניתן לצאת מהמרחב המוגן")], UPDATES_KEY, clear=ACTIVE_KEY)
+    out = payloads(r)
+    assert out["missile_alerts/bay"] == "0"
+    assert json.loads(out["missile_alerts/bay_attr"])[UPDATES_KEY][0]["id"] == "a2"
+    assert out["missile_alerts/haifa"] == "1"
+    assert out["missile_alerts/center"] == "1"
+
+
+def test_remove_drops_the_record_from_every_group_holding_it():
+    r = router()
+    shared = record(KIRYAT_HAIM)
+    r.route([shared, record(KIRYAT_MOTZKIN, "a2")], ACTIVE_KEY)
+    assert sorted(r.remove([shared])) == [0, 1]
+    out = payloads(r)
+    assert out["missile_alerts/bay"] == "1"  # still holds Kiryat Motzkin
+    assert out["missile_alerts/haifa"] == "0"
+    assert r.remove([shared]) == ()  # already gone: no group changes
+
+
+def test_render_only_reserializes_groups_whose_version_changed():
+    r = router()
+    first = r.render()
+    assert r.renders == 3
+    assert r.render() == first
+    assert r.renders == 3
+
+    r.route([record(TEL_AVIV)], ACTIVE_KEY)
+    second = dict(r.render())
+    assert r.renders == 4
+    assert second["missile_alerts/center"] == "1"
+    assert second["missile_alerts/bay_attr"] is dict(first)["missile_alerts/bay_attr"]  # cached object reused
+
+    r.remove([record(TEL_AVIV, "other")])  # nothing removed: no version bump, no render
+    r.render()
+    assert r.renders == 4
+
+
+def test_parse_groups_accepts_names_lists_and_dicts():
+    groups = parse_groups({
+        KIRYAT_HAIM: None,
+        "bay": [KIRYAT_HAIM, KIRYAT_MOTZKIN],
+        "center": {"segments": TEL_AVIV, "state_topic": "ha/center"},
+        "empty": [],
+    }, resolve=lambda segs: {str(s) for s in segs if s != "empty"})
+    assert [(g.name, g.state_topic, g.attr_topic) for g in groups] == [
+        (KIRYAT_HAIM, f"missile_alerts/{KIRYAT_HAIM}", f"missile_alerts/{KIRYAT_HAIM}_attr"),
+        ("bay", "missile_alerts/bay", "missile_alerts/bay_attr"),
+        ("center", "ha/center", "ha/center_attr"),
+    ]
+    assert groups[1].segments == {KIRYAT_HAIM, KIRYAT_MOTZKIN}
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+title_classifier.py
+
+Alert title classifier, shared by missile_alerts_app.py and mqttest.py.
+
+Replaces the hardcoded two-title `is_real` set. Every title in titles.json is
+classified once at startup (by the keyword rules below) into a lookup table,
+so a message costs one dict lookup on its raw title. Titles that miss (new
+wording, different dash or extra whitespace) are normalised and looked up
+again, then classified by the same rules and cached; when the rules cannot
+tell, the message `msgId` is looked up in the `ids` listed for each title in
+titles.json.
+
+Categories:
+    active_threat  - go to / stay in the protected space (rockets, hostile
+                     aircraft, infiltration, earthquake, hazmat, ...)
+    all_clear      - the event ended / you may leave the protected space
+    early_warning  - alerts are expected soon / stay near the protected space
+                     (including "you may leave, but stay close to it")
+    drill          - "תרגיל ..." titles
+    other          - tests, general guidance and anything unrecognised
+"""
+
+import os
+import re
+import json
+import logging
+
+ACTIVE_THREAT = "active_threat"
+ALL_CLEAR = "all_clear"
+EARLY_WARNING = "early_warning"
+DRILL = "drill"
+OTHER = "other"
+
+# Checked in this order; the first category with a matching phrase wins.
+_RULES = (
+    (DRILL, ("תרגיל",)),
+    (OTHER, ("בדיקה", "הודעה שקטה", "אין הנחיות מיוחדות", "רענון ההנחיות", "הנחיות בעקבות",
+             "יש להישמע להנחיות")),
+    (EARLY_WARNING, ("להישאר בקרבת",)),  # "ניתן לצאת ... אך יש להישאר בקרבתו" is not an all-clear
+    (ALL_CLEAR, ("הסתיים", "החשש הוסר", "ניתן לצאת", "ניתן לחזור", "חלפה", "סיום שהייה", "הנחיות לחזרה")),
+    (EARLY_WARNING, ("בדקות הקרובות", "בסמיכות למרחב")),
+    (ACTIVE_THREAT, ("ירי רקטות", "כלי טיס", "כלי טייס", "מחבלים", "היכנסו", "רעידת אדמה", "רעידת האדמה",
+                     "צונמי", "צונאמי", "חומרים מסוכנים", "כימי", "רדיולוגי", "פיצוץ", "המשך שהייה",
+                     "להמשיך לשהות", "אין לצאת", "התפנות", "פינוי")),
+)
+
+_DASHES = re.compile(r"\s*[-‐-―−]+\s*")
+_SPACES = re.compile(r"\s+")
+
+MAX_LEARNED = 1024  # Cap for titles classified at runtime
+
+
+def normalize_title(title):
+    """Collapses whitespace and unifies dash variants to " - "."""
+    title = _SPACES.sub(" ", title).strip()
+    return _DASHES.sub(" - ", title)
+
+
+def classify_by_rules(title):
+    """Keyword classification of a normalised title; None if no rule matches."""
+    for category, phrases in _RULES:
+        for phrase in phrases:
+            if phrase in title:
+                return category
+    return None
+
+
+def load_titles(titles_file, logger=None):
+    """
+    Returns [(title, msg_ids)] from titles.json, where msg_ids are the Pushy
+    `msgId` values sent with that title (empty if the file is missing).
+    """
+    logger = logger or logging.getLogger("missile_alerts")
+    if not titles_file or not os.path.exists(titles_file):
+        logger.warning(f"Titles file {titles_file} not found; classifying titles by rules only")
+        return []
+    with open(titles_file, "r", encoding="utf-8") as f:
+        return [(row["title"], tuple(i.strip() for i in str(row.get("ids", "")).split(",") if i.strip()))
+                for row in json.load(f) if row.get("title")]
+
+
+class TitleClassifier:
+    def __init__(self, titles=()):
+        """titles: (title, msg_ids) pairs, as returned by load_titles()."""
+        self._by_title = {}       # raw title -> category
+        self._by_normalized = {}  # normalised title -> category (None: rules could not tell)
+        self._by_msg_id = {}      # msgId -> category of the title it is listed under
+        for title, msg_ids in titles:
+            norm = normalize_title(title)
+            category = classify_by_rules(norm)
+            self._by_normalized[norm] = category
+            if category is not None:
+                self._by_title[title] = category
+                self._by_msg_id.update(dict.fromkeys(msg_ids, category))
+        self._capacity = len(self._by_normalized) + MAX_LEARNED
+
+    @classmethod
+    def from_file(cls, titles_file, logger=None):
+        return cls(load_titles(titles_file, logger))
+
+    def classify(self, title, msg_id=None):
+        """Returns the category of an alert title (with its `msgId` as a tie-breaker)."""
+        category = self._by_title.get(title)
+        if category is not None:
+            return category
+
+        norm = normalize_title(title or "")
+        try:
+            category = self._by_normalized[norm]
+        except KeyError:
+            category = classify_by_rules(norm)
+            if len(self._by_normalized) < self._capacity:
+                self._by_normalized[norm] = category
+        if category is not None:
+            if len(self._by_title) < self._capacity:
+                self._by_title[title] = category  # the raw variant hits the fast path next time
+            return category
+        return self._by_msg_id.get(str(msg_id), OTHER) if msg_id is not None else OTHER
+
+    def __len__(self):
+        return len(self._by_normalized)
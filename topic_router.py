@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+topic_router.py
+
+Per-segment / per-group output topics, shared by missile_alerts_app.py and
+mqttest.py.
+
+Besides the combined STATE_TOPIC/ATTR_TOPIC sensor (which covers every
+watched segment), any number of output groups - a single city, a
+neighbourhood, a whole region - can be configured, each with its own
+state/attributes topic pair:
+
+    groups:
+      "5001878":                                  # → missile_alerts/5001878 (+ _attr)
+      haifa_bay:
+        segments: ["חיפה", "קריית מוצקין", "קריית ביאליק"]
+        state_topic: "missile_alerts/haifa_bay"   # attr_topic defaults to <state_topic>_attr
+
+Each group behaves like a separate app instance watching only its own
+segments: an alert adds entries to (and clears lists of) only the groups it
+hits. The segment → groups table is built once (after parent/child
+expansion), so routing an alert costs one dict lookup per hit segment, not
+per group. Every group keeps a version and a cached rendering; a flush only
+re-serializes the groups that changed, and the publish scheduler skips the
+unchanged payloads, so one process can serve dozens of sensors.
+"""
+
+import logging
+import threading
+from collections import defaultdict
+
+from alert_record import serialize_state
+from segment_index import SegmentIndex
+
+ACTIVE_KEY = "selected_areas_active_alerts"
+UPDATES_KEY = "selected_areas_updates"
+STATE_KEYS = (ACTIVE_KEY, UPDATES_KEY)
+
+
+class OutputGroup:
+    __slots__ = ("name", "segments", "state_topic", "attr_topic")
+
+    def __init__(self, name, segments, state_topic, attr_topic=None):
+        self.name = name
+        self.segments = frozenset(str(s) for s in segments)
+        self.state_topic = state_topic
+        self.attr_topic = attr_topic or f"{state_topic}_attr"
+
+    def __repr__(self):
+        return f"OutputGroup({self.name!r}, {sorted(self.segments)}, {self.state_topic!r})"
+
+
+def parse_groups(config, topic_prefix="missile_alerts", resolve=None, logger=None):
+    """
+    Builds OutputGroups from the `groups` config: name -> None (the name is the
+    segment), a list of segments, or {segments, state_topic, attr_topic}.
+    `resolve(segments)` turns ids/names into ids (CityRegistry.resolve).
+    """
+    logger = logger or logging.getLogger("missile_alerts")
+    groups = []
+    for name, spec in (config or {}).items():
+        name = str(name)
+        if isinstance(spec, dict):
+            segments = spec.get("segments") or [name]
+            state_topic = spec.get("state_topic") or f"{topic_prefix}/{name}"
+            attr_topic = spec.get("attr_topic")
+        else:
+            segments = spec or [name]
+            state_topic = f"{topic_prefix}/{name}"
+            attr_topic = None
+        if isinstance(segments, (str, int)):
+            segments = [segments]
+        ids = resolve(segments) if resolve else {str(s) for s in segments}
+        if not ids:
+            logger.error(f"Output group '{name}' has no known segments; skipping it")
+            continue
+        groups.append(OutputGroup(name, ids, state_topic, attr_topic))
+    return groups
+
+
+class TopicRouter:
+    def __init__(self, groups, parent_map=None, *, logger=None):
+        """parent_map: {child_id: parent_id}, the same expansion the main SegmentIndex uses."""
+        self.groups = tuple(groups)
+        self.logger = logger or logging.getLogger("missile_alerts")
+
+        groups_of = defaultdict(list)
+        for i, group in enumerate(self.groups):
+            for seg in SegmentIndex(group.segments, parent_map).expanded:
+                groups_of[seg].append(i)
+        self._groups_of = {seg: tuple(idx) for seg, idx in groups_of.items()}
+
+        # Copy-on-write like the combined state: lists are never mutated once installed
+        self._lock = threading.Lock()
+        self._states = [{key: [] for key in STATE_KEYS} for _ in self.groups]
+        self._versions = [0] * len(self.groups)
+        self._rendered = [(None, ())] * len(self.groups)  # (version, payloads) per group
+
+        self.routed = 0
+        self.renders = 0
+
+    def segments(self):
+        """Every segment id used by a group (to be watched and subscribed)."""
+        out = set()
+        for group in self.groups:
+            out.update(group.segments)
+        return out
+
+    def _by_group(self, records):
+        by_group = {}
+        groups_of = self._groups_of
+        for record in records:
+            for i in groups_of.get(record.segment, ()):
+                by_group.setdefault(i, []).append(record)
+        return by_group
+
+    # ─── STATE UPDATES ──────────────────────────────────────────────────────
+
+    def route(self, records, key, clear=None):
+        """
+        Adds `records` (AlertRecords carrying their segment id) to `key` of the
+        groups they belong to, after clearing `clear` in those groups.
+        Returns the indexes of the groups that changed.
+        """
+        if not self._groups_of:
+            return ()
+        by_group = self._by_group(records)
+        if not by_group:
+            return ()
+        with self._lock:
+            for i, recs in by_group.items():
+                state = dict(self._states[i])
+                state[key] = state[key] + recs
+                if clear:
+                    state[clear] = []
+                self._states[i] = state
+                self._versions[i] += 1
+        self.routed += 1
+        return tuple(by_group)
+
+    def remove(self, records):
+        """Drops expired `records` from every group; returns the indexes of the groups that changed."""
+        by_group = self._by_group(records)
+        changed = []
+        with self._lock:
+            for i, recs in by_group.items():
+                gone = {id(r) for r in recs}
+                state = {key: [r for r in items if id(r) not in gone] for key, items in self._states[i].items()}
+                if sum(map(len, state.values())) < sum(map(len, self._states[i].values())):
+                    self._states[i] = state
+                    self._versions[i] += 1
+                    changed.append(i)
+        return tuple(changed)
+
+    def load(self, state):
+        """Rebuilds the group states from a restored combined state (after a restart)."""
+        states = [{key: [] for key in STATE_KEYS} for _ in self.groups]
+        for key, records in state.items():
+            for i, recs in self._by_group(records).items():
+                states[i][key] = recs
+        with self._lock:
+            self._states = states
+            self._versions = [v + 1 for v in self._versions]
+
+    # ─── RENDERING ──────────────────────────────────────────────────────────
+
+    def state_topics(self, indexes):
+        return [self.groups[i].state_topic for i in indexes]
+
+    def render(self):
+        """(topic, payload) pairs for every group; unchanged groups reuse their cached payloads."""
+        with self._lock:
+            snapshot = list(zip(self._states, self._versions))
+        out = []
+        for i, (state, version) in enumerate(snapshot):
+            rendered_version, payloads = self._rendered[i]
+            if rendered_version != version:
+                group = self.groups[i]
+                payloads = ((group.attr_topic, serialize_state(state)),
+                            (group.state_topic, "1" if state[ACTIVE_KEY] else "0"))
+                self._rendered[i] = (version, payloads)
+                self.renders += 1
+            out.extend(payloads)
+        return out
+
+    def stats(self):
+        return {"groups": len(self.groups), "segments": len(self._groups_of),
+                "routed": self.routed, "renders": self.renders}
+
+    def __len__(self):
+        return len(self.groups)